@@ -1,4 +1,5 @@
 import os
+import re
 import asyncio
 from typing import Annotated, List
 
@@ -7,23 +8,24 @@ from langchain_core.tools import tool
 from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
-from langchain_openai import ChatOpenAI
-from pydantic import SecretStr
 
-from load_env import *
+from models import get_chat_model
+from file_cache import file_cache
+from tracing import instrument
+from profiling import ReplProfiler
+from file_search import format_result, search_tree, start_pool
+from file_outline import file_outline as build_outline
+from file_pager import DEFAULT_PAGE_BYTES, FULL_READ_LIMIT, format_page, read_byte_range, read_line_range
 
 # Configure the base chat model. Temperature kept low for determinism.
-BASE_MODEL = ChatOpenAI(
-    api_key=SecretStr(API_KEY),
-    base_url=BASE_URL,
-    model="gpt-5.1",
-    temperature=0.2,
-)
+# Set FAKE_LLM to run against the offline scripted model instead.
+BASE_MODEL = get_chat_model(model="gpt-5.1", temperature=0.2)
 
 
-@tool("list_dir")
-def list_dir(path: str = ".") -> str:
-    """List the files and folders inside a directory."""
+# The file helpers below are plain sync functions; the tools run them via
+# asyncio.to_thread so a slow disk read never blocks the event loop that is
+# streaming tokens for this (or another) conversation.
+def _list_dir(path: str) -> str:
     target = os.path.abspath(path)
     if not os.path.exists(target):
         return f"Path not found: {target}"
@@ -36,29 +38,98 @@ def list_dir(path: str = ".") -> str:
     return "\n".join(entries)
 
 
-@tool("read_file")
-def read_file(path: str) -> str:
-    """Read a text file and return its contents (truncated to 4000 characters)."""
+def _read_file(path: str) -> str:
     target = os.path.abspath(path)
     if not os.path.exists(target):
         return f"File not found: {target}"
     if not os.path.isfile(target):
         return f"Not a file: {target}"
     try:
-        with open(target, "r", encoding="utf-8", errors="ignore") as file:
-            data = file.read(4000)
+        if os.path.getsize(target) > FULL_READ_LIMIT:
+            # Large files: map only the first page and keep them out of the cache
+            return read_byte_range(target, 0, DEFAULT_PAGE_BYTES).text[:4000]
+        entry = file_cache.get(target)
+    except OSError as exc:
+        return f"Error reading file {target}: {exc}"
+    return file_cache.render(entry, "analyzer_bot.read_file", lambda e: e.decode_lossy()[:4000])
+
+
+def _read_file_page(path: str, offset: int, length: int, start_line: int, end_line: int) -> str:
+    target = os.path.abspath(path)
+    if not os.path.isfile(target):
+        return f"Not a file: {target}"
+    try:
+        if start_line > 0:
+            page = read_line_range(target, start_line, end_line)
+        else:
+            page = read_byte_range(target, offset, length)
+    except (OSError, ValueError) as exc:
+        return f"Error reading file {target}: {exc}"
+    return format_page(page)
+
+
+def _search_files(query: str, path: str, regex: bool, pattern: str) -> str:
+    target = os.path.abspath(path)
+    if not os.path.isdir(target):
+        return f"Not a directory: {target}"
+    try:
+        return format_result(search_tree(target, query, regex=regex, pattern=pattern))
+    except re.error as exc:
+        return f"Invalid regex {query!r}: {exc}"
+    except OSError as exc:
+        return f"Error searching {target}: {exc}"
+
+
+def _file_outline(path: str) -> str:
+    target = os.path.abspath(path)
+    if not os.path.isfile(target):
+        return f"Not a file: {target}"
+    try:
+        return build_outline(target)
+    except ValueError as exc:
+        return f"{exc}; use read_file instead"
     except OSError as exc:
         return f"Error reading file {target}: {exc}"
-    return data
 
 
-tools = [list_dir, read_file]
+@tool("list_dir")
+async def list_dir(path: str = ".") -> str:
+    """List the files and folders inside a directory."""
+    return await asyncio.to_thread(_list_dir, path)
+
+
+@tool("read_file")
+async def read_file(path: str) -> str:
+    """Read a text file and return its contents (truncated to 4000 characters, use read_file_page for more)."""
+    return await asyncio.to_thread(_read_file, path)
+
+
+@tool("read_file_page")
+async def read_file_page(path: str, offset: int = 0, length: int = DEFAULT_PAGE_BYTES,
+                         start_line: int = 0, end_line: int = 0) -> str:
+    """Read a slice of a file: bytes from offset, or lines start_line..end_line when start_line > 0."""
+    return await asyncio.to_thread(_read_file_page, path, offset, length, start_line, end_line)
+
+
+@tool("search_files")
+async def search_files(query: str, path: str = ".", regex: bool = False, pattern: str = "") -> str:
+    """Find the lines containing query (literal, or a regex if regex=True) in files under path; pattern is a file-name glob."""
+    return await asyncio.to_thread(_search_files, query, path, regex, pattern)
+
+
+@tool("file_outline")
+async def file_outline(path: str) -> str:
+    """Outline a .py/.json/.jsonl/.yaml/.csv/.md file (classes and signatures, keys, columns, headings) without reading all of it."""
+    return await asyncio.to_thread(_file_outline, path)
+
+
+tools = [list_dir, read_file, read_file_page, search_files, file_outline]
 tool_node = ToolNode(tools)
 model_with_tools = BASE_MODEL.bind_tools(tools)
 
 
 SYSTEM_PROMPT = (
-    "You are Analyzer Bot. Use the tools list_dir and read_file when they help. "
+    "You are Analyzer Bot. Use the tools list_dir, read_file, read_file_page, search_files and file_outline when they help. "
     "Show a concise visible thinking trace using the format 'Thinking: ...' followed "
     "by 'Answer: ...'. Keep thinking compact but real. Be direct and avoid fluff."
 )
@@ -68,25 +139,30 @@ class State(dict):
     messages: Annotated[List, add_messages]
 
 
-graph_builder = StateGraph(State)
+def build_graph(model=None):
+    """Compile the agent/tools loop, optionally against a different chat model."""
+    bound = model.bind_tools(tools) if model is not None else model_with_tools
 
-graph_builder.add_node(
-    "agent",
-    lambda state: {
-        "messages": [model_with_tools.invoke(state["messages"])]
-    },
-)
+    graph_builder = StateGraph(State)
+
+    async def agent(state: State):
+        return {"messages": [await bound.ainvoke(state["messages"])]}
+
+    graph_builder.add_node("agent", agent)
+
+    # Node that executes whichever tool was requested.
+    graph_builder.add_node("tools", tool_node)
+
+    graph_builder.set_entry_point("agent")
+    # Route to tools when the model requests them, otherwise end.
+    graph_builder.add_conditional_edges("agent", tools_condition)
+    # After a tool runs, return to the agent for follow-up.
+    graph_builder.add_edge("tools", "agent")
 
-# Node that executes whichever tool was requested.
-graph_builder.add_node("tools", tool_node)
+    return instrument(graph_builder.compile())
 
-graph_builder.set_entry_point("agent")
-# Route to tools when the model requests them, otherwise end.
-graph_builder.add_conditional_edges("agent", tools_condition)
-# After a tool runs, return to the agent for follow-up.
-graph_builder.add_edge("tools", "agent")
 
-graph = graph_builder.compile()
+graph = build_graph()
 
 
 def format_chunk_content(chunk_content) -> str:
@@ -104,34 +180,40 @@ def print_tool_message(tool_message: ToolMessage) -> None:
 async def chat_loop() -> None:
     # Conversation memory persists across turns in this list.
     history: List = [SystemMessage(content=SYSTEM_PROMPT)]
+    # 'profile on' / 'profile off', 'mem' and 'stats', see profiling.py
+    profiler = ReplProfiler()
 
     while True:
-        user_input = input("\nUser> ").strip()
+        user_input = (await asyncio.to_thread(input, "\nUser> ")).strip()
         if user_input.lower() in {"quit", "exit", "q"}:
             print("Goodbye!")
             break
+        if profiler.handle(user_input, owners=lambda: {"message history": history, "file cache": file_cache.stats()["bytes"]}):
+            continue
 
         history.append(HumanMessage(content=user_input))
 
         assembled_reply = ""
         pending_tool_messages: List[ToolMessage] = []
 
-        async for message, _metadata in graph.astream(
-            {"messages": history},
-            stream_mode="messages",
-        ):
-            if message is None:
-                continue
-
-            if isinstance(message, ToolMessage):
-                pending_tool_messages.append(message)
-                print_tool_message(message)
-                continue
-            else:
-                if message.content:
-                    chunk_text = format_chunk_content(message.content)
-                    assembled_reply += chunk_text
-                    print(chunk_text, end="", flush=True)
+        with profiler.turn() as callbacks:
+            async for message, _metadata in graph.astream(
+                {"messages": history},
+                stream_mode="messages",
+                config={"callbacks": callbacks},
+            ):
+                if message is None:
+                    continue
+
+                if isinstance(message, ToolMessage):
+                    pending_tool_messages.append(message)
+                    print_tool_message(message)
+                    continue
+                else:
+                    if message.content:
+                        chunk_text = format_chunk_content(message.content)
+                        assembled_reply += chunk_text
+                        print(chunk_text, end="", flush=True)
 
         # Persist any tool outputs and the assistant reply for memory.
         history.extend(pending_tool_messages)
@@ -140,4 +222,6 @@ async def chat_loop() -> None:
 
 
 if __name__ == "__main__":
+    # Fork the search pool before the event loop and any threads start
+    start_pool()
     asyncio.run(chat_loop())
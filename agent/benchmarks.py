@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+agent 循环的基准测试
+
+全部用离线的 ScriptedChatModel 运行，不需要网络和 API key，结果可重复：
+- superstep:  chat.py 中 llm_call -> tool_node -> llm_call 循环每个 superstep 的框架开销
+- tool_node:  tool_node 随一轮中工具调用数量增加时的吞吐
+- checkpoint: MemorySaver / SqliteDeltaSaver 的 put/get 耗时随历史长度的变化
+- ttft:       analyzer_bot.py 流式循环的首 token 时间（扣除模拟的模型延迟后即框架开销）
+- tracing:    开启 tracing.py 后每个 superstep 增加的开销（离线模型没有网络延迟，这是最坏情况）
+- http_pool:  对本地替身服务（openai_standin.py）的请求耗时，共享连接池 vs 每次新建连接
+
+用法：
+    python benchmarks.py                                  运行并写出 bench_results.json
+    python benchmarks.py --save-baseline bench_baseline.json
+    python benchmarks.py --baseline bench_baseline.json   与基线比较，有退化时返回 1
+"""
+
+import os
+
+# 必须在导入 chat / analyzer_bot 之前设置，让模块级的模型也使用离线模型
+os.environ.setdefault("FAKE_LLM", "echo")
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.memory import MemorySaver
+
+from fake_model import ScriptedChatModel
+from file_cache import file_cache
+from sqlite_saver import SqliteDeltaSaver
+from tool_executor import ToolExecutor
+
+
+def _summary(samples: list[float]) -> dict:
+    """Median / p95 / mean in milliseconds."""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "median_ms": statistics.median(ordered) * 1000,
+        "p95_ms": p95 * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "n": len(ordered),
+    }
+
+
+def _make_files(directory: str, count: int, size: int = 4096) -> list[str]:
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"file_{i}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(("line %d of a benchmark file\n" % i) * (size // 28))
+        paths.append(path)
+    return paths
+
+
+def bench_superstep(workdir: str, repeat: int) -> dict:
+    import chat
+
+    results = {}
+    for loops in (1, 4, 16):
+        script = [
+            {"content": "", "tool_calls": [{"name": "list_directory", "args": {"directory_path": workdir}}]}
+        ] * loops + [{"content": "done"}]
+        model = ScriptedChatModel(responses=script)
+        graph = chat.build_graph(model=model, checkpointer=MemorySaver())
+
+        samples = []
+        for i in range(repeat):
+            model.reset()
+            start = time.perf_counter()
+            graph.invoke(
+                {"messages": [HumanMessage(content="list it")]},
+                config={"configurable": {"thread_id": f"bench-superstep-{loops}-{i}"}},
+            )
+            samples.append(time.perf_counter() - start)
+
+        summary = _summary(samples)
+        supersteps = 2 * loops + 1
+        summary["per_superstep_ms"] = summary["median_ms"] / supersteps
+        results[f"loops_{loops}"] = summary
+    return results
+
+
+@tool
+def _slow_tool(n: int) -> str:
+    """Sleep for 20ms, standing in for a tool blocked on I/O."""
+    time.sleep(0.02)
+    return str(n)
+
+
+def bench_tool_node(workdir: str, repeat: int) -> dict:
+    import chat
+
+    paths = _make_files(workdir, 16)
+    slow_executor = ToolExecutor([_slow_tool], max_workers=16)
+    results = {}
+    for calls in (1, 2, 4, 8, 16):
+        message = AIMessage(content="", tool_calls=[
+            {"name": "read_file_tool", "args": {"file_path": paths[i]}, "id": f"call_{i}", "type": "tool_call"}
+            for i in range(calls)
+        ])
+        cold, warm = [], []
+        for _ in range(repeat):
+            file_cache.invalidate()
+            start = time.perf_counter()
+            chat.tool_node({"messages": [message]}, {})
+            cold.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            chat.tool_node({"messages": [message]}, {})
+            warm.append(time.perf_counter() - start)
+
+        slow_calls = [{"name": "_slow_tool", "args": {"n": i}, "id": f"call_{i}", "type": "tool_call"}
+                      for i in range(calls)]
+        slow = []
+        for _ in range(max(1, repeat // 4)):
+            start = time.perf_counter()
+            slow_executor.run(slow_calls)
+            slow.append(time.perf_counter() - start)
+
+        cold_summary = _summary(cold)
+        results[f"calls_{calls}"] = {
+            "read_cold": cold_summary,
+            "read_warm": _summary(warm),
+            "read_calls_per_s": calls / (cold_summary["median_ms"] / 1000),
+            "slow_tool_20ms": _summary(slow),
+        }
+    slow_executor.shutdown()
+    return results
+
+
+def _messages(count: int) -> list:
+    return [
+        (HumanMessage if i % 2 == 0 else AIMessage)(content=f"message {i} " + "x" * 200)
+        for i in range(count)
+    ]
+
+
+def bench_checkpoint(workdir: str, repeat: int) -> dict:
+    savers = {
+        "memory": MemorySaver,
+        "sqlite_delta": lambda: SqliteDeltaSaver(":memory:", ttl_seconds=None, max_threads=None),
+    }
+    results = {}
+    for name, factory in savers.items():
+        for history in (10, 100, 1000):
+            saver = factory()
+            config = {"configurable": {"thread_id": "bench", "checkpoint_ns": ""}}
+            messages = _messages(history)
+            version = None
+
+            def _put(messages, version):
+                checkpoint = empty_checkpoint()
+                checkpoint["channel_values"] = {"messages": messages}
+                checkpoint["channel_versions"] = {"messages": version}
+                return saver.put(config, checkpoint, {"step": len(messages)}, {"messages": version})
+
+            version = saver.get_next_version(version, None)
+            config = _put(messages, version)
+
+            puts, gets = [], []
+            for i in range(repeat):
+                # 每一步追加一问一答，与真实对话的增长方式一致
+                messages = messages + _messages(2)
+                version = saver.get_next_version(version, None)
+                start = time.perf_counter()
+                config = _put(messages, version)
+                puts.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                saver.get_tuple({"configurable": {"thread_id": "bench", "checkpoint_ns": ""}})
+                gets.append(time.perf_counter() - start)
+
+            results[f"{name}.history_{history}"] = {"put": _summary(puts), "get": _summary(gets)}
+    return results
+
+
+def bench_ttft(workdir: str, repeat: int) -> dict:
+    import analyzer_bot
+
+    first_token_latency = 0.02
+    model = ScriptedChatModel(
+        responses=[{"content": "Thinking: nothing to do. Answer: " + "word " * 50}],
+        first_token_latency=first_token_latency,
+        token_latency=0.0005,
+        streaming=True,
+    )
+    graph = analyzer_bot.build_graph(model=model)
+
+    async def _run_once() -> tuple[float, float]:
+        start = time.perf_counter()
+        first = None
+        async for message, _metadata in graph.astream(
+            {"messages": [HumanMessage(content="hi")]},
+            stream_mode="messages",
+        ):
+            if first is None and getattr(message, "content", None):
+                first = time.perf_counter() - start
+        return first or 0.0, time.perf_counter() - start
+
+    ttft, total = [], []
+    for _ in range(repeat):
+        model.reset()
+        first, elapsed = asyncio.run(_run_once())
+        ttft.append(first)
+        total.append(elapsed)
+
+    ttft_summary = _summary(ttft)
+    return {
+        "ttft": ttft_summary,
+        "total": _summary(total),
+        "ttft_overhead_ms": ttft_summary["median_ms"] - first_token_latency * 1000,
+    }
+
+
+def bench_tracing(workdir: str, repeat: int) -> dict:
+    import chat
+    from tracing import Tracer, instrument
+
+    loops = 8
+    script = [
+        {"content": "", "tool_calls": [{"name": "list_directory", "args": {"directory_path": workdir}}]}
+    ] * loops + [{"content": "done"}]
+    model = ScriptedChatModel(responses=script)
+    plain = chat.build_graph(model=model, checkpointer=MemorySaver())
+    traced = instrument(plain, Tracer())
+    samples = {"off": [], "on": []}
+    # 交替运行，避免机器负载的变化只落在其中一组
+    for i in range(repeat):
+        for name, graph in (("off", plain), ("on", traced)):
+            model.reset()
+            start = time.perf_counter()
+            graph.invoke(
+                {"messages": [HumanMessage(content="list it")]},
+                config={"configurable": {"thread_id": f"bench-tracing-{name}-{i}"}},
+            )
+            samples[name].append(time.perf_counter() - start)
+    off, on = _summary(samples["off"]), _summary(samples["on"])
+    supersteps = 2 * loops + 1
+    return {
+        "off": off,
+        "on": on,
+        "overhead_per_superstep_ms": (on["median_ms"] - off["median_ms"]) / supersteps,
+    }
+
+
+def bench_http_pool(workdir: str, repeat: int) -> dict:
+    import httpx
+
+    from http_pool import LIMITS, TIMEOUT
+    from openai_standin import StandinServer
+
+    server = StandinServer().start()
+    url = server.base_url + "/chat/completions"
+    body = {"model": "bench", "messages": [{"role": "user", "content": "ping " * 50}]}
+    try:
+        fresh = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with httpx.Client(timeout=TIMEOUT) as client:
+                client.post(url, json=body).raise_for_status()
+            fresh.append(time.perf_counter() - start)
+
+        pooled = []
+        with httpx.Client(limits=LIMITS, timeout=TIMEOUT) as client:
+            client.post(url, json=body).raise_for_status()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                client.post(url, json=body).raise_for_status()
+                pooled.append(time.perf_counter() - start)
+    finally:
+        server.stop()
+    return {"fresh_client": _summary(fresh), "pooled": _summary(pooled)}
+
+
+CASES = {
+    "superstep": bench_superstep,
+    "tool_node": bench_tool_node,
+    "checkpoint": bench_checkpoint,
+    "ttft": bench_ttft,
+    "tracing": bench_tracing,
+    "http_pool": bench_http_pool,
+}
+
+
+def _flatten(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_ms: float = 0.05) -> list[str]:
+    """Return one line per metric that regressed by more than ``tolerance``."""
+    current, previous = _flatten(results), _flatten(baseline)
+    regressions = []
+    for name, value in sorted(current.items()):
+        old = previous.get(name)
+        if old is None or old <= 0:
+            continue
+        if name.endswith("_ms"):
+            # 越小越好；很小的绝对差值视为噪声
+            if value > old * (1 + tolerance) and value - old > min_delta_ms:
+                regressions.append(f"{name}: {old:.3f} -> {value:.3f} ms (+{(value / old - 1) * 100:.0f}%)")
+        elif name.endswith("_per_s"):
+            if value < old * (1 - tolerance):
+                regressions.append(f"{name}: {old:.1f} -> {value:.1f} /s ({(value / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent loops against the offline model.")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated, default: all")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", help="also write the results to this file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="agent-bench-") as workdir:
+        for name in args.cases.split(","):
+            print(f"running {name} ...", flush=True)
+            results[name] = CASES[name](workdir, args.repeat)
+
+    report = {
+        "meta": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("regressions against baseline:")
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
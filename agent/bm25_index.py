@@ -0,0 +1,409 @@
+"""
+本地 BM25 倒排索引
+
+- BM25Index: 纯内存的索引，适合临时的小语料（例如把一个文件切成的若干块）
+- DocIndex:  面向一个文档目录的持久化索引。文档按段落切成 passage 建索引，
+  倒排表以紧凑的 uint32 二进制格式写入磁盘，启动时用 mmap 加载；
+  文档变化时只重新分词变化的文件，然后重写倒排表
+
+重写会给 passage 重新编号。查询结果里的 id 要用同一代的 PassageTable 解析成文本
+（search_snapshot 在同一把锁里返回两者），否则并发的重写会让 id 指向别的段落。
+passage 的原文也是这一代索引的一部分（passages.<fingerprint>.bin），不从文档目录里读：
+建索引之后被编辑的文档在下次 update() 之前仍然返回建索引时的段落，不会按旧的字节偏移切出错位的文本。
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+K1 = 1.2
+B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+|[一-鿿]")
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have how i if in is it its my of on or so that the this
+to was we what when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased word tokens; CJK text becomes single characters plus bigrams."""
+    tokens = []
+    prev_cjk = None
+    for token in _TOKEN_RE.findall(text.lower()):
+        if len(token) == 1 and "一" <= token <= "鿿":
+            tokens.append(token)
+            if prev_cjk is not None:
+                tokens.append(prev_cjk + token)
+            prev_cjk = token
+            continue
+        prev_cjk = None
+        if token not in _STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+def _bm25(tf: int, df: int, n_docs: int, doc_len: int, avgdl: float) -> float:
+    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+    return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * doc_len / avgdl))
+
+
+class BM25Index:
+    """In-memory BM25 over a list of texts; ``search`` returns ``(doc_id, score)``."""
+
+    def __init__(self, texts: Iterable[str] = ()):
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self.lengths: list[int] = []
+        for text in texts:
+            self.add(text)
+
+    def add(self, text: str) -> int:
+        doc_id = len(self.lengths)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, []).append((doc_id, tf))
+        self.lengths.append(sum(counts.values()))
+        return doc_id
+
+    def search(self, query: str, k: int = 5) -> list[tuple[int, float]]:
+        n_docs = len(self.lengths)
+        if not n_docs:
+            return []
+        avgdl = (sum(self.lengths) / n_docs) or 1.0
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            for doc_id, tf in postings:
+                scores[doc_id] = scores.get(doc_id, 0.0) + _bm25(tf, len(postings), n_docs, self.lengths[doc_id], avgdl)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+# ---- 持久化的文档目录索引 ----
+
+DOC_EXTENSIONS = (".md", ".txt", ".rst", ".html")
+PASSAGE_BYTES = 1200
+# 2: passage 原文存进索引目录（passages.*.bin）
+INDEX_VERSION = 2
+# 没有 lexicon 引用、超过这个时间的 passages.*.bin 是并发重写留下的，可以删除
+ORPHAN_SECONDS = 3600
+_PARAGRAPH_RE = re.compile(rb"\n\s*\n")
+
+
+def split_passages(data: bytes, target: int = PASSAGE_BYTES) -> list[tuple[int, int]]:
+    """Byte ranges of passages: paragraphs merged up to about ``target`` bytes."""
+    ranges = []
+    start = 0
+    for match in _PARAGRAPH_RE.finditer(data):
+        if match.start() - start >= target:
+            ranges.append((start, match.start()))
+            start = match.end()
+    if start < len(data) and data[start:].strip():
+        ranges.append((start, len(data)))
+    return ranges
+
+
+@dataclass(frozen=True)
+class PassageTable:
+    """Passages of one index generation; ids returned together with it resolve against it."""
+    passages: list      # [rel_path, start, end]，start/end 是在 data 里的字节偏移
+    data: object        # 这一代的 passage 原文（passages.*.bin 的 mmap）
+    fingerprint: str
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def raw(self, passage_id: int) -> bytes:
+        _, start, end = self.passages[passage_id]
+        return bytes(self.data[start:end])
+
+    def text(self, passage_id: int) -> str:
+        return self.raw(passage_id).decode("utf-8", errors="ignore").strip()
+
+    def path(self, passage_id: int) -> str:
+        return self.passages[passage_id][0]
+
+
+def _fingerprint(manifest: dict) -> str:
+    docs = manifest.get("docs", {})
+    key = json.dumps(sorted((p, d["mtime_ns"], d["size"]) for p, d in docs.items()))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class DocIndex:
+    """Persistent BM25 index over the documents under ``docs_dir``.
+
+    Files in ``index_dir``:
+        manifest.json  每个文档的 mtime/size 和各 passage 的词频，用于增量更新
+        lexicon.json   term -> [offset, df]，passage 列表和长度，以及原文文件名
+        postings.bin   uint32 (passage_id, tf) 对，按 term 连续存放
+        passages.<fingerprint>.bin  所有 passage 的原文，按 passage_id 连续存放
+    """
+
+    def __init__(self, docs_dir: str, index_dir: Optional[str] = None):
+        self.docs_dir = os.path.abspath(docs_dir)
+        self.index_dir = index_dir or os.path.join(self.docs_dir, ".bm25")
+        self.lock = threading.Lock()
+        # 串行化 update()：并发的重写会让磁盘上的文件和内存里的索引来自不同的一代
+        self._update_lock = threading.Lock()
+        self._manifest: dict = {}
+        self._terms: dict[str, list[int]] = {}
+        self._table = PassageTable([], b"", _fingerprint({}))
+        self._lengths: list[int] = []
+        self._avgdl = 1.0
+        self._file = None
+        self._mm = None
+        self._postings: Optional[memoryview] = None
+        self.last_update = 0.0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    # ---- 加载 ----
+
+    def load(self) -> bool:
+        """Map an existing index from disk; False if there is none yet."""
+        try:
+            with open(self._path("manifest.json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            with open(self._path("lexicon.json"), "r", encoding="utf-8") as f:
+                lexicon = json.load(f)
+            if manifest.get("version") != INDEX_VERSION:
+                return False    # 旧格式的索引没有 passage 原文，由 update() 重建
+            data = self._map_texts(lexicon["texts"])
+        except (OSError, ValueError, KeyError):
+            return False
+        with self.lock:
+            self._manifest = manifest
+            self._set_lexicon(lexicon, data)
+            self._map_postings()
+        return True
+
+    def _map_texts(self, name: str):
+        with open(self._path(name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            # mmap 自己持有文件，不需要显式关闭：旧的 PassageTable 被释放时一起回收，
+            # 文件被下一代删掉之后也仍然可读
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _set_lexicon(self, lexicon: dict, data) -> None:
+        self._terms = lexicon["terms"]
+        # 整体替换而不是原地修改，旧的 PassageTable 对持有它的查询保持不变
+        self._table = PassageTable(lexicon["passages"], data, _fingerprint(self._manifest))
+        self._lengths = lexicon["lengths"]
+        self._avgdl = (sum(self._lengths) / len(self._lengths)) if self._lengths else 1.0
+
+    def _map_postings(self) -> None:
+        self._close_map()
+        path = self._path("postings.bin")
+        if os.path.getsize(path) == 0:
+            return
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._postings = memoryview(self._mm).cast("I")
+
+    def _close_map(self) -> None:
+        if self._postings is not None:
+            self._postings.release()
+            self._postings = None
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ---- 增量更新 ----
+
+    def _scan_docs(self) -> dict[str, os.stat_result]:
+        found = {}
+        for root, dirs, files in os.walk(self.docs_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in files:
+                if name.endswith(DOC_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    found[os.path.relpath(path, self.docs_dir)] = os.stat(path)
+        return found
+
+    def _index_doc(self, rel_path: str, st: os.stat_result) -> tuple[dict, list[bytes]]:
+        with open(os.path.join(self.docs_dir, rel_path), "rb") as f:
+            data = f.read()
+        passages, texts = [], []
+        for start, end in split_passages(data):
+            counts = Counter(tokenize(data[start:end].decode("utf-8", errors="ignore")))
+            passages.append([start, end, sum(counts.values()), dict(counts)])
+            texts.append(data[start:end])
+        return {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "passages": passages}, texts
+
+    def update(self) -> int:
+        """Re-index changed documents and rewrite the postings; returns how many docs changed."""
+        with self._update_lock:
+            return self._update()
+
+    def _update(self) -> int:
+        if not self._manifest:
+            self.load()
+        current = self._scan_docs()
+        old_docs = self._manifest.get("docs", {})
+        # 没变的文档沿用上一代的原文，不重新读文件
+        kept: dict[str, list[bytes]] = {}
+        table = self._table
+        for passage_id, (rel_path, _, _) in enumerate(table.passages):
+            kept.setdefault(rel_path, []).append(table.raw(passage_id))
+        docs, texts, changed = {}, {}, 0
+        for rel_path, st in current.items():
+            entry = old_docs.get(rel_path)
+            old_texts = kept.get(rel_path, [])
+            if (entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size
+                    and len(old_texts) == len(entry["passages"])):
+                docs[rel_path], texts[rel_path] = entry, old_texts
+            else:
+                docs[rel_path], texts[rel_path] = self._index_doc(rel_path, st)
+                changed += 1
+        changed += len(set(old_docs) - set(current))
+        self.last_update = time.time()
+        if changed or not os.path.exists(self._path("postings.bin")):
+            self._write({"version": INDEX_VERSION, "docs": docs}, texts)
+        return changed
+
+    def _write(self, manifest: dict, texts: dict[str, list[bytes]]) -> None:
+        postings: dict[str, list[int]] = {}
+        passages, lengths = [], []
+        data = bytearray()
+        for rel_path in sorted(manifest["docs"]):
+            for (_, _, length, counts), text in zip(manifest["docs"][rel_path]["passages"], texts[rel_path]):
+                passage_id = len(passages)
+                passages.append([rel_path, len(data), len(data) + len(text)])
+                data += text
+                lengths.append(length)
+                for term, tf in counts.items():
+                    postings.setdefault(term, []).extend((passage_id, tf))
+
+        buffer = array("I")
+        terms = {}
+        for term in sorted(postings):
+            values = postings[term]
+            terms[term] = [len(buffer), len(values) // 2]
+            buffer.extend(values)
+        # 原文文件名带上这一代的指纹，lexicon 指向的总是和它一起写出的原文
+        texts_name = f"passages.{_fingerprint(manifest)[:16]}.bin"
+        lexicon = {"terms": terms, "passages": passages, "lengths": lengths, "texts": texts_name}
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        previous = self._read_texts_name()
+        # 先写临时文件再 rename，读者不会看到写了一半的索引；
+        # 临时文件名唯一，几个进程同时重写时不会互相覆盖
+        for name, writer in (
+            (texts_name, lambda f: f.write(data)),
+            ("postings.bin", lambda f: buffer.tofile(f)),
+            ("lexicon.json", lambda f: f.write(json.dumps(lexicon).encode("utf-8"))),
+            ("manifest.json", lambda f: f.write(json.dumps(manifest).encode("utf-8"))),
+        ):
+            fd, tmp = tempfile.mkstemp(dir=self.index_dir, prefix=name + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    writer(f)
+                os.replace(tmp, self._path(name))
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.unlink(tmp)
+                raise
+
+        mapped = self._map_texts(texts_name)
+        with self.lock:
+            self._manifest = manifest
+            self._set_lexicon(lexicon, mapped)
+            self._map_postings()
+        # 上一代的原文文件已经没有 lexicon 引用；已经映射它的 PassageTable 删除后仍然可读
+        if previous and previous != texts_name and os.path.exists(self._path(previous)):
+            os.remove(self._path(previous))
+        self._sweep(texts_name)
+
+    def _read_texts_name(self) -> Optional[str]:
+        try:
+            with open(self._path("lexicon.json"), "r", encoding="utf-8") as f:
+                return json.load(f).get("texts")
+        except (OSError, ValueError):
+            return None
+
+    def _sweep(self, keep: str) -> None:
+        """Remove passage files of rewrites that lost a race with another process."""
+        cutoff = time.time() - ORPHAN_SECONDS
+        with os.scandir(self.index_dir) as it:
+            for entry in it:
+                if entry.name.startswith("passages.") and entry.name != keep:
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except OSError:
+                        continue
+
+    # ---- 查询 ----
+
+    @property
+    def fingerprint(self) -> str:
+        """Changes whenever any indexed document changes; lets derived indexes detect staleness."""
+        return self._table.fingerprint
+
+    @property
+    def table(self) -> PassageTable:
+        """The current generation's passages."""
+        return self._table
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def passage_text(self, passage_id: int) -> str:
+        return self._table.text(passage_id)
+
+    def passage_path(self, passage_id: int) -> str:
+        return self._table.path(passage_id)
+
+    def search_ids(self, query: str, k: int = 5) -> list[tuple[int, float]]:
+        """Top-``k`` ``(passage_id, score)`` pairs."""
+        return self.search_snapshot(query, k)[0]
+
+    def search_snapshot(self, query: str, k: int = 5) -> tuple[list[tuple[int, float]], PassageTable]:
+        """``search_ids`` plus the PassageTable its ids refer to, even if a rewrite happens meanwhile."""
+        with self.lock:
+            table = self._table
+            n_docs = len(self._lengths)
+            if not n_docs or self._postings is None:
+                return [], table
+            scores: dict[int, float] = {}
+            for term in set(tokenize(query)):
+                entry = self._terms.get(term)
+                if entry is None:
+                    continue
+                offset, df = entry
+                pairs = self._postings[offset:offset + 2 * df]
+                for i in range(0, 2 * df, 2):
+                    passage_id, tf = pairs[i], pairs[i + 1]
+                    scores[passage_id] = scores.get(passage_id, 0.0) + _bm25(
+                        tf, df, n_docs, self._lengths[passage_id], self._avgdl)
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1]), table
+
+    def search(self, query: str, k: int = 5) -> list[dict]:
+        """Top-``k`` passages as ``{"path", "score", "text"}``."""
+        results = []
+        ids, table = self.search_snapshot(query, k)
+        for passage_id, score in ids:
+            results.append({"path": table.path(passage_id), "score": score, "text": table.text(passage_id)})
+        return results
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_map()
@@ -1,16 +1,10 @@
-import os
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
-from dotenv import load_dotenv
-from pydantic import SecretStr
-load_dotenv('../../..llm_env')
+from models import get_chat_model
 
-API_KEY : str= os.getenv("MY_OPENAI_API_KEY") or ""
-BASE_URL = os.getenv("MY_OPENAI_API_BASE")
-
-llm = ChatOpenAI(api_key=SecretStr(API_KEY),  base_url=BASE_URL,  model="gpt-4",temperature=0)
+# 通过 get_chat_model 创建，LLM_CACHE / FAKE_LLM 对这个脚本同样生效
+llm = get_chat_model(model="gpt-4", temperature=0)
 
 ## --- 提示词 1：提取信息 ---
 prompt_extract = ChatPromptTemplate.from_template(
@@ -8,42 +8,62 @@
 """
 
 import os
+import re
 import sys
+import time
 import operator
 from typing import Annotated, Literal
-from langchain_core.runnables import RunnableLambda
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage, AnyMessage
 from langchain.tools import tool
-from pydantic import SecretStr
-
-from langgraph.checkpoint.memory import MemorySaver # checkpoint
-
-from load_env import API_KEY, BASE_URL
-
-# 初始化 LLM
-llm = ChatOpenAI(
+from langchain_core.runnables import RunnableConfig
+
+from models import get_chat_model
+from rate_limit import format_stats, get_rate_limiter
+from tool_executor import ToolExecutor
+from file_cache import FileEntry, file_cache
+from dir_index import dir_index
+from history import compact_history
+from sqlite_saver import SqliteDeltaSaver
+from stream_render import StreamRenderer
+from tracing import instrument
+from profiling import ReplProfiler
+from file_search import format_result, search_tree, start_pool
+from file_outline import file_outline as build_outline
+from tool_results import format_result_page, tool_results
+from prefetch import Prefetcher, format_stats as format_prefetch_stats
+from file_pager import DEFAULT_PAGE_BYTES, FULL_READ_LIMIT, format_page, read_byte_range, read_line_range
+
+# 初始化 LLM（设置 FAKE_LLM 时使用离线脚本模型）
+llm = get_chat_model(
     streaming=True,     # [1] 开启流式输出
-    api_key=SecretStr(API_KEY),
-    base_url=BASE_URL,
     model="gpt-5.1",
-    temperature=0
+    temperature=0,
+    rate_limited=True,  # 只经过 rate_limiter.call 调用，重试交给限流器
 )
+# 所有会话共用的限流器（RPM/TPM + 自适应并发），见 rate_limit.py
+rate_limiter = get_rate_limiter()
+
+
+# list_directory 单次最多返回的条目数
+MAX_LIST_ENTRIES = 500
 
 
 # 定义工具
 @tool
-def list_directory(directory_path: str = ".") -> str:
-    """list file under specific directory
+def list_directory(directory_path: str = ".", max_depth: int = 1, pattern: str = "") -> str:
+    """list file under specific directory, optionally recursively
     
     Args:
         directory_path: dir path to be listed, default is current dir: '.'
+        max_depth: how many levels to list, 1 means only direct children
+        pattern: glob to filter file names, e.g. '*.py'; empty means all files
     
     Returns:
-        content list of a directory
+        content list of a directory. .git, node_modules, __pycache__ and
+        .gitignore'd entries are skipped.
     """
     try:
         if not os.path.isabs(directory_path):
@@ -56,21 +76,44 @@ def list_directory(directory_path: str = ".") -> str:
         if not os.path.isdir(directory_path):
             return f"Error:'{directory_path}' is not a directory"
         
+        # 一次 scandir 遍历，结果边遍历边格式化，超过上限就停止
         items = []
-        for item in sorted(os.listdir(directory_path)):
-            item_path = os.path.join(directory_path, item)
-            if os.path.isdir(item_path):
-                items.append(f"[dir] {item}/")
+        listed = []
+        for entry in dir_index.walk(directory_path, max_depth=max(1, max_depth), pattern=pattern):
+            if len(items) >= MAX_LIST_ENTRIES:
+                items.append(f"... (truncated at {MAX_LIST_ENTRIES} entries, narrow max_depth or pattern)")
+                break
+            listed.append(entry)
+            indent = "  " * (entry.depth - 1)
+            name = entry.path.rsplit("/", 1)[-1]
+            if entry.is_dir:
+                items.append(f"{indent}[dir] {name}/" + (" (skipped)" if entry.ignored else ""))
             else:
-                size = os.path.getsize(item_path)
-                items.append(f"[file] {item} ({size} bytes)")
+                items.append(f"{indent}[file] {name} ({entry.size} bytes)")
         
+        # 后台预读接下来最可能被读的文件，不等它完成
+        prefetcher.schedule(directory_path, listed)
         result = f"content of dir '{directory_path}':\n" + "\n".join(items)
         return result
     except Exception as e:
         return f"错误：列出目录时出现问题 - {str(e)}"
 
 
+def _format_file_entry(entry: FileEntry) -> str:
+    if entry.is_binary:
+        # 二进制文件只报告长度
+        return f"file '{entry.path}' is a binary file with length {entry.size}, cannot displayed as text."
+    return f"file: '{entry.path}' , length: {len(entry.text)}, content:\n\n{entry.text}"
+
+
+def _warm_file(path: str) -> str:
+    # 预读时连 read_file_tool 的输出一起生成好，之后的调用直接返回
+    return file_cache.render(file_cache.get(path), "read_file_tool", _format_file_entry)
+
+
+prefetcher = Prefetcher(warm=_warm_file)
+
+
 @tool
 def read_file_tool(file_path: str) -> str:
     """read content of certain file
@@ -92,88 +135,195 @@ def read_file_tool(file_path: str) -> str:
         if not os.path.isfile(file_path):
             return f"Error: file '{file_path}' is not a file"
         
-        # 尝试读取文件
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return f"file: '{file_path}' , length: {len(content)}, content:\n\n{content}"
-        except UnicodeDecodeError:
-            # 如果是二进制文件，尝试以二进制模式读取
-            with open(file_path, 'rb') as f:
-                content = f.read()
-            return f"file '{file_path}' is a binary file with length {len(content)}, cannot displayed as text."
+        # 大文件不整体读入内存，只返回第一页并提示改用分页读取
+        if os.path.getsize(file_path) > FULL_READ_LIMIT:
+            page = read_byte_range(file_path, 0, DEFAULT_PAGE_BYTES)
+            return (f"file '{file_path}' is too large to read at once, "
+                    f"use read_file_page to fetch more.\n" + format_page(page))
+        
+        # 通过共享缓存读取，文件未变化时不再读盘（列目录后可能已经被预读）
+        prefetcher.claim(file_path)
+        entry = file_cache.get(file_path)
+        return file_cache.render(entry, "read_file_tool", _format_file_entry)
+    except Exception as e:
+        return f"Error in reading file - {str(e)}"
+
+
+@tool
+def read_file_page(file_path: str, offset: int = 0, length: int = DEFAULT_PAGE_BYTES,
+                   start_line: int = 0, end_line: int = 0) -> str:
+    """read part of a (large) file, by byte range or by line range
+    
+    Args:
+        file_path: path of target file (absolute or relative path)
+        offset: byte offset to start from, used when start_line is 0
+        length: number of bytes to read, at most 262144
+        start_line: first line to read (1-based); if > 0, read by lines instead of bytes
+        end_line: last line to read (inclusive); 0 means up to 2000 lines
+    
+    Returns:
+        the requested slice and where the next page starts. if doesn't exist, it is error message.
+    """
+    try:
+        if not os.path.isabs(file_path):
+            file_path = os.path.abspath(file_path)
+        
+        if not os.path.isfile(file_path):
+            return f"Error: file '{file_path}' doesn't exist or is not a file"
+        
+        if start_line > 0:
+            page = read_line_range(file_path, start_line, end_line)
+        else:
+            page = read_byte_range(file_path, offset, length)
+        return format_page(page)
     except Exception as e:
         return f"Error in reading file - {str(e)}"
 
 
+@tool
+def search_files(query: str, directory_path: str = ".", regex: bool = False,
+                 case_sensitive: bool = False, pattern: str = "", context_lines: int = 1,
+                 max_matches: int = 50) -> str:
+    """search the content of all files under a dir, like grep -rn
+    
+    Args:
+        query: text to look for; a Python regular expression if regex is true
+        directory_path: dir to search in, default is current dir: '.'
+        regex: treat query as a regular expression instead of literal text
+        case_sensitive: match case exactly, default is case-insensitive
+        pattern: glob to filter file names, e.g. '*.py'; empty means all files
+        context_lines: lines shown before and after each match, at most 5
+        max_matches: stop after this many matching lines, at most 200
+    
+    Returns:
+        matching lines grouped by file, as 'line_no: text' (context lines use 'line_no- text').
+        binary files, .git, node_modules and .gitignore'd entries are skipped.
+    """
+    try:
+        if not os.path.isabs(directory_path):
+            directory_path = os.path.abspath(directory_path)
+        
+        if not os.path.isdir(directory_path):
+            return f"Error: dir '{directory_path}' doesn't exist or is not a directory"
+        
+        # 多进程搜索，只把命中的行和上下文交给模型
+        result = search_tree(directory_path, query, regex=regex, case_sensitive=case_sensitive,
+                             pattern=pattern, context=context_lines, max_matches=max_matches)
+        return format_result(result)
+    except re.error as e:
+        return f"Error: invalid regex {query!r} - {str(e)}"
+    except Exception as e:
+        return f"Error in searching files - {str(e)}"
+
+
+@tool
+def file_outline(file_path: str) -> str:
+    """show the structure of a file instead of its full content
+    
+    Args:
+        file_path: path of target file (absolute or relative path); supports
+            .py (classes, functions, signatures, docstrings), .json/.jsonl/.yaml
+            (keys and value types), .csv/.tsv (columns, types, row count) and .md (headings)
+    
+    Returns:
+        the outline, with line numbers for python and markdown. if doesn't exist, it is error message.
+    """
+    try:
+        if not os.path.isabs(file_path):
+            file_path = os.path.abspath(file_path)
+        
+        if not os.path.isfile(file_path):
+            return f"Error: file '{file_path}' doesn't exist or is not a file"
+        
+        # 概要随文件条目缓存，文件没变时不重新解析
+        return build_outline(file_path)
+    except ValueError as e:
+        return f"Error: {str(e)}, use read_file_tool instead"
+    except Exception as e:
+        return f"Error in outlining file - {str(e)}"
+
+
+@tool
+def read_tool_result(handle: str, offset: int = 0, length: int = DEFAULT_PAGE_BYTES,
+                     start_line: int = 0, end_line: int = 0) -> str:
+    """read the rest of a tool output that was too large and was stored under a handle
+    
+    Args:
+        handle: the handle given in the truncated tool output, e.g. 'tr-0123456789abcdef0123'
+        offset: byte offset to start from, used when start_line is 0
+        length: number of bytes to read, at most 262144
+        start_line: first line to read (1-based); if > 0, read by lines instead of bytes
+        end_line: last line to read (inclusive); 0 means up to 2000 lines
+    
+    Returns:
+        the requested slice and where the next page starts. if the handle is unknown, it is error message.
+    """
+    try:
+        page = tool_results.read(handle, offset, length, start_line, end_line)
+        return format_result_page(handle, page)
+    except Exception as e:
+        return f"Error in reading tool result - {str(e)}"
+
+
 # 绑定工具到 LLM
-tools = [list_directory, read_file_tool]
+tools = [list_directory, read_file_tool, read_file_page, search_files, file_outline, read_tool_result]
 tools_by_name = {tool.name: tool for tool in tools}
 model_with_tools = llm.bind_tools(tools)
+# 超长的工具输出落盘，state 和 checkpoint 里只留预览和 handle
+tool_executor = ToolExecutor(tools, result_store=tool_results)
 
 
 class State(TypedDict):
     """对话状态，包含消息历史"""
     messages: Annotated[list[AnyMessage], operator.add]
+    history_stats: dict  # 最近一次调用 LLM 时历史压缩的统计
 
 
-def llm_call(state: State):
-    """LLM node, decide if there is a need to use tool"""
-    system_prompt = """You a are professional file-analyzing assistant. You can use the following tools to help your user:
-1. list_directory: list the content of a dir
+SYSTEM_PROMPT = """You a are professional file-analyzing assistant. You can use the following tools to help your user:
+1. list_directory: list the content of a dir, use max_depth to see several levels at once
 2. read_file_tool: read the content of a (text) file
+3. read_file_page: read a byte range or line range of a file, use it for large files
+4. search_files: find which files and lines contain a text or regex, prefer it over reading files one by one
+5. file_outline: the structure of a code/data file (classes, functions, keys, columns), check it before reading a large file
+6. read_tool_result: page through a tool output that was too large and was replaced by a preview and a handle
 
 Decide if there is a need to use tool according to user's need. If user request to analyze file/dir, 
 or you think the analyzed file need the content of another file, you should invoke according tools.
 """
-    
-    messages = [SystemMessage(content=system_prompt)]
-    # messages.extend(state["messages"])
-    
-    # NOTE: 改为stream后，这里如果还用invoke，仍然不会获得event
-    # 使用 invoke 返回完整响应（节点函数需要返回完整结果）
-    # 流式输出在 main 函数中通过 graph.stream() 处理
-    # response = model_with_tools.invoke(messages)
-    
-    # return {"messages": [response]}
 
-    messages = [SystemMessage(content=system_prompt)] + state["messages"]
 
-    # 关键：直接调用 runnable，而不是 invoke
-    # return {
-    #     "messages": model_with_tools
-    # }
+def prepare_messages(state: State):
+    """按 token 预算压缩历史，system prompt 和最近几轮始终保留；返回 (messages, report)"""
+    history, report = compact_history(state["messages"])
+    return [SystemMessage(content=SYSTEM_PROMPT)] + history, report
 
 
+def llm_call(state: State, model=None):
+    """LLM node, decide if there is a need to use tool"""
+    messages, report = prepare_messages(state)
+
+    # 必须在节点内直接调用模型：返回 RunnableLambda 包装时它会原样进入 state，模型从未被调用。
+    # graph.stream 的 callbacks 会传到这里，流式 token 仍然能收到
+    # 经过全局限流器：排队等待 RPM/TPM 配额和并发名额，429 时由它统一退避重试
+    response = rate_limiter.call((model or model_with_tools).invoke, messages)
+
     #  这里必须用 [] 包裹，因为会对state进行 "add"，要求是list
     return { 
-        "messages": [RunnableLambda(lambda _: model_with_tools.invoke(messages)) ]
+        "messages": [response],
+        "history_stats": report.as_dict(),
     }
 
 
-
-def tool_node(state: State):
+def tool_node(state: State, config: RunnableConfig):
     """Tool node"""
-    result = []
     last_message = state["messages"][-1]
     
     # 检查是否有工具调用
     if not hasattr(last_message, 'tool_calls') or not last_message.tool_calls:
         return {"messages": []}
     
-    for tool_call in last_message.tool_calls:
-        tool = tools_by_name[tool_call["name"]]
-        try:
-            observation = tool.invoke(tool_call["args"])
-        except Exception as e:
-            observation = f"错误：执行工具时出现问题 - {str(e)}"
-        
-        result.append(ToolMessage(
-            content=str(observation),
-            tool_call_id=tool_call["id"]
-        ))
-    
-    return {"messages": result}
+    # 多个工具调用并发执行，结果顺序与 tool_calls 一致
+    return {"messages": tool_executor.run(last_message.tool_calls, config)}
 
 
 def should_continue(state: State) -> Literal["tool_node", END]:
@@ -189,12 +339,21 @@ def should_continue(state: State) -> Literal["tool_node", END]:
     return END
 
 
-def build_graph():
-    """构建对话图"""
+def build_graph(model=None, checkpointer=None):
+    """构建对话图
+
+    Args:
+        model: 替换默认 LLM 的聊天模型（例如离线的 ScriptedChatModel），None 表示使用默认模型
+        checkpointer: 替换默认的 SQLite checkpointer
+    """
     graph_builder = StateGraph(State)
     
     # 添加节点
-    graph_builder.add_node("llm_call", llm_call)
+    if model is None:
+        graph_builder.add_node("llm_call", llm_call)
+    else:
+        bound = model.bind_tools(tools)
+        graph_builder.add_node("llm_call", lambda state: llm_call(state, bound))
     graph_builder.add_node("tool_node", tool_node)
     
     # 设置入口
@@ -213,14 +372,48 @@ def build_graph():
     # 工具执行后返回 LLM
     graph_builder.add_edge("tool_node", "llm_call")
 
-    # 增加check point
-    checkpointer = MemorySaver()
+    # 增加check point：持久化到本地 SQLite，只写增量，重启后会话仍在
+    if checkpointer is None:
+        checkpointer = SqliteDeltaSaver()
     
-    return graph_builder.compile(checkpointer=checkpointer)
+    # TRACE=1 时记录节点 / 模型 / 工具的耗时，见 tracing.py
+    return instrument(graph_builder.compile(checkpointer=checkpointer))
+
+
+def session_memory(graph, thread_id: str) -> dict:
+    """What the current session keeps in memory / on disk, for the 'mem' command."""
+    state = graph.get_state(config={"configurable": {"thread_id": thread_id}})
+    owners = {
+        "message history": state.values.get("messages", []),
+        "checkpoint state (incl. history)": state.values,
+        "file cache": file_cache.stats()["bytes"],
+        "spilled tool results (on disk)": tool_results.stats()["disk_bytes"],
+    }
+    if isinstance(graph.checkpointer, SqliteDeltaSaver):
+        owners["checkpoint db (all sessions, on disk)"] = graph.checkpointer.size_bytes()
+    return owners
+
+
+def print_history(messages: list[AnyMessage]) -> None:
+    print("\n" + "=" * 60)
+    print("chat history:")
+    print("=" * 60)
+    for i, msg in enumerate(messages, 1):
+        if isinstance(msg, HumanMessage):
+            print(f"\n[{i}] User: {msg.content}")
+        elif isinstance(msg, AIMessage):
+            print(f"\n[{i}] Assistant: {msg.content}")
+            if hasattr(msg, 'tool_calls') and msg.tool_calls:
+                print(f"      [invoking: {[tc['name'] for tc in msg.tool_calls]}]")
+        elif isinstance(msg, ToolMessage):
+            print(f"\n[{i}] [result] {msg.content[:200]}...")
+    print("=" * 60)
 
 
 def main():
     """主函数"""
+    # 搜索进程池要在渲染、预读等线程启动之前 fork 出来
+    start_pool()
     print("=" * 60)
     print("File Helper")
     print("=" * 60)
@@ -229,15 +422,20 @@ def main():
     print("  - 'quit', 'exit', 'q' to exit")
     print("  - 'clear' to clear history")
     print("  - 'show' to show chat history")
+    print("  - 'cache' to show file cache and spilled tool result stats")
+    print("  - 'limits' to show model rate limiter stats")
+    print("  - 'profile on' / 'profile off', 'mem', 'stats' to profile this session")
     print("-" * 60)
     
     # 构建图
     graph = build_graph()
+    profiler = ReplProfiler()
     
     # 不再使用current_state（隐藏细节）
-    # 使用check point
-    session_id = 1
-    thread_id = f"file-helper-session-{session_id}"
+    # 使用check point，启动时接着上一次的会话
+    thread_id = graph.checkpointer.latest_thread("file-helper-session-") \
+        or f"file-helper-session-{int(time.time())}"
+    print(f"session: {thread_id}")
     
     # 交互式循环
     while True:
@@ -254,32 +452,37 @@ def main():
         # 处理清空历史命令
         if user_input.lower() == "clear":
             # 使用checkpoint后，不再手动管理State状态
-            session_id += 1
-            thread_id = f"file-helper-session-{session_id}"
+            thread_id = f"file-helper-session-{int(time.time())}"
+            prefetcher.cancel()
             print("clear the chat history")
             continue
         
+        # 查看文件缓存命中情况
+        if user_input.lower() == "cache":
+            stats = file_cache.stats()
+            print(f"file cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['entries']} entries, {stats['bytes']}/{stats['max_bytes']} bytes")
+            spilled = tool_results.stats()
+            print(f"tool results: {spilled['spilled']} spilled ({spilled['spilled_chars']} chars), "
+                  f"{spilled['reads']} page reads, {spilled['disk_bytes']}/{spilled['max_bytes']} bytes on disk")
+            print(format_prefetch_stats(prefetcher.stats()))
+            continue
+
+        if user_input.lower() == "limits":
+            print(format_stats(rate_limiter.stats()))
+            continue
+
+        # profile on/off、mem、stats
+        if profiler.handle(user_input, owners=lambda: session_memory(graph, thread_id)):
+            continue
+        
         # 处理查看历史命令
         if user_input.lower() == "show":
-            print("\n" + "=" * 60)
-            print("chat history:")
-            print("=" * 60)
-
             state = graph.get_state(
                 config={"configurable": {"thread_id": thread_id}}
             )
             # 手动获得state，然后再打印
-            messages = state.values["messages"]
-            for i, msg in enumerate(messages, 1):
-                if isinstance(msg, HumanMessage):
-                    print(f"\n[{i}] User: {msg.content}")
-                elif isinstance(msg, AIMessage):
-                    print(f"\n[{i}] Assistant: {msg.content}")
-                    if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                        print(f"      [invoking: {[tc['name'] for tc in msg.tool_calls]}]")
-                elif isinstance(msg, ToolMessage):
-                    print(f"\n[{i}] [result] {msg.content[:200]}...")
-            print("=" * 60)
+            print_history(state.values.get("messages", []))
             continue
         
         # 处理用户输入
@@ -294,26 +497,30 @@ def main():
                 "messages": [HumanMessage(content=user_input)]
             }
 
-
+            # stream_mode="messages" 只产出模型 token 和节点消息；renderer 缓冲输出、插入工具标记、记录 TTFT
+            renderer = StreamRenderer().start()
+            try:
+                with profiler.turn() as callbacks:
+                    for message, metadata in graph.stream(
+                        inputs,
+                        stream_mode="messages",
+                        config={
+                            "configurable": {"thread_id": thread_id},   # 指定thread id，可供checkpoint使用
+                            "callbacks": callbacks,                      # 统计本轮模型 / 工具耗时，见 profiling.py
+                        }
+                    ):
+                        renderer.handle(message, metadata)
+            finally:
+                timing = renderer.finish()
+            if timing["ttft_ms"] is not None:
+                print(f"\n[ttft {timing['ttft_ms']:.0f} ms, total {timing['total_ms'] / 1000:.1f} s]")
             
-            # 流式处理图的执行
-            for event in graph.stream(
-                inputs,
-                stream_mode="events",
-                config={"configurable": {"thread_id": thread_id}}   # 指定thread id，可供checkpoint使用
-            ):     # [2] stream node
-                print('------------------')
-                print(event)
-                # [3] 监听token事件
-                if event["event"] == "on_llm_stream":
-                    chunk = event["chunk"]
-                    print(chunk, end="", flush=True)
-
-                elif event["event"] == "on_tool_start":
-                    print(f"\n[invoking: {event['name']}]")
-
-                elif event["event"] == "on_tool_end":
-                    print("\n[tool finished]")
+            # 报告本轮历史压缩节省的 token
+            stats = graph.get_state(
+                config={"configurable": {"thread_id": thread_id}}
+            ).values.get("history_stats")
+            if stats and stats["tokens_saved"]:
+                print(f"\n[history: {stats['tokens_after']} tokens sent, {stats['tokens_saved']} saved]")
             
         except Exception as e:
             print(f"\n错误：处理请求时出现问题 - {e}")
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+chat.py 的 asyncio 版本
+
+节点、工具、checkpointer 和用户输入都不阻塞事件循环：
+- llm_call 用 ainvoke / 流式回调，tool_node 用 ToolExecutor.arun 并发执行工具
+- 工具与 chat.py 相同，但文件 I/O 通过 asyncio.to_thread 放到线程里执行
+- SqliteDeltaSaver 的 aget_tuple / aput 同样在线程中访问 SQLite
+- 终端输入由单独的线程读取
+因此同一个进程可以同时跑多个会话（不同 thread_id 并发调用 graph.astream），
+一个会话读大文件不会卡住其它会话。工具、system prompt、历史压缩与 chat.py 共用。
+"""
+
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool
+from langgraph.graph import StateGraph, START, END
+
+import chat
+from chat import State, prepare_messages, print_history, rate_limiter, session_memory, should_continue
+from file_cache import file_cache
+from rate_limit import format_stats
+from sqlite_saver import SqliteDeltaSaver
+from stream_render import StreamRenderer
+from tool_executor import ToolExecutor
+from tool_results import tool_results
+from prefetch import format_stats as format_prefetch_stats
+from tracing import instrument
+from profiling import ReplProfiler
+
+
+def _offload(sync_tool) -> StructuredTool:
+    """Same tool (name, schema, description), with an async path that runs it in a worker thread."""
+    async def _run(**kwargs):
+        return await asyncio.to_thread(sync_tool.func, **kwargs)
+
+    return StructuredTool.from_function(
+        func=sync_tool.func,
+        coroutine=_run,
+        name=sync_tool.name,
+        description=sync_tool.description,
+        args_schema=sync_tool.args_schema,
+    )
+
+
+tools = [_offload(t) for t in chat.tools]
+model_with_tools = chat.llm.bind_tools(tools)
+tool_executor = ToolExecutor(tools, result_store=tool_results)
+
+
+async def llm_call(state: State, model=None):
+    """LLM node (async)"""
+    messages, report = prepare_messages(state)
+    response = await rate_limiter.acall((model or model_with_tools).ainvoke, messages)
+    return {
+        "messages": [response],
+        "history_stats": report.as_dict(),
+    }
+
+
+async def tool_node(state: State, config: RunnableConfig):
+    """Tool node (async), tool calls of one message run concurrently"""
+    last_message = state["messages"][-1]
+    if not getattr(last_message, "tool_calls", None):
+        return {"messages": []}
+    return {"messages": await tool_executor.arun(last_message.tool_calls, config)}
+
+
+def build_graph(model=None, checkpointer=None):
+    """构建异步对话图，参数与 chat.build_graph 相同"""
+    graph_builder = StateGraph(State)
+
+    if model is None:
+        graph_builder.add_node("llm_call", llm_call)
+    else:
+        bound = model.bind_tools(tools)
+
+        async def _llm_call(state: State):
+            return await llm_call(state, bound)
+
+        graph_builder.add_node("llm_call", _llm_call)
+    graph_builder.add_node("tool_node", tool_node)
+
+    graph_builder.add_edge(START, "llm_call")
+    graph_builder.add_conditional_edges(
+        "llm_call",
+        should_continue,
+        {
+            "tool_node": "tool_node",
+            END: END
+        }
+    )
+    graph_builder.add_edge("tool_node", "llm_call")
+
+    if checkpointer is None:
+        checkpointer = SqliteDeltaSaver()
+    return instrument(graph_builder.compile(checkpointer=checkpointer))
+
+
+# 终端输入放在专用线程里读取。不用 loop.connect_read_pipe：它会把 stdin 设为非阻塞，
+# 终端下 stdin/stdout 共用同一个文件描述，大段输出时 print 会抛 BlockingIOError
+_input_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stdin")
+
+
+async def ainput(prompt: str = "") -> str:
+    """input() that does not block the event loop; raises EOFError at end of input."""
+    print(prompt, end="", flush=True)
+    line = await asyncio.get_running_loop().run_in_executor(_input_pool, sys.stdin.readline)
+    if not line:
+        raise EOFError
+    return line.rstrip("\n")
+
+
+async def run_turn(graph, thread_id: str, user_input: str, renderer: Optional[StreamRenderer] = None,
+                   callbacks: Optional[list] = None) -> dict:
+    """Stream one user turn of ``thread_id`` through ``renderer``; returns its timings."""
+    renderer = (renderer or StreamRenderer()).start()
+    config = {"configurable": {"thread_id": thread_id}}
+    if callbacks:
+        config["callbacks"] = callbacks
+    try:
+        async for message, metadata in graph.astream(
+            {"messages": [HumanMessage(content=user_input)]},
+            config=config,
+            stream_mode="messages",
+        ):
+            renderer.handle(message, metadata)
+    finally:
+        timing = renderer.finish()
+    return timing
+
+
+async def main():
+    """主函数"""
+    print("=" * 60)
+    print("File Helper (async)")
+    print("=" * 60)
+    print("\nCurrent working directory:", os.getcwd())
+    print("\nprompt>")
+    print("  - 'quit', 'exit', 'q' to exit")
+    print("  - 'clear' to clear history")
+    print("  - 'show' to show chat history")
+    print("  - 'cache' to show file cache and spilled tool result stats")
+    print("  - 'limits' to show model rate limiter stats")
+    print("  - 'profile on' / 'profile off', 'mem', 'stats' to profile this session")
+    print("-" * 60)
+
+    graph = build_graph()
+    profiler = ReplProfiler()
+    thread_id = graph.checkpointer.latest_thread("file-helper-session-") \
+        or f"file-helper-session-{int(time.time())}"
+    print(f"session: {thread_id}")
+
+    while True:
+        try:
+            user_input = (await ainput("\nUser> ")).strip()
+        except EOFError:
+            print("Bye!")
+            break
+
+        if not user_input:
+            continue
+
+        if user_input.lower() in ["quit", "exit", "q"]:
+            print("Bye!")
+            break
+
+        if user_input.lower() == "clear":
+            thread_id = f"file-helper-session-{int(time.time())}"
+            chat.prefetcher.cancel()
+            print("clear the chat history")
+            continue
+
+        if user_input.lower() == "cache":
+            stats = file_cache.stats()
+            print(f"file cache: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['entries']} entries, {stats['bytes']}/{stats['max_bytes']} bytes")
+            spilled = tool_results.stats()
+            print(f"tool results: {spilled['spilled']} spilled ({spilled['spilled_chars']} chars), "
+                  f"{spilled['reads']} page reads, {spilled['disk_bytes']}/{spilled['max_bytes']} bytes on disk")
+            print(format_prefetch_stats(chat.prefetcher.stats()))
+            continue
+
+        if user_input.lower() == "limits":
+            print(format_stats(rate_limiter.stats()))
+            continue
+
+        if profiler.handle(user_input, owners=lambda: session_memory(graph, thread_id)):
+            continue
+
+        if user_input.lower() == "show":
+            state = await graph.aget_state(config={"configurable": {"thread_id": thread_id}})
+            print_history(state.values.get("messages", []))
+            continue
+
+        try:
+            print("\nAssistant: ", end="", flush=True)
+            with profiler.turn() as callbacks:
+                timing = await run_turn(graph, thread_id, user_input, callbacks=callbacks)
+            if timing["ttft_ms"] is not None:
+                print(f"\n[ttft {timing['ttft_ms']:.0f} ms, total {timing['total_ms'] / 1000:.1f} s]")
+        except Exception as e:
+            print(f"\n错误：处理请求时出现问题 - {e}")
+            import traceback
+            traceback.print_exc()
+
+    _input_pool.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    # 搜索进程池在事件循环和线程启动之前 fork 出来
+    chat.start_pool()
+    asyncio.run(main())
@@ -5,40 +5,114 @@
 1. 读取文件作为分析任务
 2. 记忆功能（保存对话历史）
 3. 人工追问和干预
+
+小文件整体放进 system prompt；大文件（超过 RAG_FULL_LIMIT 个字符）切成有重叠的块，
+用 BM25 建本地索引，每轮只把与问题最相关的 RAG_TOP_K 个块发给模型，
+每轮 prompt 的大小只与问题有关，与文件大小无关。CHAT_BK_MODE=full/rag 可强制指定模式。
 """
 
 import os
 import sys
+from dataclasses import dataclass
 from typing import Annotated
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from pydantic import SecretStr
 
-from load_env import API_KEY, BASE_URL
+from models import get_chat_model
+from file_cache import file_cache
+from bm25_index import BM25Index
+
+# 初始化 LLM（设置 FAKE_LLM 时使用离线脚本模型）
+llm = get_chat_model(model="gpt-4.1", temperature=0)
+
 
-# 初始化 LLM
-llm = ChatOpenAI(
-    api_key=SecretStr(API_KEY),
-    base_url=BASE_URL,
-    model="gpt-4.1",
-    temperature=0
-)
+# 超过这个字符数的文件使用分块检索模式
+RAG_FULL_LIMIT = int(os.getenv("RAG_FULL_LIMIT", "12000"))
+CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", "2000"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "300"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "4"))
 
 
 class State(TypedDict):
     """对话状态，包含消息历史和文件内容"""
     messages: Annotated[list, add_messages]
-    file_content: str  # 保存读取的文件内容
+    file_content: str  # 保存读取的文件内容（分块模式下为空）
+    file_path: str
+    mode: str  # "full" 或 "rag"
+
+
+@dataclass
+class Chunk:
+    start_line: int
+    end_line: int
+    text: str
+
+
+def split_chunks(text: str, size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list[Chunk]:
+    """按行切块，每块约 size 个字符，相邻块重叠约 overlap 个字符"""
+    # (行号, 片段)；超长的行（例如压缩过的 js）再按 size 硬切
+    pieces = []
+    for line_no, line in enumerate(text.splitlines(keepends=True), 1):
+        for start in range(0, max(len(line), 1), size):
+            pieces.append((line_no, line[start:start + size]))
+
+    chunks = []
+    i = 0
+    while i < len(pieces):
+        j, length = i, 0
+        while j < len(pieces) and (length < size or j == i):
+            length += len(pieces[j][1])
+            j += 1
+        chunks.append(Chunk(pieces[i][0], pieces[j - 1][0], "".join(p for _, p in pieces[i:j])))
+        if j >= len(pieces):
+            break
+        # 往回退几行作为下一块的开头，保证跨块的内容不会被切断
+        back, tail = j, 0
+        while back - 1 > i and tail + len(pieces[back - 1][1]) <= overlap:
+            back -= 1
+            tail += len(pieces[back][1])
+        i = back
+    return chunks
+
+
+class ChunkIndex:
+    """一个文件的分块和 BM25 索引，只在文件变化时重建"""
+
+    def __init__(self, text: str):
+        self.chunks = split_chunks(text)
+        self.index = BM25Index(c.text for c in self.chunks)
+
+    def select(self, query: str, k: int = RAG_TOP_K) -> list[Chunk]:
+        ids = [i for i, _ in self.index.search(query, k)]
+        if not ids:
+            # 没有命中（例如"总结一下这个文件"）时取均匀分布在全文的块，兼顾开头和整体结构
+            step = max(1, len(self.chunks) // k)
+            ids = list(range(0, len(self.chunks), step))[:k]
+        return [self.chunks[i] for i in sorted(ids)]
+
+
+# file_path -> (mtime_ns, size, ChunkIndex)
+_chunk_indexes: dict[str, tuple[int, int, ChunkIndex]] = {}
+
+
+def get_chunk_index(file_path: str) -> ChunkIndex:
+    entry = file_cache.get(file_path)
+    cached = _chunk_indexes.get(entry.path)
+    if cached is None or cached[:2] != (entry.mtime_ns, entry.size):
+        cached = (entry.mtime_ns, entry.size, ChunkIndex(entry.text or ""))
+        _chunk_indexes[entry.path] = cached
+    return cached[2]
 
 
 def read_file(file_path: str) -> str:
     """读取文件内容"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        entry = file_cache.get(file_path)
+        if entry.is_binary:
+            raise ValueError("文件不是 UTF-8 文本")
+        return entry.text
     except FileNotFoundError:
         print(f"错误：文件 '{file_path}' 未找到")
         sys.exit(1)
@@ -47,16 +121,32 @@ def read_file(file_path: str) -> str:
         sys.exit(1)
 
 
+def _retrieval_query(messages: list) -> str:
+    # 最近两条用户消息一起检索，"那第二个呢"这类追问也能找到上下文
+    questions = [m.content for m in messages if isinstance(m, HumanMessage)][-2:]
+    return "\n".join(str(q) for q in questions)
+
+
 def chatbot(state: State):
     """聊天机器人节点，处理用户输入并生成回复"""
+    if state.get("mode") == "rag":
+        chunks = get_chunk_index(state["file_path"]).select(_retrieval_query(state["messages"]))
+        file_content = "\n\n".join(
+            f"[第 {c.start_line}-{c.end_line} 行]\n{c.text}" for c in chunks
+        )
+        file_note = "文件较大，下面只给出与当前问题最相关的片段（行号为原文件中的行号），如果片段不足以回答请说明。"
+    else:
+        file_content = state.get("file_content", "")
+        file_note = ""
+
     # 构建系统提示词，包含文件内容
     system_prompt = """你是一个专业的文件分析助手。用户会提供一个文件内容，你需要仔细分析它。
-
+{file_note}
 文件内容：
 {file_content}
 
 请根据用户的问题，对文件内容进行深入分析。如果用户没有提供具体问题，你可以主动提供文件的关键信息摘要。
-""".format(file_content=state.get("file_content", ""))
+""".format(file_note=file_note, file_content=file_content)
 
     # 构建消息列表：系统消息 + 历史消息
     messages = [SystemMessage(content=system_prompt)]
@@ -103,13 +193,22 @@ def main():
     file_content = read_file(file_path)
     print(f"文件读取成功，共 {len(file_content)} 个字符\n")
     
+    mode = os.getenv("CHAT_BK_MODE") or ("rag" if len(file_content) > RAG_FULL_LIMIT else "full")
+    if mode == "rag":
+        # 只切块建索引一次，之后每轮只发送相关的块
+        chunk_count = len(get_chunk_index(file_path).chunks)
+        print(f"文件较大，使用分块检索模式：{chunk_count} 个块，每轮发送最相关的 {RAG_TOP_K} 个\n")
+        file_content = ""
+    
     # 构建图
     graph = build_graph()
     
     # 初始化状态
     initial_state = {
         "messages": [],
-        "file_content": file_content
+        "file_content": file_content,
+        "file_path": file_path,
+        "mode": mode,
     }
     
     # 发送初始分析请求
@@ -152,10 +251,7 @@ def main():
         
         # 处理清空历史命令
         if user_input.lower() == "clear":
-            current_state = {
-                "messages": [],
-                "file_content": file_content
-            }
+            current_state = initial_state
             print("对话历史已清空")
             continue
         
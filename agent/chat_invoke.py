@@ -14,20 +14,17 @@ from typing import Annotated, Literal
 from typing_extensions import TypedDict
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage, AnyMessage
 from langchain.tools import tool
-from pydantic import SecretStr
 
-from load_env import API_KEY, BASE_URL
+from models import get_chat_model
+from tracing import instrument
+from profiling import ReplProfiler
+from rate_limit import get_rate_limiter
 
-# 初始化 LLM
-llm = ChatOpenAI(
-    api_key=SecretStr(API_KEY),
-    base_url=BASE_URL,
-    model="gpt-5.1",
-    temperature=0
-)
+# 初始化 LLM（与其它脚本共用模型注册表和 HTTP 连接池）
+llm = get_chat_model(model="gpt-5.1", temperature=0, rate_limited=True)
+rate_limiter = get_rate_limiter()
 
 
 # 定义工具
@@ -126,7 +123,7 @@ or you think the analyzed file need the content of another file, you should invo
     messages = [SystemMessage(content=system_prompt)]
     messages.extend(state["messages"])
     
-    response = model_with_tools.invoke(messages)
+    response = rate_limiter.call(model_with_tools.invoke, messages)
     
     return {"messages": [response]}
 
@@ -192,7 +189,7 @@ def build_graph():
     # 工具执行后返回 LLM
     graph_builder.add_edge("tool_node", "llm_call")
     
-    return graph_builder.compile()
+    return instrument(graph_builder.compile())
 
 
 def main():
@@ -205,10 +202,12 @@ def main():
     print("  - 'quit', 'exit', 'q' to exit")
     print("  - 'clear' to clear history")
     print("  - 'show' to show chat history")
+    print("  - 'profile on' / 'profile off', 'mem', 'stats' to profile this session")
     print("-" * 60)
     
     # 构建图
     graph = build_graph()
+    profiler = ReplProfiler()
     
     # 初始化状态
     current_state = {"messages": []}
@@ -231,6 +230,10 @@ def main():
             print("clear the chat history")
             continue
         
+        # profile on/off、mem、stats；这里没有 checkpointer，历史就是 current_state
+        if profiler.handle(user_input, owners=lambda: {"message history": current_state["messages"]}):
+            continue
+        
         # 处理查看历史命令
         if user_input.lower() == "show":
             print("\n" + "=" * 60)
@@ -257,7 +260,8 @@ def main():
             }
             
             # 调用图处理
-            result = graph.invoke(new_state)
+            with profiler.turn() as callbacks:
+                result = graph.invoke(new_state, config={"callbacks": callbacks})
             
             # 检查是否有工具调用，并显示相关信息
             tool_calls_made = []
@@ -0,0 +1,194 @@
+"""
+基于 os.scandir 的递归目录索引
+
+os.listdir + os.path.isdir + os.path.getsize 每个条目要多次 stat，而且一次只能看一层。
+DirIndex 用 scandir 一次遍历整棵树，支持深度限制和忽略规则（默认规则 + .gitignore），
+并以生成器的形式流式返回结果。
+
+每个目录的子项列表（名字和类型）按目录 mtime 缓存：再次遍历时只需 stat 目录本身，
+只有 mtime 变化（增删了子项）的目录才会重新扫描。
+文件内容变化不会改变目录 mtime，所以文件大小不进缓存，每次遍历时重新 stat 文件。
+指向目录的符号链接和 os.path.isdir 一样算作目录，但不会进入，避免链接成环。
+"""
+
+import fnmatch
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+DEFAULT_IGNORE = [
+    ".git/", "node_modules/", "__pycache__/", ".venv/", "venv/",
+    ".mypy_cache/", ".pytest_cache/", ".ruff_cache/", ".tox/",
+    "*.pyc", "*.pyo",
+]
+# 缓存的目录数上限，超出时淘汰最久未使用的
+MAX_CACHED_DIRS = int(os.getenv("DIR_INDEX_MAX_DIRS", "4096"))
+
+
+@dataclass(frozen=True)
+class DirEntry:
+    name: str
+    is_dir: bool            # 跟随符号链接，与 os.path.isdir 一致
+    is_link: bool = False
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    """One item yielded by ``DirIndex.walk``."""
+    path: str       # 相对于遍历根目录的路径
+    depth: int      # 根目录下的直接子项为 1
+    is_dir: bool
+    size: int
+    ignored: bool = False   # 被忽略的目录仍会列出，但不会进入
+
+
+class IgnoreRules:
+    """A small subset of .gitignore semantics.
+
+    Supports comments, ``!`` negation, trailing ``/`` for directory-only
+    patterns and leading ``/`` (or an inner ``/``) to anchor at the root.
+    """
+
+    def __init__(self, patterns: Optional[list[str]] = None):
+        self._rules: list[tuple[str, bool, bool, bool]] = []
+        for pattern in patterns or []:
+            self.add(pattern)
+
+    def add(self, pattern: str) -> None:
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith("#"):
+            return
+        negate = pattern.startswith("!")
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        if pattern:
+            self._rules.append((pattern, negate, dir_only, anchored))
+
+    @classmethod
+    def for_root(cls, root: str, extra: Optional[list[str]] = None) -> "IgnoreRules":
+        """Default rules plus the root's .gitignore, if any."""
+        rules = cls(DEFAULT_IGNORE + (extra or []))
+        try:
+            with open(os.path.join(root, ".gitignore"), "r", encoding="utf-8") as f:
+                for line in f:
+                    rules.add(line)
+        except OSError:
+            pass
+        return rules
+
+    def match(self, rel_path: str, is_dir: bool) -> bool:
+        name = rel_path.rsplit("/", 1)[-1]
+        ignored = False
+        # 与 git 一致：后面的规则覆盖前面的
+        for pattern, negate, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            target = rel_path if anchored else name
+            if fnmatch.fnmatchcase(target, pattern):
+                ignored = not negate
+        return ignored
+
+
+class DirIndex:
+    """Recursive directory walker with a per-directory mtime-validated cache."""
+
+    def __init__(self, max_dirs: int = MAX_CACHED_DIRS):
+        self.max_dirs = max_dirs
+        self._dirs: OrderedDict[str, tuple[int, list[DirEntry]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.scans = 0
+        self.reuses = 0
+
+    def scan(self, path: str) -> list[DirEntry]:
+        """Entries of one directory, sorted by name; rescanned only if its mtime changed."""
+        path = os.path.abspath(path)
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._dirs.get(path)
+            if cached is not None and cached[0] == mtime_ns:
+                self._dirs.move_to_end(path)
+                self.reuses += 1
+                return cached[1]
+
+        entries = []
+        with os.scandir(path) as it:
+            for item in it:
+                try:
+                    # 普通条目的类型由 d_type 直接给出，只有符号链接需要额外 stat 目标
+                    is_link = item.is_symlink()
+                    is_dir = item.is_dir()
+                except OSError:
+                    continue
+                entries.append(DirEntry(item.name, is_dir, is_link))
+        entries.sort(key=lambda e: e.name)
+
+        with self._lock:
+            self._dirs[path] = (mtime_ns, entries)
+            self._dirs.move_to_end(path)
+            while len(self._dirs) > self.max_dirs:
+                self._dirs.popitem(last=False)
+            self.scans += 1
+        return entries
+
+    def walk(
+        self,
+        root: str,
+        max_depth: int = 1,
+        pattern: str = "",
+        rules: Optional[IgnoreRules] = None,
+    ) -> Iterator[IndexEntry]:
+        """Yield entries under ``root`` depth-first, in name order.
+
+        Args:
+            max_depth: how many levels to descend, 1 lists only the direct children
+            pattern: glob applied to file names; directories are always yielded
+            rules: ignore rules, defaults to ``IgnoreRules.for_root(root)``
+        """
+        root = os.path.abspath(root)
+        if rules is None:
+            rules = IgnoreRules.for_root(root)
+        yield from self._walk_dir(root, "", 1, max_depth, pattern, rules)
+
+    def _walk_dir(self, abs_dir, rel_dir, depth, max_depth, pattern, rules) -> Iterator[IndexEntry]:
+        try:
+            entries = self.scan(abs_dir)
+        except OSError:
+            return
+        for entry in entries:
+            rel = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            ignored = rules.match(rel, entry.is_dir)
+            if entry.is_dir:
+                yield IndexEntry(rel, depth, True, 0, ignored)
+                # 先序遍历：子目录的内容紧跟在该目录之后
+                if not ignored and not entry.is_link and depth < max_depth:
+                    yield from self._walk_dir(os.path.join(abs_dir, entry.name), rel,
+                                              depth + 1, max_depth, pattern, rules)
+            elif not ignored and (not pattern or fnmatch.fnmatch(entry.name, pattern)):
+                # 大小不缓存：文件被改写时目录 mtime 不变
+                try:
+                    size = os.stat(os.path.join(abs_dir, entry.name)).st_size
+                except OSError:
+                    continue
+                yield IndexEntry(rel, depth, False, size)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        with self._lock:
+            if path is None:
+                self._dirs.clear()
+            else:
+                self._dirs.pop(os.path.abspath(path), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"directories": len(self._dirs), "max_directories": self.max_dirs,
+                    "scans": self.scans, "reuses": self.reuses}
+
+
+# 进程内共享的目录索引
+dir_index = DirIndex()
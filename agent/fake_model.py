@@ -0,0 +1,206 @@
+"""
+离线的脚本化聊天模型
+
+所有脚本都直接构造 ChatOpenAI，没有网络就无法测量图本身的开销。
+ScriptedChatModel 按顺序回放预先写好的回复（可以包含 tool_calls），
+支持按 token 流式输出并模拟首 token 延迟和每个 token 的延迟，
+结果可重复，适合做吞吐和延迟的基准测试。
+
+脚本是一个 JSON 列表，每一项是一次模型回复：
+    {"content": "text", "tool_calls": [{"name": "read_file_tool", "args": {"file_path": "a.txt"}}]}
+    {"structured": {"intent": "bug", ...}}      # 供 with_structured_output 使用
+脚本为空时回显最后一条用户消息。
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterator, Literal, Optional, get_args, get_origin, get_type_hints
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import PrivateAttr
+
+_TOKEN_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text)
+
+
+def _default_for(schema) -> dict:
+    """A placeholder instance of a TypedDict schema: first Literal option, empty str, ..."""
+    result = {}
+    for name, hint in get_type_hints(schema).items():
+        if get_origin(hint) is Literal:
+            result[name] = get_args(hint)[0]
+        elif hint in (int, float):
+            result[name] = hint()
+        else:
+            result[name] = ""
+    return result
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Chat model that replays scripted responses with simulated latency.
+
+    Args:
+        responses: scripted replies, see the module docstring for the format
+        cycle: start over when the script runs out instead of echoing
+        first_token_latency: seconds before the first token
+        token_latency: seconds between tokens
+        streaming: stream tokens from ``invoke`` (mirrors ``ChatOpenAI(streaming=True)``)
+    """
+
+    responses: list[dict] = []
+    cycle: bool = True
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    streaming: bool = False
+    model_name: str = "scripted"
+
+    _index: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ScriptedChatModel":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(responses=json.load(f), **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model_name": self.model_name}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._index = 0
+
+    def _next_response(self, messages: list[BaseMessage]) -> dict:
+        with self._lock:
+            if self._index < len(self.responses):
+                response = self.responses[self._index]
+                self._index += 1
+                if self.cycle and self._index == len(self.responses):
+                    self._index = 0
+                return response
+        # 没有脚本时回显最后一条用户消息
+        last_human = next((m for m in reversed(messages) if isinstance(m, HumanMessage)), None)
+        return {"content": str(last_human.content) if last_human else ""}
+
+    @staticmethod
+    def _tool_calls(response: dict) -> list[dict]:
+        return [
+            {"name": tc["name"], "args": tc.get("args", {}), "id": tc.get("id") or f"call_{uuid.uuid4().hex[:12]}"}
+            for tc in response.get("tool_calls", [])
+        ]
+
+    def _total_latency(self, tokens: list[str]) -> float:
+        return self.first_token_latency + self.token_latency * max(0, len(tokens) - 1)
+
+    # ---- 非流式 ----
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        response = self._next_response(messages)
+        content = response.get("content", "")
+        delay = self._total_latency(_tokenize(content))
+        if delay:
+            time.sleep(delay)
+        message = AIMessage(content=content, tool_calls=self._tool_calls(response))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        response = self._next_response(messages)
+        content = response.get("content", "")
+        delay = self._total_latency(_tokenize(content))
+        if delay:
+            await asyncio.sleep(delay)
+        message = AIMessage(content=content, tool_calls=self._tool_calls(response))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    # ---- 流式 ----
+
+    def _chunks(self, response: dict) -> Iterator[AIMessageChunk]:
+        for token in _tokenize(response.get("content", "")):
+            yield AIMessageChunk(content=token)
+        tool_calls = self._tool_calls(response)
+        if tool_calls:
+            # 工具调用放在最后一个 chunk 里，与 OpenAI 流式接口的行为一致
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc["id"], "index": i}
+                    for i, tc in enumerate(tool_calls)
+                ],
+            )
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        response = self._next_response(messages)
+        for i, message in enumerate(self._chunks(response)):
+            delay = self.first_token_latency if i == 0 else self.token_latency
+            if delay:
+                time.sleep(delay)
+            chunk = ChatGenerationChunk(message=message)
+            if run_manager:
+                run_manager.on_llm_new_token(str(message.content), chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        response = self._next_response(messages)
+        for i, message in enumerate(self._chunks(response)):
+            delay = self.first_token_latency if i == 0 else self.token_latency
+            if delay:
+                await asyncio.sleep(delay)
+            chunk = ChatGenerationChunk(message=message)
+            if run_manager:
+                await run_manager.on_llm_new_token(str(message.content), chunk=chunk)
+            yield chunk
+
+    # ---- 工具与结构化输出 ----
+
+    def bind_tools(self, tools, **kwargs) -> "ScriptedChatModel":
+        # 脚本里已经写好了要调用的工具，这里不需要把工具传给模型
+        return self
+
+    def with_structured_output(self, schema, **kwargs):
+        def _structured(prompt) -> dict:
+            messages = prompt if isinstance(prompt, list) else [HumanMessage(content=str(prompt))]
+            response = self._next_response(messages)
+            if "structured" in response:
+                return response["structured"]
+            return _default_for(schema)
+
+        return RunnableLambda(_structured)
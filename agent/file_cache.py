@@ -0,0 +1,178 @@
+"""
+共享的文件内容缓存
+
+同一个会话里 agent 会反复读取同一批文件。FileCache 以 (path, mtime, size) 为键缓存
+文件内容、二进制/文本判断以及各工具格式化好的输出；文件没有变化时只需要一次 stat，
+不再重新读盘和解码。缓存按 LRU 淘汰，总大小受字节预算限制。
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+# 默认缓存预算 64MB，可通过环境变量 FILE_CACHE_MAX_BYTES 调整
+DEFAULT_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+@dataclass
+class FileEntry:
+    """One cached file version."""
+    path: str
+    mtime_ns: int
+    size: int
+    text: Optional[str]             # utf-8 解码后的文本，二进制文件为 None
+    data: Optional[bytes] = None    # 仅二进制文件保留原始字节
+    renders: dict = field(default_factory=dict)
+    nbytes: int = 0
+
+    @property
+    def key(self) -> tuple:
+        return (self.path, self.mtime_ns, self.size)
+
+    @property
+    def is_binary(self) -> bool:
+        return self.text is None
+
+    def decode_lossy(self) -> str:
+        """Text with undecodable bytes dropped, like ``open(errors="ignore")``."""
+        if self.text is not None:
+            return self.text
+        return _normalize_newlines(self.data.decode("utf-8", errors="ignore"))
+
+
+def _normalize_newlines(text: str) -> str:
+    # 与 open() 文本模式的 universal newlines 行为保持一致
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _sizeof(value) -> int:
+    if isinstance(value, str):
+        # 粗略估计：按 utf-8 编码后的长度计
+        return len(value.encode("utf-8", errors="ignore"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return 0
+
+
+class FileCache:
+    """Thread-safe LRU cache of file contents with a byte budget."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, FileEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path: str) -> FileEntry:
+        """Return the cached entry for ``path``, reading the file only if it changed.
+
+        Raises the same ``OSError`` subclasses as ``os.stat`` / ``open``.
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.key == key:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = self._load(path, st)
+
+        with self._lock:
+            self._discard(path)
+            if entry.nbytes <= self.max_bytes:
+                self._entries[path] = entry
+                self.total_bytes += entry.nbytes
+                self._evict()
+        return entry
+
+    def peek(self, path: str) -> Optional[FileEntry]:
+        """Return the entry only if it is cached and still fresh; never reads the file."""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.key == (path, st.st_mtime_ns, st.st_size):
+                return entry
+        return None
+
+    def render(self, entry: FileEntry, name: str, formatter: Callable[[FileEntry], str]) -> str:
+        """Memoize ``formatter(entry)`` on the entry under ``name``."""
+        with self._lock:
+            cached = entry.renders.get(name)
+            if cached is not None:
+                return cached
+
+        output = formatter(entry)
+
+        with self._lock:
+            if name not in entry.renders:
+                entry.renders[name] = output
+                size = _sizeof(output)
+                entry.nbytes += size
+                # 条目可能已经被淘汰，只有仍在缓存中时才计入预算
+                if self._entries.get(entry.path) is entry:
+                    self.total_bytes += size
+                    self._evict()
+        return output
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self.total_bytes = 0
+            else:
+                self._discard(os.path.abspath(path))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _load(self, path: str, st: os.stat_result) -> FileEntry:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            text = _normalize_newlines(data.decode("utf-8"))
+            entry = FileEntry(path, st.st_mtime_ns, st.st_size, text)
+        except UnicodeDecodeError:
+            entry = FileEntry(path, st.st_mtime_ns, st.st_size, None, data)
+        entry.nbytes = _sizeof(entry.text) + _sizeof(entry.data)
+        return entry
+
+    def _discard(self, path: str) -> None:
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self.total_bytes -= old.nbytes
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self.total_bytes -= old.nbytes
+            self.evictions += 1
+
+
+# 进程内共享的缓存实例
+file_cache = FileCache()
@@ -0,0 +1,420 @@
+"""
+文件结构概要（outline）
+
+很多时候模型只需要先知道文件里有什么：类、函数签名、docstring 第一行，或者 JSON 的键、
+CSV 的列和行数，再决定要不要读全文。这里按文件类型生成概要：
+- Python: ast 解析，列出 import、常量、类/方法/函数的签名和 docstring 首行
+- JSON / JSONL: 键和值类型（schema），数组给出长度和元素结构
+- YAML: 同 JSON（需要 PyYAML，没装时退化为扫描顶层键）
+- CSV / TSV: 表头、推断的列类型、行数
+- Markdown: 标题层级
+小文件的概要通过 file_cache.render 缓存在文件条目上，文件 mtime/size 变化后自然失效。
+超过 FULL_READ_LIMIT 的文件不进 file_cache，结果按 (path, mtime, size) 缓存：
+- CSV/JSONL 只分析开头一页，行数流式统计
+- 其它类型不超过 FILE_OUTLINE_MAX_BYTES（Python/YAML 是 FILE_OUTLINE_SLOW_MAX_BYTES）时直接读整个文件解析
+- 更大的 JSON 从开头 JSON_HEAD_BYTES 里逐个解码顶层元素（或键），给出顶层结构；更大的 YAML 只列出开头部分的顶层键
+"""
+
+import ast
+import csv
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from file_cache import FileEntry, file_cache
+from file_pager import FULL_READ_LIMIT
+
+try:
+    import yaml
+except ImportError:  # PyYAML 是可选依赖
+    yaml = None
+
+# 概要输出的上限，避免超大 schema 或上千个函数又把上下文撑爆
+MAX_OUTLINE_LINES = 300
+MAX_SCHEMA_DEPTH = 4
+MAX_SCHEMA_KEYS = 40
+SCHEMA_SAMPLE_ITEMS = 20
+CSV_SAMPLE_ROWS = 200
+HEAD_BYTES = 64 * 1024
+# 概要只在内存里解析一次，不进 file_cache，可以比整份读取的上限大得多
+FILE_OUTLINE_MAX_BYTES = int(os.getenv("FILE_OUTLINE_MAX_BYTES", str(16 * 1024 * 1024)))
+# ast 和 PyYAML 的纯 Python 加载器比 json.loads 慢一两个数量级，单独用更小的上限
+FILE_OUTLINE_SLOW_MAX_BYTES = int(os.getenv("FILE_OUTLINE_SLOW_MAX_BYTES", str(4 * 1024 * 1024)))
+_SLOW_KINDS = ("python", "yaml")
+JSON_HEAD_BYTES = 1024 * 1024
+_MAX_LARGE_OUTLINES = 64
+
+_KINDS = {
+    ".py": "python", ".pyi": "python",
+    ".json": "json", ".jsonl": "jsonl", ".ndjson": "jsonl",
+    ".yaml": "yaml", ".yml": "yaml",
+    ".csv": "csv", ".tsv": "csv",
+    ".md": "markdown", ".markdown": "markdown",
+}
+
+
+def outline_kind(path: str) -> Optional[str]:
+    return _KINDS.get(os.path.splitext(path)[1].lower())
+
+
+def _first_line(doc: Optional[str]) -> str:
+    if not doc:
+        return ""
+    line = doc.strip().splitlines()[0].strip()
+    return line if len(line) <= 100 else line[:100] + "..."
+
+
+def _signature(node) -> str:
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns is not None else ""
+    return f"{prefix} {node.name}({ast.unparse(node.args)}){returns}"
+
+
+def _outline_python(text: str) -> list[str]:
+    try:
+        tree = ast.parse(text)
+    except SyntaxError as e:
+        return [f"SyntaxError at line {e.lineno}: {e.msg}; use read_file_page to inspect it"]
+
+    out = []
+    doc = _first_line(ast.get_docstring(tree))
+    if doc:
+        out.append(f'"""{doc}"""')
+    imports = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imports += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            imports.append("." * node.level + (node.module or ""))
+    if imports:
+        out.append("imports: " + ", ".join(dict.fromkeys(imports)))
+
+    def visit(body, indent: str) -> None:
+        for node in body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and len(out) > MAX_OUTLINE_LINES:
+                # 超过上限的行不会输出，只占位计数，省掉 ast.unparse
+                out.extend([""] * (len(node.decorator_list) + 1))
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, indent + "  ")
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                for decorator in node.decorator_list:
+                    out.append(f"{indent}L{decorator.lineno} @{ast.unparse(decorator)}")
+                if isinstance(node, ast.ClassDef):
+                    bases = ", ".join(ast.unparse(b) for b in node.bases + node.keywords)
+                    line = f"{indent}L{node.lineno} class {node.name}" + (f"({bases})" if bases else "")
+                else:
+                    line = f"{indent}L{node.lineno} {_signature(node)}"
+                doc = _first_line(ast.get_docstring(node))
+                out.append(line + (f"  # {doc}" if doc else ""))
+                # 只展开类的成员，函数体内部的嵌套定义不列出
+                if isinstance(node, ast.ClassDef):
+                    visit(node.body, indent + "  ")
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)) and indent == "":
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                names = [t.id for t in targets if isinstance(t, ast.Name)]
+                if names:
+                    out.append(f"L{node.lineno} {' = '.join(names)}")
+            elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+                # dataclass / TypedDict 字段
+                out.append(f"{indent}L{node.lineno} {node.target.id}: {ast.unparse(node.annotation)}")
+            elif (isinstance(node, ast.If) and indent == ""
+                  and "__name__" in ast.unparse(node.test)):
+                out.append(f"L{node.lineno} if {ast.unparse(node.test)}: ...")
+
+    visit(tree.body, "")
+    return out
+
+
+def _type_name(value: Any) -> str:
+    if value is None:
+        return "null"
+    return {bool: "bool", int: "int", float: "float", str: "str"}.get(type(value), type(value).__name__)
+
+
+def _schema(value: Any, indent: str, depth: int, out: list[str]) -> None:
+    """Append 'key: type' lines describing ``value``; lists are summarized by their items."""
+    if isinstance(value, dict):
+        for i, (key, item) in enumerate(value.items()):
+            if i >= MAX_SCHEMA_KEYS:
+                out.append(f"{indent}... ({len(value) - MAX_SCHEMA_KEYS} more keys)")
+                break
+            out.append(f"{indent}{key}: {_describe(item)}")
+            if depth < MAX_SCHEMA_DEPTH and isinstance(item, (dict, list)):
+                _schema(item, indent + "  ", depth + 1, out)
+    elif isinstance(value, list):
+        items = value[:SCHEMA_SAMPLE_ITEMS]
+        dicts = [item for item in items if isinstance(item, dict)]
+        if dicts:
+            # 合并前几个元素的键，字段缺失的情况也能看到
+            merged: dict = {}
+            for item in dicts:
+                for key, sub in item.items():
+                    merged.setdefault(key, sub)
+            _schema(merged, indent, depth, out)
+        elif items and isinstance(items[0], list):
+            _schema(items[0], indent, depth, out)
+
+
+def _item_kinds(items: list) -> str:
+    kinds = sorted({_type_name(v) if not isinstance(v, (dict, list)) else
+                    ("object" if isinstance(v, dict) else "array") for v in items[:SCHEMA_SAMPLE_ITEMS]})
+    return f" of {'|'.join(kinds)}" if kinds else ""
+
+
+def _describe(value: Any) -> str:
+    if isinstance(value, dict):
+        return f"object ({len(value)} keys)"
+    if isinstance(value, list):
+        return f"array[{len(value)}]" + _item_kinds(value)
+    if isinstance(value, str) and len(value) > 40:
+        return f"str ({len(value)} chars)"
+    return _type_name(value) if isinstance(value, str) or value is None else f"{_type_name(value)} = {value!r}"
+
+
+def _outline_data(value: Any) -> list[str]:
+    out = [f"top level: {_describe(value)}"]
+    _schema(value, "  ", 1, out)
+    return out
+
+
+def _outline_json(text: str) -> list[str]:
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError as e:
+        return [f"invalid JSON at line {e.lineno} column {e.colno}: {e.msg}"]
+    return _outline_data(value)
+
+
+_JSON_SEPARATORS = re.compile(r"[\s,]*")
+_JSON_COLON = re.compile(r"\s*:\s*")
+
+
+def _outline_json_head(head: str) -> list[str]:
+    """Top-level shape of a JSON document of which only ``head`` was read."""
+    text = head.lstrip()
+    if not text or text[0] not in "[{":
+        return ["top level: a single value larger than the sampled part"]
+    decoder = json.JSONDecoder()
+    is_object = text[0] == "{"
+    items: list = []
+    keys: dict = {}
+    cut_key = None
+    pos = 1
+    # 逐个解码顶层元素，解码失败说明这个元素被采样截断了
+    while True:
+        pos = _JSON_SEPARATORS.match(text, pos).end()
+        if pos >= len(text) or text[pos] in "]}":
+            break
+        try:
+            if is_object:
+                key, pos = decoder.raw_decode(text, pos)
+                colon = _JSON_COLON.match(text, pos)
+                if colon is None:
+                    break
+                cut_key, pos = key, colon.end()
+            value, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        if is_object:
+            keys[cut_key] = value
+            cut_key = None
+        else:
+            items.append(value)
+    if is_object:
+        out = [f"top level: object, {len(keys)} keys in the sampled part"]
+        _schema(keys, "  ", 1, out)
+        if cut_key is not None:
+            out.append(f"  {cut_key}: (value continues past the sampled part)")
+    else:
+        out = [f"top level: array{_item_kinds(items)}, first {len(items)} elements in the sampled part"]
+        _schema(items, "  ", 1, out)
+    return out
+
+
+def _outline_jsonl(lines: list[str], total_rows: Optional[int] = None) -> list[str]:
+    rows, errors = [], 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError:
+            errors += 1
+    count = total_rows if total_rows is not None else len(rows) + errors
+    out = [f"rows: {count}" + (f" ({errors} invalid in the sampled part)" if errors else "")]
+    out.append("row schema:")
+    _schema(rows[:SCHEMA_SAMPLE_ITEMS], "  ", 1, out)
+    return out
+
+
+def _yaml_top_keys(text: str) -> list[str]:
+    return [f"  {line.split(':', 1)[0]}" for line in text.splitlines()
+            if line and not line[0].isspace() and not line.startswith("#") and ":" in line]
+
+
+def _outline_yaml(text: str) -> list[str]:
+    if yaml is None:
+        return ["(PyYAML not installed, top-level keys only)"] + _yaml_top_keys(text)
+    try:
+        documents = list(yaml.safe_load_all(text))
+    except yaml.YAMLError as e:
+        return [f"invalid YAML: {e}"]
+    if len(documents) == 1:
+        return _outline_data(documents[0])
+    out = [f"{len(documents)} documents"]
+    for i, document in enumerate(documents[:5]):
+        out.append(f"document {i}: {_describe(document)}")
+        _schema(document, "  ", 1, out)
+    return out
+
+
+def _column_type(values: list[str]) -> str:
+    values = [v for v in values if v != ""]
+    if not values:
+        return "empty"
+    for kind, cast in (("int", int), ("float", float)):
+        try:
+            for v in values:
+                cast(v)
+            return kind
+        except ValueError:
+            continue
+    return "str"
+
+
+def _outline_csv(head: str, path: str, total_rows: Optional[int] = None) -> list[str]:
+    try:
+        dialect = csv.Sniffer().sniff(head[:8192], delimiters=",\t;|")
+        delimiter = dialect.delimiter
+    except csv.Error:
+        delimiter = "\t" if path.lower().endswith(".tsv") else ","
+    reader = csv.reader(io.StringIO(head), delimiter=delimiter)
+    header = next(reader, [])
+    sample = []
+    for row in reader:
+        sample.append(row)
+        if len(sample) >= CSV_SAMPLE_ROWS:
+            break
+    if total_rows is None:
+        total_rows = len(sample) + sum(1 for _ in reader)
+    out = [f"delimiter: {delimiter!r}, {len(header)} columns, {total_rows} data rows"]
+    for i, name in enumerate(header):
+        column = [row[i] for row in sample if i < len(row)]
+        example = next((v for v in column if v), "")
+        example = example if len(example) <= 40 else example[:40] + "..."
+        out.append(f"  {name}: {_column_type(column)}" + (f"  e.g. {example!r}" if example else ""))
+    return out
+
+
+def _outline_markdown(text: str) -> list[str]:
+    out, fenced = [], False
+    for lineno, line in enumerate(text.splitlines(), 1):
+        if line.startswith("```"):
+            fenced = not fenced
+        elif not fenced and line.startswith("#"):
+            level = len(line) - len(line.lstrip("#"))
+            out.append(f"{'  ' * (level - 1)}L{lineno} {line.lstrip('#').strip()}")
+    return out or ["(no headings)"]
+
+
+def _finish(path: str, kind: str, size: int, lines: int, body: list[str]) -> str:
+    header = f"outline of '{path}' ({kind}, {size} bytes, {lines} lines)"
+    if len(body) > MAX_OUTLINE_LINES:
+        body = body[:MAX_OUTLINE_LINES] + [f"... ({len(body) - MAX_OUTLINE_LINES} more lines truncated)"]
+    return "\n".join([header] + body)
+
+
+def _format_entry(entry: FileEntry) -> str:
+    return _outline_text(entry.path, outline_kind(entry.path), entry.size, entry.decode_lossy())
+
+
+def _outline_text(path: str, kind: str, size: int, text: str) -> str:
+    lines = text.count("\n") + (1 if text and not text.endswith("\n") else 0)
+    if kind == "python":
+        body = _outline_python(text)
+    elif kind == "json":
+        body = _outline_json(text)
+    elif kind == "jsonl":
+        body = _outline_jsonl(text.splitlines())
+    elif kind == "yaml":
+        body = _outline_yaml(text)
+    elif kind == "csv":
+        body = _outline_csv(text, path)
+    else:
+        body = _outline_markdown(text)
+    return _finish(path, kind, size, lines, body)
+
+
+_large: "OrderedDict[tuple, str]" = OrderedDict()
+_large_lock = threading.Lock()
+
+
+def _count_lines(path: str) -> tuple[int, bool]:
+    """Number of lines and whether the file ends with a newline, read in 1 MB chunks."""
+    count, last = 0, b"\n"
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            count += chunk.count(b"\n")
+            last = chunk[-1:]
+    return count, last == b"\n"
+
+
+def _outline_large(path: str, kind: str, st: os.stat_result) -> str:
+    """Outline a file too big for the cache, read directly or sampled from its head."""
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _large_lock:
+        cached = _large.get(key)
+        if cached is not None:
+            _large.move_to_end(key)
+            return cached
+
+    limit = FILE_OUTLINE_SLOW_MAX_BYTES if kind in _SLOW_KINDS else FILE_OUTLINE_MAX_BYTES
+    if kind not in ("csv", "jsonl") and st.st_size <= limit:
+        with open(path, "rb") as f:
+            output = _outline_text(path, kind, st.st_size, f.read().decode("utf-8", errors="ignore"))
+    elif kind in ("python", "markdown"):
+        return (f"'{path}' ({kind}, {st.st_size} bytes) is too large to outline, "
+                f"use read_file_page to read parts of it")
+    else:
+        newlines, complete = _count_lines(path)
+        lines = newlines + (0 if complete else 1)
+        with open(path, "rb") as f:
+            head = f.read(HEAD_BYTES if kind in ("csv", "jsonl") else JSON_HEAD_BYTES)
+        head = head.decode("utf-8", errors="ignore")
+        if kind == "json":
+            body = _outline_json_head(head)
+        else:
+            # 最后一行可能被截断，丢掉
+            head = head[:head.rfind("\n") + 1] or head
+            if kind == "yaml":
+                body = ["top-level keys in the sampled part:"] + _yaml_top_keys(head)
+            elif kind == "csv":
+                body = _outline_csv(head, path, total_rows=max(0, lines - 1))
+            else:
+                body = _outline_jsonl(head.splitlines(), total_rows=lines)
+        body.append(f"(schema sampled from the first {len(head)} bytes)")
+        output = _finish(path, kind, st.st_size, lines, body)
+
+    with _large_lock:
+        _large[key] = output
+        while len(_large) > _MAX_LARGE_OUTLINES:
+            _large.popitem(last=False)
+    return output
+
+
+def file_outline(path: str) -> str:
+    """Outline of ``path``; raises OSError / ValueError for missing or unsupported files."""
+    path = os.path.abspath(path)
+    kind = outline_kind(path)
+    if kind is None:
+        raise ValueError(f"no outline for '{os.path.splitext(path)[1] or path}' files, "
+                         f"supported: {', '.join(sorted(_KINDS))}")
+    st = os.stat(path)
+    if st.st_size > FULL_READ_LIMIT:
+        return _outline_large(path, kind, st)
+    entry = file_cache.get(path)
+    return file_cache.render(entry, "file_outline", _format_entry)
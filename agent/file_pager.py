@@ -0,0 +1,202 @@
+"""
+基于 mmap 的分页文件读取
+
+整文件读取会让大文件（例如几百 MB 的日志）撑爆内存和上下文窗口。
+这里只把请求的那一段字节/行映射出来，内存占用与文件大小无关：
+- read_byte_range: 按 offset/length 读取一段字节
+- read_line_range: 按行号读取，行号到偏移量的映射使用稀疏索引（每 LINE_INDEX_STRIDE 行记一个点）
+"""
+
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# 超过这个大小的文件不再整体读取，改为分页
+FULL_READ_LIMIT = int(os.getenv("FULL_READ_LIMIT", str(1024 * 1024)))
+DEFAULT_PAGE_BYTES = 16 * 1024
+MAX_PAGE_BYTES = 256 * 1024
+MAX_PAGE_LINES = 2000
+LINE_INDEX_STRIDE = 1024
+_MAX_LINE_INDEXES = 32
+
+
+@dataclass
+class Page:
+    """A decoded slice of a file."""
+    path: str
+    file_size: int
+    start: int          # 起始字节偏移
+    end: int            # 结束字节偏移（不含）
+    text: str
+    first_line: int = 0  # 按行读取时的起始行号（从 1 开始），按字节读取时为 0
+    last_line: int = 0
+    line_truncated: bool = False  # last_line 超过 MAX_PAGE_BYTES，只读到了 end，剩余部分要按字节读
+
+    @property
+    def has_more(self) -> bool:
+        return self.end < self.file_size
+
+
+def _utf8_boundary(mm, pos: int, size: int) -> int:
+    """Move ``pos`` back to the start of the utf-8 sequence it falls into."""
+    # utf-8 的后续字节形如 0b10xxxxxx，最多回退 3 个字节
+    back = 0
+    while 0 < pos < size and back < 3 and (mm[pos] & 0xC0) == 0x80:
+        pos -= 1
+        back += 1
+    return pos
+
+
+class _LineIndex:
+    """Sparse map from line number to byte offset, built lazily."""
+
+    def __init__(self, key: tuple):
+        self.key = key
+        # checkpoints[i] 是第 i * LINE_INDEX_STRIDE + 1 行的起始偏移
+        self.checkpoints = [0]
+        self.complete = False
+        self.total_lines = 0
+
+    def offset_of(self, mm, size: int, line: int) -> int:
+        """Byte offset of 1-based ``line``; ``size`` if the file is shorter."""
+        slot, rest = divmod(line - 1, LINE_INDEX_STRIDE)
+        while len(self.checkpoints) <= slot and not self.complete:
+            self._extend(mm, size)
+        if slot >= len(self.checkpoints):
+            return size
+        pos = self.checkpoints[slot]
+        for _ in range(rest):
+            nl = mm.find(b"\n", pos)
+            if nl < 0:
+                return size
+            pos = nl + 1
+        return pos
+
+    def _extend(self, mm, size: int) -> None:
+        pos = self.checkpoints[-1]
+        for _ in range(LINE_INDEX_STRIDE):
+            nl = mm.find(b"\n", pos)
+            if nl < 0 or nl + 1 >= size:
+                self.complete = True
+                return
+            pos = nl + 1
+        self.checkpoints.append(pos)
+
+
+_line_indexes: "OrderedDict[str, _LineIndex]" = OrderedDict()
+_line_index_lock = threading.Lock()
+
+
+def _get_line_index(path: str, st: os.stat_result) -> _LineIndex:
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _line_index_lock:
+        index = _line_indexes.get(path)
+        if index is None or index.key != key:
+            index = _LineIndex(key)
+            _line_indexes[path] = index
+        _line_indexes.move_to_end(path)
+        while len(_line_indexes) > _MAX_LINE_INDEXES:
+            _line_indexes.popitem(last=False)
+        return index
+
+
+def _open_map(path: str):
+    f = open(path, "rb")
+    try:
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+        f.close()
+        raise
+
+
+def read_byte_range(path: str, offset: int = 0, length: int = DEFAULT_PAGE_BYTES) -> Page:
+    """Read ``length`` bytes starting at ``offset``, trimmed to whole utf-8 characters."""
+    path = os.path.abspath(path)
+    length = max(1, min(length, MAX_PAGE_BYTES))
+    size = os.path.getsize(path)
+    offset = max(0, min(offset, size))
+    if size == 0:
+        return Page(path, 0, 0, 0, "")
+
+    f, mm = _open_map(path)
+    try:
+        start = _utf8_boundary(mm, offset, size)
+        end = min(start + length, size)
+        end = _utf8_boundary(mm, end, size)
+        if end <= start:
+            # 单个字符就超过了 length，至少返回这一个字符
+            end = min(start + 4, size)
+        text = mm[start:end].decode("utf-8", errors="replace")
+    finally:
+        mm.close()
+        f.close()
+    return Page(path, size, start, end, text)
+
+
+def read_line_range(path: str, start_line: int = 1, end_line: int = 0) -> Page:
+    """Read lines ``start_line``..``end_line`` (1-based, inclusive).
+
+    ``end_line`` <= 0 means ``start_line + MAX_PAGE_LINES - 1``. The page is also
+    capped at ``MAX_PAGE_BYTES``; check ``Page.last_line`` to see where it stopped.
+    A single line longer than that is cut and ``Page.line_truncated`` is set; the
+    rest of it can be read with ``read_byte_range(path, page.end)``.
+    """
+    path = os.path.abspath(path)
+    start_line = max(1, start_line)
+    if end_line <= 0 or end_line - start_line + 1 > MAX_PAGE_LINES:
+        end_line = start_line + MAX_PAGE_LINES - 1
+    if end_line < start_line:
+        raise ValueError("end_line must be >= start_line")
+
+    st = os.stat(path)
+    size = st.st_size
+    if size == 0:
+        return Page(path, 0, 0, 0, "", start_line, start_line - 1)
+
+    index = _get_line_index(path, st)
+    f, mm = _open_map(path)
+    try:
+        start = index.offset_of(mm, size, start_line)
+        pos = start
+        last_line = start_line - 1
+        while last_line < end_line and pos < size:
+            nl = mm.find(b"\n", pos)
+            next_pos = size if nl < 0 else nl + 1
+            if next_pos - start > MAX_PAGE_BYTES and last_line >= start_line:
+                break
+            pos = next_pos
+            last_line += 1
+        end = pos
+        truncated = end - start > MAX_PAGE_BYTES
+        if truncated:
+            end = _utf8_boundary(mm, start + MAX_PAGE_BYTES, size)
+        text = mm[start:end].decode("utf-8", errors="replace")
+    finally:
+        mm.close()
+        f.close()
+    return Page(path, size, start, end, text, start_line, last_line, truncated)
+
+
+def page_hint(page: Page, end_text: str = "end of file") -> str:
+    """How to fetch what follows ``page``."""
+    if not page.has_more:
+        return end_text
+    if page.line_truncated:
+        return (f"line {page.last_line} is longer than {MAX_PAGE_BYTES} bytes and was cut at byte {page.end}; "
+                f"next: offset={page.end} for the rest of it, or start_line={page.last_line + 1}")
+    if page.first_line:
+        return f"next: start_line={page.last_line + 1}"
+    return f"next: offset={page.end}"
+
+
+def format_page(page: Page) -> str:
+    """Render a page as tool output, telling the model how to fetch the next one."""
+    if page.first_line:
+        header = (f"file: '{page.path}' , size: {page.file_size} bytes, "
+                  f"lines {page.first_line}-{page.last_line}")
+    else:
+        header = (f"file: '{page.path}' , size: {page.file_size} bytes, "
+                  f"bytes {page.start}-{page.end}")
+    return f"{header} ({page_hint(page)}), content:\n\n{page.text}"
@@ -0,0 +1,365 @@
+"""
+多进程的文件内容搜索
+
+模型要找某个定义时，只能 list_directory 再逐个 read_file_tool，整份文件都进上下文。
+search_tree 在一次调用里搜完整棵目录树，只返回命中的行和少量上下文：
+- 文件列表来自 dir_index.walk，遵守默认忽略规则和 .gitignore
+- 每个文件先读开头 BINARY_SNIFF_BYTES 字节，含 NUL 视为二进制直接跳过
+- 字面量查询先在原始字节上查子串；再对整份文本做一次 regex.search，没有命中的文件不会按行切分
+- 文件按批次分给进程池（正则匹配是纯 CPU，线程受 GIL 限制），文件少的字面量查询在进程内直接搜
+- 命中数达到上限后取消剩余批次；一个批次运行超过 SEARCH_TIMEOUT_SECONDS 时（例如灾难性回溯的正则）
+  返回已经拿到的部分结果，新的搜索换用新进程池，旧池的 worker 被结束；同时在旧池上运行的其它搜索
+  会在新进程池上重跑没收集到的批次。正则查询总是走进程池，才能被超时打断
+
+进程池要在其它线程启动之前创建：入口脚本在 main() 开头调用 start_pool()，用 fork 立即创建
+worker（fork 多线程进程是不安全的，3.12 起会警告）。如果第一次用到进程池时已经有其它线程
+（没有调用 start_pool，或者 worker 被超时结束后重建），改用 forkserver。
+"""
+
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Optional
+
+from dir_index import dir_index
+
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", str(min(8, os.cpu_count() or 1))))
+# 文件数少于这个值时不走进程池，省掉序列化和调度的开销
+SEARCH_PARALLEL_MIN_FILES = int(os.getenv("SEARCH_PARALLEL_MIN_FILES", "64"))
+SEARCH_BATCH_FILES = 32
+SEARCH_MAX_DEPTH = int(os.getenv("SEARCH_MAX_DEPTH", "32"))
+SEARCH_MAX_FILE_BYTES = int(os.getenv("SEARCH_MAX_FILE_BYTES", str(4 * 1024 * 1024)))
+SEARCH_MAX_MATCHES = int(os.getenv("SEARCH_MAX_MATCHES", "200"))
+SEARCH_TIMEOUT_SECONDS = float(os.getenv("SEARCH_TIMEOUT_SECONDS", "30"))
+# 批次还在排队时多久查看一次它是否开始运行，排队的时间不计入超时
+_QUEUE_POLL_SECONDS = 0.1
+MAX_MATCHES_PER_FILE = 20
+MAX_CONTEXT_LINES = 5
+MAX_LINE_CHARS = 240
+BINARY_SNIFF_BYTES = 8192
+
+
+@dataclass
+class FileMatches:
+    """Matches in one file: (line_no, is_match, text) rows, context rows included."""
+    path: str
+    rows: list[tuple[int, bool, str]]
+    matches: int
+    truncated: bool = False
+
+
+@dataclass
+class SearchResult:
+    root: str
+    query: str
+    files: list[FileMatches] = field(default_factory=list)
+    scanned: int = 0
+    skipped_binary: int = 0
+    skipped_large: int = 0
+    matches: int = 0
+    truncated: bool = False
+    timed_out: bool = False
+
+
+def _compile(query: str, regex: bool, case_sensitive: bool) -> "re.Pattern[str]":
+    flags = re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE
+    return re.compile(query if regex else re.escape(query), flags)
+
+
+def _needle(query: str, regex: bool, case_sensitive: bool) -> Optional[bytes]:
+    """Bytes that every matching file must contain, for literal queries.
+
+    bytes.lower() only folds ASCII, so a case-insensitive non-ASCII query gets no prefilter.
+    """
+    if regex or not query or (not case_sensitive and not query.isascii()):
+        return None
+    return query.encode("utf-8") if case_sensitive else query.lower().encode("utf-8")
+
+
+def _clip(line: str) -> str:
+    line = line.rstrip("\r")
+    return line if len(line) <= MAX_LINE_CHARS else line[:MAX_LINE_CHARS] + " ..."
+
+
+def _search_file(root: str, rel: str, compiled: "re.Pattern[str]", needle: Optional[bytes],
+                 context: int, limit: int) -> tuple[str, Optional[FileMatches]]:
+    """Search one file. Returns (status, matches); status is 'ok', 'binary' or 'error'."""
+    try:
+        with open(os.path.join(root, rel), "rb") as f:
+            head = f.read(BINARY_SNIFF_BYTES)
+            if b"\0" in head:
+                return "binary", None
+            data = head + f.read()
+    except OSError:
+        return "error", None
+
+    # 字面量查询先在原始字节上做子串判断，不命中的文件不用解码，也不跑（忽略大小写的）正则
+    if needle is not None and needle not in (data if compiled.flags & re.IGNORECASE == 0 else data.lower()):
+        return "ok", None
+    text = data.decode("utf-8", errors="replace")
+    # 整份文本先搜一次，绝大多数文件在这里就结束了
+    first = compiled.search(text)
+    if first is None:
+        return "ok", None
+
+    lines = text.split("\n")
+    start_line = text.count("\n", 0, first.start())
+    hits = []
+    for i in range(start_line, len(lines)):
+        if compiled.search(lines[i]):
+            hits.append(i)
+            if len(hits) > limit:
+                break
+    truncated = len(hits) > limit
+    hits = hits[:limit]
+    if not hits:
+        # 跨行的正则（例如包含 \n）只在整份文本上命中，退回报告起始行
+        hits = [start_line]
+
+    wanted: dict[int, bool] = {}
+    for i in hits:
+        for j in range(max(0, i - context), min(len(lines), i + context + 1)):
+            wanted.setdefault(j, False)
+        wanted[i] = True
+    rows = [(j + 1, wanted[j], _clip(lines[j])) for j in sorted(wanted)]
+    return "ok", FileMatches(rel, rows, len(hits), truncated)
+
+
+def _trim(found: FileMatches, keep: int, context: int) -> FileMatches:
+    """Keep only the first ``keep`` matches of ``found`` (plus their trailing context)."""
+    seen = 0
+    for index, (line_no, is_match, _) in enumerate(found.rows):
+        seen += is_match
+        if seen == keep:
+            tail = [row for row in found.rows[index + 1:index + 1 + context]
+                    if not row[1] and row[0] <= line_no + context]
+            return FileMatches(found.path, found.rows[:index + 1] + tail, keep, True)
+    return found
+
+
+def _search_batch(root: str, rels: list[str], query: str, regex: bool, case_sensitive: bool,
+                  context: int, limit: int) -> list[tuple[str, Optional[FileMatches]]]:
+    """Worker entry point: searches a batch of files under ``root``."""
+    compiled = _compile(query, regex, case_sensitive)
+    needle = _needle(query, regex, case_sensitive)
+    return [_search_file(root, rel, compiled, needle, context, limit) for rel in rels]
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _noop() -> None:
+    pass
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """The process pool shared by all searches in this process, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            if "fork" in methods and threading.active_count() == 1:
+                # 只有主线程时 fork 是安全的，worker 继承已经导入的模块，启动最快
+                _pool = ProcessPoolExecutor(max_workers=SEARCH_WORKERS, mp_context=multiprocessing.get_context("fork"))
+                # fork 上下文在第一次提交时一次性创建全部 worker，趁现在还没有其它线程
+                _pool.submit(_noop).result()
+            else:
+                # forkserver 的服务进程是新启动的单线程进程，worker 从它 fork；
+                # 它会导入一次 __main__（入口脚本的 main() 在 __name__ 检查之后，不会运行）
+                ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                if ctx.get_start_method() == "forkserver":
+                    ctx.set_forkserver_preload([__name__])
+                _pool = ProcessPoolExecutor(max_workers=SEARCH_WORKERS, mp_context=ctx)
+        return _pool
+
+
+def start_pool() -> None:
+    """Start the search workers now; call at the top of main(), before any other thread exists."""
+    if SEARCH_WORKERS > 1:
+        _get_pool()
+
+
+def _kill(pool: ProcessPoolExecutor) -> None:
+    # ProcessPoolExecutor 没有公开的办法中断正在运行的任务
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _retire(pool: ProcessPoolExecutor) -> None:
+    """Kill ``pool``'s workers; searches started from now on get a fresh pool.
+
+    Other searches still running on ``pool`` see BrokenProcessPool or CancelledError and retry on the new one.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    _kill(pool)
+
+
+def shutdown_pool(kill: bool = False) -> None:
+    """Drop the pool; with ``kill``, also terminate workers stuck in a search."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is None:
+        return
+    if kill:
+        _kill(pool)
+    else:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _wait(future, timeout: float):
+    """Result of one batch; only the time the batch spends running counts against ``timeout``.
+
+    Batches queued behind other searches' batches wait as long as it takes.
+    """
+    started = None
+    while True:
+        try:
+            if started is None:
+                return future.result(timeout=_QUEUE_POLL_SECONDS)
+            return future.result(timeout=max(0.0, started + timeout - time.monotonic()))
+        except FutureTimeout:
+            if started is not None:
+                raise
+            if future.running():
+                started = time.monotonic()
+
+
+def _search_pooled(root: str, batches: list, args: tuple, collect, result) -> None:
+    """Run ``batches`` on the shared pool, retrying the uncollected ones once if the pool breaks."""
+    done = 0
+    for attempt in range(2):
+        pool = _get_pool()
+        futures = []
+        try:
+            try:
+                futures = [pool.submit(_search_batch, root, batch, *args) for batch in batches[done:]]
+            except RuntimeError:
+                # 另一个搜索超时后刚刚关闭了这个进程池（BrokenProcessPool 也是 RuntimeError）
+                _retire(pool)
+                if attempt:
+                    raise
+                continue
+            # 按提交顺序收集，输出顺序与目录遍历一致
+            for future in futures:
+                outcomes = _wait(future, SEARCH_TIMEOUT_SECONDS)
+                done += 1
+                if not collect(outcomes):
+                    return
+            return
+        except FutureTimeout:
+            result.timed_out = True
+            # 卡住的 worker 不会自己停下来：新的搜索换用新进程池，旧池连同卡住的 worker 一起结束
+            _retire(pool)
+            return
+        except (BrokenProcessPool, CancelledError):
+            # 通常是另一个搜索超时结束了共享进程池：运行中的批次报 BrokenProcessPool，排队的批次被取消，
+            # 没收集到的批次在新进程池上重跑一次
+            _retire(pool)
+            if attempt:
+                raise
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def search_tree(root: str, query: str, regex: bool = False, case_sensitive: bool = False,
+                pattern: str = "", context: int = 1, max_matches: int = 50) -> SearchResult:
+    """Search every non-ignored text file under ``root``.
+
+    Args:
+        query: literal text, or a Python regex when ``regex`` is true
+        pattern: glob applied to file names, e.g. '*.py'
+        context: lines of context around each match, at most MAX_CONTEXT_LINES
+        max_matches: stop after this many matching lines, at most SEARCH_MAX_MATCHES
+
+    Raises:
+        re.error: the query is not a valid regex
+    """
+    root = os.path.abspath(root)
+    _compile(query, regex, case_sensitive)  # 在主进程里先校验，错误不必跨进程传回来
+    context = max(0, min(context, MAX_CONTEXT_LINES))
+    max_matches = max(1, min(max_matches, SEARCH_MAX_MATCHES))
+    limit = min(MAX_MATCHES_PER_FILE, max_matches)
+    result = SearchResult(root, query)
+
+    rels = []
+    for entry in dir_index.walk(root, max_depth=SEARCH_MAX_DEPTH, pattern=pattern):
+        if entry.is_dir:
+            continue
+        if entry.size > SEARCH_MAX_FILE_BYTES:
+            result.skipped_large += 1
+        elif entry.size:
+            rels.append(entry.path)
+    batches = [rels[i:i + SEARCH_BATCH_FILES] for i in range(0, len(rels), SEARCH_BATCH_FILES)]
+    args = (query, regex, case_sensitive, context, limit)
+
+    def collect(outcomes) -> bool:
+        for status, found in outcomes:
+            result.scanned += 1
+            if status == "binary":
+                result.skipped_binary += 1
+            if found is None:
+                continue
+            if result.matches + found.matches > max_matches:
+                found = _trim(found, max_matches - result.matches, context)
+            result.files.append(found)
+            result.matches += found.matches
+            if result.matches >= max_matches:
+                result.truncated = True
+                return False
+        return True
+
+    # 字面量查询不会灾难性回溯，文件少时在进程内搜；正则总是交给进程池，超时后可以结束 worker
+    if SEARCH_WORKERS <= 1 or (not regex and len(rels) < SEARCH_PARALLEL_MIN_FILES):
+        for batch in batches:
+            if not collect(_search_batch(root, batch, *args)):
+                break
+    elif batches:
+        _search_pooled(root, batches, args, collect, result)
+    return result
+
+
+def format_result(result: SearchResult) -> str:
+    """grep-like text: 'path' header, then 'N: line' for matches and 'N- line' for context."""
+    summary = (f"{result.matches} matching lines in {len(result.files)} files "
+               f"(searched {result.scanned} files under '{result.root}'")
+    skipped = []
+    if result.skipped_binary:
+        skipped.append(f"{result.skipped_binary} binary")
+    if result.skipped_large:
+        skipped.append(f"{result.skipped_large} over {SEARCH_MAX_FILE_BYTES // 1024} KB")
+    if skipped:
+        summary += ", skipped " + ", ".join(skipped)
+    summary += ")"
+    timed_out = (f"... (search stopped after {SEARCH_TIMEOUT_SECONDS:g} s, results are partial; "
+                 f"simplify the regex or narrow the directory or pattern)")
+    if not result.files:
+        return f"No match for {result.query!r}: " + summary + ("\n" + timed_out if result.timed_out else "")
+
+    out = [summary]
+    for found in result.files:
+        out.append(found.path)
+        previous = None
+        for line_no, is_match, text in found.rows:
+            if previous is not None and line_no != previous + 1:
+                out.append("  --")
+            out.append(f"  {line_no}{':' if is_match else '-'} {text}")
+            previous = line_no
+        if found.truncated:
+            out.append("  ... (more matches in this file, use read_file_page)")
+    if result.truncated:
+        out.append("... (match limit reached, narrow the query, directory or pattern)")
+    if result.timed_out:
+        out.append(timed_out)
+    return "\n".join(out)
@@ -13,12 +13,13 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
 from load_env import *
+from models import get_chat_model
 
 # load_dotenv('../../../.llm_env')
 # API_KEY : str= os.getenv("MY_OPENAI_API_KEY") or ""
 # BASE_URL = os.getenv("MY_OPENAI_API_BASE")
 
-llm = ChatOpenAI(api_key=SecretStr(API_KEY),  base_url=BASE_URL,  model="gpt-4.1",temperature=0)
+llm = get_chat_model(model="gpt-4.1", temperature=0)
 
 class State(TypedDict):
     # messages have the type "list".
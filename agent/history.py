@@ -0,0 +1,143 @@
+"""
+对话历史压缩
+
+State.messages 会不断增长，每一轮都把完整历史（包括之前 ToolMessage 里的整个文件内容）
+重新发给模型。compact_history 在调用模型之前按 token 预算裁剪历史：
+1. 最近 keep_recent_turns 轮原样保留
+2. 更早的 ToolMessage 只保留开头一小段预览
+3. 仍超出预算时，从最早的一轮开始整轮丢弃（可选地交给 summarizer 生成摘要）
+State 本身不被修改，只影响发给模型的消息。
+"""
+
+import os
+from dataclasses import dataclass, asdict
+from typing import Callable, Optional
+
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "24000"))
+DEFAULT_KEEP_RECENT_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "2"))
+TOOL_PREVIEW_CHARS = 300
+
+# 每条消息的固定开销（角色、分隔符等）
+_PER_MESSAGE_TOKENS = 4
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def _count_text(text: str) -> int:
+        return len(_encoding.encode(text, disallowed_special=()))
+except Exception:  # tiktoken 不可用时按 4 字符 ≈ 1 token 估算
+    def _count_text(text: str) -> int:
+        return (len(text) + 3) // 4
+
+
+def _message_text(message: AnyMessage) -> str:
+    content = message.content
+    if isinstance(content, list):
+        content = "".join(c.get("text", "") if isinstance(c, dict) else str(c) for c in content)
+    text = str(content)
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        text += tool_call.get("name", "") + str(tool_call.get("args", ""))
+    return text
+
+
+def count_tokens(messages: list[AnyMessage]) -> int:
+    return sum(_count_text(_message_text(m)) + _PER_MESSAGE_TOKENS for m in messages)
+
+
+@dataclass
+class CompactionReport:
+    tokens_before: int
+    tokens_after: int
+    trimmed_tool_messages: int = 0
+    dropped_turns: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "tokens_saved": self.tokens_saved}
+
+
+def _split_turns(messages: list[AnyMessage]) -> list[list[AnyMessage]]:
+    """Group messages into turns, each starting at a HumanMessage."""
+    turns: list[list[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _trim_tool_message(message: ToolMessage, preview_chars: int) -> ToolMessage:
+    text = _message_text(message)
+    omitted = len(text) - preview_chars
+    return ToolMessage(
+        content=f"{text[:preview_chars]}\n[... {omitted} chars of earlier tool output trimmed, "
+                f"call the tool again if you need them]",
+        tool_call_id=message.tool_call_id,
+        name=message.name,
+    )
+
+
+def compact_history(
+    messages: list[AnyMessage],
+    budget: int = DEFAULT_TOKEN_BUDGET,
+    keep_recent_turns: int = DEFAULT_KEEP_RECENT_TURNS,
+    preview_chars: int = TOOL_PREVIEW_CHARS,
+    summarizer: Optional[Callable[[list[AnyMessage]], str]] = None,
+) -> tuple[list[AnyMessage], CompactionReport]:
+    """Fit ``messages`` into ``budget`` tokens without touching the recent turns.
+
+    The system prompt is not part of ``messages``; callers prepend it afterwards,
+    so it is always kept. ``summarizer``, if given, turns the dropped turns into
+    a short text that is kept as a SystemMessage in their place.
+    """
+    before = count_tokens(messages)
+    report = CompactionReport(before, before)
+    if before <= budget:
+        return messages, report
+
+    turns = _split_turns(messages)
+    split = max(0, len(turns) - keep_recent_turns)
+    old_turns, recent_turns = turns[:split], turns[split:]
+
+    # 第一步：裁剪旧轮次中的工具输出
+    compacted_old = []
+    for turn in old_turns:
+        new_turn = []
+        for message in turn:
+            if isinstance(message, ToolMessage) and len(_message_text(message)) > preview_chars * 2:
+                message = _trim_tool_message(message, preview_chars)
+                report.trimmed_tool_messages += 1
+            new_turn.append(message)
+        compacted_old.append(new_turn)
+
+    recent = [m for turn in recent_turns for m in turn]
+    recent_tokens = count_tokens(recent)
+    turn_tokens = [count_tokens(turn) for turn in compacted_old]
+    total = recent_tokens + sum(turn_tokens)
+
+    # 第二步：仍然超出预算时，从最早的一轮开始整轮丢弃（整轮丢弃不会拆散 tool_call 与 ToolMessage）
+    dropped: list[AnyMessage] = []
+    while compacted_old and total > budget:
+        dropped.extend(compacted_old.pop(0))
+        total -= turn_tokens.pop(0)
+        report.dropped_turns += 1
+
+    result: list[AnyMessage] = []
+    if dropped:
+        if summarizer is not None:
+            note = f"Summary of {report.dropped_turns} earlier turns: {summarizer(dropped)}"
+        else:
+            note = f"[{report.dropped_turns} earlier turns were omitted to save context]"
+        result.append(SystemMessage(content=note))
+    for turn in compacted_old:
+        result.extend(turn)
+    result.extend(recent)
+
+    report.tokens_after = count_tokens(result)
+    return result, report
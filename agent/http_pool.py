@@ -0,0 +1,179 @@
+"""
+进程内共享的 HTTP 连接池
+
+每个 ChatOpenAI 默认各自创建 httpx 客户端，同一进程里的几个模型实例各有一套连接，
+彼此不能复用 TLS 连接。这里提供进程级的同步/异步客户端各一个，由 models.get_chat_model
+传给所有模型：连接数上限、keep-alive、超时都集中在这里配置，安装了 h2 时自动启用 HTTP/2
+（服务端不支持时 ALPN 协商会回落到 HTTP/1.1）。
+
+环境变量：
+    HTTP_MAX_CONNECTIONS=20         连接总数上限
+    HTTP_MAX_KEEPALIVE=10           空闲时保留的连接数
+    HTTP_KEEPALIVE_EXPIRY=60        空闲连接保留的秒数
+    HTTP_HTTP2=auto                 auto / 1 / 0；auto 表示装了 h2 就启用
+    HTTP_CONNECT_TIMEOUT=5          秒
+    HTTP_READ_TIMEOUT=120           秒，流式输出时是两个数据块之间的最长间隔
+    HTTP_WRITE_TIMEOUT=30           秒
+    HTTP_POOL_TIMEOUT=10            秒，等待空闲连接的最长时间
+
+pool_stats() 返回请求数、新建连接数以及当前池中连接的状态。
+"""
+
+import importlib.util
+import os
+import threading
+from typing import Optional
+
+import httpx
+
+
+def _http2_enabled() -> bool:
+    setting = os.getenv("HTTP_HTTP2", "auto").strip().lower()
+    if setting in ("0", "false", "off"):
+        return False
+    # httpx 的 HTTP/2 支持依赖可选的 h2 包
+    return importlib.util.find_spec("h2") is not None
+
+
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP2 = _http2_enabled()
+TIMEOUT = httpx.Timeout(
+    connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+    read=float(os.getenv("HTTP_READ_TIMEOUT", "120")),
+    write=float(os.getenv("HTTP_WRITE_TIMEOUT", "30")),
+    pool=float(os.getenv("HTTP_POOL_TIMEOUT", "10")),
+)
+LIMITS = httpx.Limits(
+    max_connections=MAX_CONNECTIONS,
+    max_keepalive_connections=MAX_KEEPALIVE,
+    keepalive_expiry=KEEPALIVE_EXPIRY,
+)
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.errors = 0
+
+    def add(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "errors": self.errors,
+            }
+
+
+_counters = {"sync": _Counters(), "async": _Counters()}
+_clients: dict[str, httpx.Client | httpx.AsyncClient] = {}
+_lock = threading.Lock()
+
+
+def _sync_hooks(counters: _Counters) -> dict:
+    # httpcore 的 trace 扩展会在新建 TCP 连接时回调，复用的连接不会触发
+    def trace(event: str, info: dict) -> None:
+        if event == "connection.connect_tcp.complete":
+            counters.add("connections_opened")
+
+    def on_request(request: httpx.Request) -> None:
+        counters.add("requests")
+        request.extensions["trace"] = trace
+
+    def on_response(response: httpx.Response) -> None:
+        if response.status_code >= 400:
+            counters.add("errors")
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def _async_hooks(counters: _Counters) -> dict:
+    async def trace(event: str, info: dict) -> None:
+        if event == "connection.connect_tcp.complete":
+            counters.add("connections_opened")
+
+    async def on_request(request: httpx.Request) -> None:
+        counters.add("requests")
+        request.extensions["trace"] = trace
+
+    async def on_response(response: httpx.Response) -> None:
+        if response.status_code >= 400:
+            counters.add("errors")
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+def get_http_client() -> httpx.Client:
+    """The process-wide pooled sync client."""
+    with _lock:
+        client = _clients.get("sync")
+        if client is None or client.is_closed:
+            client = _clients["sync"] = httpx.Client(
+                http2=HTTP2, limits=LIMITS, timeout=TIMEOUT,
+                event_hooks=_sync_hooks(_counters["sync"]),
+            )
+        return client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """The process-wide pooled async client.
+
+    httpx.AsyncClient 可以在不同事件循环之间复用，但连接绑定在创建它的循环上；
+    asyncio.run 多次的脚本在循环结束后应调用 aclose_http_clients()。
+    """
+    with _lock:
+        client = _clients.get("async")
+        if client is None or client.is_closed:
+            client = _clients["async"] = httpx.AsyncClient(
+                http2=HTTP2, limits=LIMITS, timeout=TIMEOUT,
+                event_hooks=_async_hooks(_counters["async"]),
+            )
+        return client
+
+
+def close_http_clients() -> None:
+    with _lock:
+        client = _clients.pop("sync", None)
+    if client is not None:
+        client.close()
+
+
+async def aclose_http_clients() -> None:
+    with _lock:
+        client = _clients.pop("async", None)
+    if client is not None:
+        await client.aclose()
+
+
+def _connections(client: Optional[httpx.Client | httpx.AsyncClient]) -> list:
+    # httpx 没有公开连接池，取不到时（例如换了 transport）只返回计数
+    try:
+        return list(client._transport._pool.connections)
+    except AttributeError:
+        return []
+
+
+def pool_stats() -> dict:
+    """Request/connection counters and the current pool state of both clients."""
+    stats = {
+        "http2_enabled": HTTP2,
+        "max_connections": MAX_CONNECTIONS,
+        "max_keepalive": MAX_KEEPALIVE,
+    }
+    for name, counters in _counters.items():
+        entry = counters.as_dict()
+        connections = _connections(_clients.get(name))
+        entry["open"] = len(connections)
+        entry["idle"] = sum(1 for c in connections if c.is_idle())
+        entry["http2"] = sum(1 for c in connections if "HTTP/2" in c.info())
+        # 每个新连接平均承载的请求数，越大说明 keep-alive 复用越充分
+        entry["reuse"] = entry["requests"] / entry["connections_opened"] if entry["connections_opened"] else 0.0
+        stats[name] = entry
+    return stats
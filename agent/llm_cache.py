@@ -0,0 +1,315 @@
+"""
+本地 LLM 响应缓存
+
+回放和回归测试里大量调用的 prompt、模型和采样参数完全相同（temperature=0 尤其常见），
+每次都打到 API 既慢又花钱。CachingChatModel 包装任意聊天模型：
+- key 是消息、绑定的工具、模型名和采样参数规范化后的 sha256；消息 id、usage 等
+  每次都会变的字段不参与计算
+- 响应存到本地 SQLite，总大小超过上限时按最近使用时间淘汰
+- 流式调用命中缓存时按原来的分块重新输出 chunk，流式消费者（stream_mode="messages"、
+  StreamRenderer 等）不需要区分是否命中
+
+通过 get_chat_model 按模型开启，见 models.py：
+    LLM_CACHE=1                 所有模型
+    LLM_CACHE=gpt-4.1,gpt-4     只缓存这些模型
+    LLM_CACHE_DB=path           缓存文件，默认 ~/.llm_response_cache.sqlite
+    LLM_CACHE_MAX_BYTES=...     大小上限，默认 256MB
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, message_chunk_to_message
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+DEFAULT_DB_PATH = os.path.expanduser(os.getenv("LLM_CACHE_DB", "~/.llm_response_cache.sqlite"))
+DEFAULT_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# 是否流式输出不影响结果，不参与 key
+_IGNORED_PARAMS = {"stream", "streaming", "_type"}
+
+
+def _canonical_message(message: BaseMessage) -> dict:
+    data = {"type": message.type, "content": message.content}
+    for field in ("name", "tool_call_id"):
+        if getattr(message, field, None):
+            data[field] = getattr(message, field)
+    if getattr(message, "tool_calls", None):
+        data["tool_calls"] = [{"name": tc["name"], "args": tc["args"], "id": tc.get("id")}
+                              for tc in message.tool_calls]
+    return data
+
+
+def cache_key(messages: list[BaseMessage], params: dict) -> str:
+    payload = {
+        "messages": [_canonical_message(m) for m in messages],
+        "params": {k: v for k, v in params.items() if k not in _IGNORED_PARAMS},
+    }
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed store of AI messages (plus their stream chunking), LRU-bounded by size."""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used);
+        """)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[tuple[AIMessage, Optional[list]]]:
+        """Return ``(message, chunk contents or None)``."""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        value = json.loads(row[0])
+        return messages_from_dict([value["message"]])[0], value.get("chunks")
+
+    def put(self, key: str, model: str, message: AIMessage, chunks: Optional[list] = None) -> None:
+        value = json.dumps({"message": messages_to_dict([message])[0], "chunks": chunks}, ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, model, value, size, now, now))
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        # 一次删到上限的 90%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        stale = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            stale.append((key,))
+            self.total_bytes -= size
+        self.conn.execute("BEGIN")
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+        self.conn.execute("COMMIT")
+        self.evictions += len(stale)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": entries, "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+
+_caches: dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(path: str = DEFAULT_DB_PATH) -> ResponseCache:
+    """One shared ResponseCache per file within the process."""
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(path)
+        return _caches[path]
+
+
+def _replay(message: AIMessage, pieces: Optional[list]) -> Iterator[AIMessageChunk]:
+    """Turn a cached message back into the chunks it was originally streamed as."""
+    if not pieces:
+        pieces = [message.content]
+    for piece in pieces[:-1]:
+        yield AIMessageChunk(content=piece)
+    # 工具调用、usage 等放在最后一个 chunk，与 OpenAI 流式接口一致
+    yield AIMessageChunk(
+        content=pieces[-1],
+        tool_call_chunks=[
+            {"name": tc["name"], "args": json.dumps(tc["args"]), "id": tc.get("id"), "index": i}
+            for i, tc in enumerate(message.tool_calls)
+        ],
+        response_metadata=message.response_metadata,
+        usage_metadata=message.usage_metadata,
+    )
+
+
+def _merge(chunks: list[ChatGenerationChunk]) -> tuple[AIMessage, Optional[list]]:
+    merged = chunks[0]
+    for chunk in chunks[1:]:
+        merged = merged + chunk
+    pieces = [chunk.message.content for chunk in chunks]
+    if not all(isinstance(p, str) for p in pieces):
+        pieces = None
+    return message_chunk_to_message(merged.message), pieces
+
+
+class CachingChatModel(BaseChatModel):
+    """Wrap ``inner`` with an exact-match response cache.
+
+    Args:
+        inner: the model that is called on a cache miss
+        store: where responses are kept, usually ``get_response_cache()``
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: BaseChatModel
+    store: ResponseCache
+    streaming: bool = False
+
+    def __init__(self, **kwargs):
+        # 只在内部模型开启流式时设置：显式设置 streaming=False 会让 langchain 完全禁用流式
+        if "streaming" not in kwargs and getattr(kwargs.get("inner"), "streaming", False):
+            kwargs["streaming"] = True
+        super().__init__(**kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"cached-{self.inner._llm_type}"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.inner._identifying_params
+
+    @property
+    def model_name(self) -> str:
+        return str(self.inner._identifying_params.get("model_name") or self.inner._llm_type)
+
+    def _key(self, messages: list[BaseMessage], stop: Optional[list[str]], kwargs: dict) -> str:
+        params = self.inner._get_invocation_params(stop=stop, **kwargs)
+        params["_llm_type"] = self.inner._llm_type
+        return cache_key(messages, params)
+
+    # ---- 工具与结构化输出 ----
+
+    def bind_tools(self, tools, **kwargs):
+        # 让内部模型把工具转换成它需要的参数，再绑定到包装器上，工具定义因此会进入 key
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    # with_structured_output 使用 BaseChatModel 的默认实现（bind_tools + 解析器），同样经过缓存
+
+    # ---- 非流式 ----
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = self._key(messages, stop, kwargs)
+        cached = self.store.get(key)
+        if cached is not None:
+            return ChatResult(generations=[ChatGeneration(message=cached[0])])
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        if len(result.generations) == 1:
+            self.store.put(key, self.model_name, result.generations[0].message)
+        return result
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        key = self._key(messages, stop, kwargs)
+        cached = self.store.get(key)
+        if cached is not None:
+            return ChatResult(generations=[ChatGeneration(message=cached[0])])
+        result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        if len(result.generations) == 1:
+            self.store.put(key, self.model_name, result.generations[0].message)
+        return result
+
+    # ---- 流式 ----
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        key = self._key(messages, stop, kwargs)
+        cached = self.store.get(key)
+        if cached is not None:
+            for message in _replay(*cached):
+                chunk = ChatGenerationChunk(message=message)
+                if run_manager:
+                    run_manager.on_llm_new_token(str(message.content), chunk=chunk)
+                yield chunk
+            return
+
+        if type(self.inner)._stream is BaseChatModel._stream:
+            # 内部模型不支持流式：整体生成一次，作为一个 chunk 输出
+            result = self._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            for message in _replay(result.generations[0].message, None):
+                yield ChatGenerationChunk(message=message)
+            return
+
+        chunks = []
+        for chunk in self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        # 只缓存完整结束的流，中途出错或被中断的不写入
+        if chunks:
+            self.store.put(key, self.model_name, *_merge(chunks))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        key = self._key(messages, stop, kwargs)
+        cached = self.store.get(key)
+        if cached is not None:
+            for message in _replay(*cached):
+                chunk = ChatGenerationChunk(message=message)
+                if run_manager:
+                    await run_manager.on_llm_new_token(str(message.content), chunk=chunk)
+                yield chunk
+            return
+
+        chunks = []
+        async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        if chunks:
+            self.store.put(key, self.model_name, *_merge(chunks))
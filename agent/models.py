@@ -0,0 +1,120 @@
+"""
+统一创建聊天模型
+
+各脚本通过 get_chat_model 获取模型，而不是各自构造 ChatOpenAI。
+设置环境变量 FAKE_LLM 后返回离线的 ScriptedChatModel，不需要网络和 API key：
+    FAKE_LLM=echo                   回显最后一条用户消息
+    FAKE_LLM=path/to/script.json    回放脚本（格式见 fake_model.py）
+    FAKE_LLM_TOKEN_LATENCY=0.02     每个 token 的模拟延迟（秒）
+    FAKE_LLM_FIRST_TOKEN_LATENCY=0.3
+
+设置 LLM_CACHE 后真实模型的响应会缓存到本地（见 llm_cache.py）：
+    LLM_CACHE=1                     所有模型
+    LLM_CACHE=gpt-4.1,gpt-4         只缓存列出的模型
+
+真实模型按 (model, temperature, 其余参数) 登记在进程内的注册表里，相同参数的调用拿到同一个实例，
+所有实例共用 http_pool.py 的连接池（连接上限、keep-alive、超时、HTTP/2 在那里配置）。
+registry_stats() 返回注册表和连接池的统计。
+
+调用方把模型调用交给 rate_limit.py 的限流器时传 rate_limited=True：限流器开启（LLM_RATE_LIMIT 默认开启）
+时由它负责 429 的退避重试，ChatOpenAI 自己的重试关闭（显式传 max_retries 时以传入的为准）。
+没有经过限流器的调用方保留 ChatOpenAI 默认的重试。
+"""
+
+import os
+import threading
+from typing import Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from pydantic import SecretStr
+
+from load_env import API_KEY, BASE_URL
+from http_pool import get_async_http_client, get_http_client, pool_stats
+from rate_limit import rate_limit_enabled
+
+# (model, temperature, cache, rate_limited, kwargs) -> 模型实例
+_registry: dict[tuple, BaseChatModel] = {}
+_registry_lock = threading.Lock()
+_registry_hits = 0
+
+
+def _fake_model(spec: str, **kwargs) -> BaseChatModel:
+    from fake_model import ScriptedChatModel
+
+    options = {
+        "token_latency": float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0")),
+        "first_token_latency": float(os.getenv("FAKE_LLM_FIRST_TOKEN_LATENCY", "0")),
+        "streaming": kwargs.get("streaming", False),
+        "model_name": f"scripted:{kwargs.get('model', '')}",
+    }
+    if spec == "echo":
+        return ScriptedChatModel(**options)
+    return ScriptedChatModel.from_file(spec, **options)
+
+
+def _cache_enabled(model: str) -> bool:
+    setting = os.getenv("LLM_CACHE", "").strip()
+    if setting.lower() in ("", "0", "false", "off"):
+        return False
+    if setting.lower() in ("1", "true", "on", "all"):
+        return True
+    return model in {name.strip() for name in setting.split(",")}
+
+
+def _registry_key(model: str, temperature: float, cache: bool, rate_limited: bool, kwargs: dict) -> tuple:
+    # kwargs 里可能有 dict/list 之类不可哈希的值，用 repr 作为键
+    return (model, float(temperature), cache, rate_limited, tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+
+
+def _create_model(model: str, temperature: float, cache: bool, rate_limited: bool, **kwargs) -> BaseChatModel:
+    from langchain_openai import ChatOpenAI
+
+    if rate_limited and rate_limit_enabled():
+        kwargs.setdefault("max_retries", 0)
+    llm = ChatOpenAI(
+        api_key=SecretStr(API_KEY),
+        base_url=BASE_URL,
+        model=model,
+        temperature=temperature,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+        **kwargs,
+    )
+    if cache:
+        from llm_cache import CachingChatModel, get_response_cache
+
+        return CachingChatModel(inner=llm, store=get_response_cache())
+    return llm
+
+
+def get_chat_model(model: str, temperature: float = 0, cache: Optional[bool] = None,
+                   rate_limited: bool = False, **kwargs) -> BaseChatModel:
+    """Return the chat model for ``model``, or the offline stand-in when FAKE_LLM is set.
+
+    ``cache`` turns the local response cache on/off for this model; None follows LLM_CACHE.
+    ``rate_limited`` means every call goes through ``rate_limiter.call/acall``, which then owns the retries.
+    Calls with the same arguments share one instance.
+    """
+    global _registry_hits
+    fake = os.getenv("FAKE_LLM")
+    if fake:
+        # 脚本模型记录了自己的回放位置，不能共享
+        return _fake_model(fake, model=model, **kwargs)
+
+    cache = cache if cache is not None else _cache_enabled(model)
+    key = _registry_key(model, temperature, cache, rate_limited, kwargs)
+    with _registry_lock:
+        llm = _registry.get(key)
+        if llm is not None:
+            _registry_hits += 1
+            return llm
+        llm = _registry[key] = _create_model(model, temperature, cache, rate_limited, **kwargs)
+        return llm
+
+
+def registry_stats() -> dict:
+    """Registered model instances plus the shared HTTP pool statistics."""
+    with _registry_lock:
+        models = [key[0] for key in _registry]
+        hits = _registry_hits
+    return {"models": models, "hits": hits, "http": pool_stats()}
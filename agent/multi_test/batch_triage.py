@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Batch triage for the email workflow in multi_test.py
+
+Runs many emails through the same compiled graph concurrently:
+- emails are classified up front in micro-batches, then each graph run skips the
+  per-email classification call; a batch is classified in the background while
+  the runs of earlier batches keep finishing and being yielded
+- graph runs go through a bounded worker pool, each with its own thread_id
+  ("triage-<email_id>") so human_review interrupts can be resumed later
+- results are yielded / written as soon as each email finishes
+
+Usage:
+    python batch_triage.py emails.jsonl -o results.jsonl --workers 8 --batch-size 16
+    cat emails.jsonl | python batch_triage.py -
+
+Each input line is a JSON object with email_content, sender_email and optionally email_id.
+"""
+
+import argparse
+import json
+import sys
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, Optional
+
+from langchain_core.runnables import RunnableLambda
+from langgraph.types import Command
+
+from multi_test import (EmailClassification, app, build_classification_prompt, classification_cache, llm,
+                        rate_limiter)
+from rate_limit import format_stats  # importable once multi_test has put agent/ on sys.path
+
+
+def thread_id_for(email_id: str) -> str:
+    return f"triage-{email_id}"
+
+
+def read_emails(path: str) -> Iterator[dict]:
+    """Stream emails from a JSONL file, or stdin when path is '-'."""
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def _initial_state(email: dict) -> dict:
+    return {
+        "email_content": email["email_content"],
+        "sender_email": email.get("sender_email", ""),
+        "email_id": str(email.get("email_id") or uuid.uuid4().hex),
+        "messages": [],
+    }
+
+
+def classify_batch(states: list[dict], max_concurrency: int) -> list[Optional[EmailClassification]]:
+    """Classify a micro-batch of emails; failed items come back as None and are
+    classified again inside the graph. Cached classifications skip the model.
+
+    This is not a single request: the chat completions API has no synchronous batch
+    endpoint, so RunnableLambda.batch runs one invoke per email on a thread pool
+    (at most ``max_concurrency`` at a time), each through the shared rate limiter.
+    """
+    classifications: list[Optional[EmailClassification]] = [None] * len(states)
+    misses = []
+    for i, state in enumerate(states):
+        cached = classification_cache.get(state["email_content"]) if classification_cache else None
+        if cached is not None:
+            classifications[i] = cached[0]
+        else:
+            misses.append(i)
+    if not misses:
+        return classifications
+
+    structured_llm = llm.with_structured_output(EmailClassification)
+    # Each item of the batch waits for its own slot in the shared rate limiter
+    limited = RunnableLambda(lambda prompt: rate_limiter.call(structured_llm.invoke, prompt))
+    prompts = [build_classification_prompt(states[i]) for i in misses]
+    results = limited.batch(
+        prompts,
+        config={"max_concurrency": max_concurrency},
+        return_exceptions=True,
+    )
+    for i, result in zip(misses, results):
+        if isinstance(result, Exception):
+            continue
+        classifications[i] = result
+        if classification_cache is not None:
+            classification_cache.put(states[i]["email_content"], result)
+    return classifications
+
+
+def _run_one(state: dict) -> dict:
+    config = {"configurable": {"thread_id": thread_id_for(state["email_id"])}}
+    result = {"email_id": state["email_id"], "thread_id": config["configurable"]["thread_id"]}
+    try:
+        values = app.invoke(state, config)
+        snapshot = app.get_state(config)
+    except Exception as e:
+        return {**result, "status": "error", "error": str(e)}
+
+    result["classification"] = values.get("classification")
+    result["draft_response"] = values.get("draft_response")
+    if snapshot.next:
+        # Paused at human_review; resume later with resume_review()
+        interrupts = [i.value for task in snapshot.tasks for i in task.interrupts]
+        return {**result, "status": "pending_review", "review": interrupts[0] if interrupts else None}
+    return {**result, "status": "sent" if values.get("draft_response") else "closed"}
+
+
+def triage(
+    emails: Iterable[dict],
+    workers: int = 8,
+    batch_size: int = 16,
+) -> Iterator[dict]:
+    """Triage ``emails`` concurrently, yielding one result per email as it finishes.
+
+    At most ``workers`` graph runs are in flight and at most ``batch_size`` emails are
+    read ahead (plus one batch being classified), so memory stays bounded for
+    arbitrarily long input streams.
+    """
+    pending: set[Future] = set()
+    # classification future -> its batch; classified on a separate thread so finished
+    # graph runs are still yielded while the next batch waits for the model
+    classifying: dict[Future, list[dict]] = {}
+
+    def _drain(max_runs: int, max_batches: int) -> Iterator[dict]:
+        while len(pending) > max_runs or len(classifying) > max_batches:
+            done, _ = wait(pending | set(classifying), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in classifying:
+                    _start_runs(pool, pending, classifying.pop(future), future)
+                else:
+                    pending.discard(future)
+                    yield future.result()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="triage") as pool, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="classify") as classifier:
+        batch: list[dict] = []
+        for email in emails:
+            batch.append(_initial_state(email))
+            if len(batch) < batch_size:
+                continue
+            classifying[classifier.submit(classify_batch, batch, workers)] = batch
+            batch = []
+            yield from _drain(workers, 1)
+        if batch:
+            classifying[classifier.submit(classify_batch, batch, workers)] = batch
+        yield from _drain(0, 0)
+
+
+def _start_runs(pool: ThreadPoolExecutor, pending: set, batch: list[dict], classified: Future) -> None:
+    try:
+        classifications = classified.result()
+    except Exception:
+        # The graph classifies each email itself
+        classifications = [None] * len(batch)
+    for state, classification in zip(batch, classifications):
+        if classification is not None:
+            state["precomputed_classification"] = classification
+        pending.add(pool.submit(_run_one, state))
+
+
+def resume_review(email_id: str, approved: bool, edited_response: Optional[str] = None) -> dict:
+    """Resume an email paused at human_review with the reviewer's decision."""
+    config = {"configurable": {"thread_id": thread_id_for(email_id)}}
+    decision = {"approved": approved}
+    if edited_response is not None:
+        decision["edited_response"] = edited_response
+    values = app.invoke(Command(resume=decision), config)
+    return {"email_id": email_id, "status": "sent" if approved else "closed",
+            "draft_response": values.get("draft_response")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Triage a JSONL stream of emails.")
+    parser.add_argument("input", help="JSONL file, or '-' for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL results file, '-' for stdout")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    counts: dict[str, int] = {}
+    try:
+        for result in triage(read_emails(args.input), args.workers, args.batch_size):
+            out.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"done: {counts}", file=sys.stderr)
+    print(format_stats(rate_limiter.stats()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Classification cache for classify_intent
+
+Auto-generated notifications and duplicate complaints make up a large share of
+the email traffic. This cache stores EmailClassification results in a local
+SQLite file, in two tiers:
+- exact: keyed on a hash of the normalized content (case, whitespace, numbers,
+  URLs and addresses are normalized away)
+- near-duplicate (optional): MinHash signatures over word shingles, looked up
+  through LSH bands; a hit needs an estimated Jaccard similarity >= threshold.
+  The cached summary describes the other email, so near hits get a summary
+  taken from their own text instead
+
+Entries are scoped by a namespace (model + prompt version): a classification
+made by another model or prompt is never returned. Entries older than
+CLASSIFICATION_CACHE_TTL_SECONDS are ignored, and every PRUNE_EVERY writes the
+file is pruned back to CLASSIFICATION_CACHE_MAX_ENTRIES rows (oldest first).
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+from typing import Optional
+
+DEFAULT_DB_PATH = os.path.expanduser(
+    os.getenv("CLASSIFICATION_CACHE_DB", "~/.email_classification_cache.sqlite")
+)
+DEFAULT_TTL_SECONDS = float(os.getenv("CLASSIFICATION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.getenv("CLASSIFICATION_CACHE_MAX_ENTRIES", "50000"))
+# Expired and excess rows are pruned once every this many writes
+PRUNE_EVERY = 256
+# Rows written before entries were scoped by namespace cannot be trusted
+SCHEMA_VERSION = 2
+NEAR_SUMMARY_CHARS = 200
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERM)]
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_NUM_RE = re.compile(r"\d+(?:[.,:/-]\d+)*")
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Canonical form used for hashing: numbers, URLs and addresses become placeholders."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _URL_RE.sub(" _url_ ", text)
+    text = _EMAIL_RE.sub(" _email_ ", text)
+    text = _NUM_RE.sub(" _num_ ", text)
+    return " ".join(_WORD_RE.findall(text))
+
+
+def content_hash(text: str, namespace: str = "") -> str:
+    return _key(normalize(text), namespace)
+
+
+def _key(normalized: str, namespace: str) -> str:
+    return hashlib.sha256(f"{namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+def _own_summary(text: str) -> str:
+    """Stand-in summary for a near-duplicate hit: the start of the email itself."""
+    text = " ".join(text.split())
+    return text if len(text) <= NEAR_SUMMARY_CHARS else text[:NEAR_SUMMARY_CHARS].rsplit(" ", 1)[0] + " ..."
+
+
+def _shingle_hashes(normalized: str) -> set[int]:
+    words = normalized.split()
+    if len(words) < SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return {int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles}
+
+
+def minhash(normalized: str) -> tuple[int, ...]:
+    hashes = _shingle_hashes(normalized)
+    return tuple(min((a * h + b) % _MERSENNE for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def _band_keys(signature: tuple[int, ...]) -> list[str]:
+    return [
+        f"{band}:" + hashlib.blake2b(struct.pack(f"<{ROWS}Q", *signature[band * ROWS:(band + 1) * ROWS]),
+                                     digest_size=8).hexdigest()
+        for band in range(BANDS)
+    ]
+
+
+class ClassificationCache:
+    """Persistent exact + near-duplicate cache of email classifications.
+
+    Args:
+        path: SQLite file, ``":memory:"`` for a throwaway cache
+        near_duplicates: enable the MinHash/LSH tier
+        threshold: minimum estimated Jaccard similarity for a near-duplicate hit
+        namespace: identifies the model and prompt; entries of other namespaces are invisible
+        read_only: never write (e.g. classifications from an offline fake model)
+        ttl_seconds / max_entries: retention limits, 0 disables the limit
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, near_duplicates: bool = True, threshold: float = 0.9,
+                 namespace: str = "", read_only: bool = False,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.conn.executescript(f"""
+                DROP TABLE IF EXISTS classifications;
+                DROP TABLE IF EXISTS bands;
+                PRAGMA user_version = {SCHEMA_VERSION};
+            """)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS classifications (
+                hash TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                classification TEXT NOT NULL,
+                signature BLOB,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS classifications_created ON classifications (created_at);
+            CREATE TABLE IF NOT EXISTS bands (
+                band TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (band, hash)
+            );
+            CREATE INDEX IF NOT EXISTS bands_hash ON bands (hash);
+        """)
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.namespace = namespace
+        self.read_only = read_only
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._writes = 0
+        self.lock = threading.Lock()
+        self.hits = {"exact": 0, "near": 0}
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[tuple[dict, str]]:
+        """Return ``(classification, "exact" | "near")`` or None."""
+        normalized = normalize(text)
+        key = _key(normalized, self.namespace)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT classification FROM classifications WHERE hash = ? AND created_at >= ?",
+                (key, self._cutoff()),
+            ).fetchone()
+            if row is not None:
+                self.hits["exact"] += 1
+                return json.loads(row[0]), "exact"
+
+            if self.near_duplicates:
+                match = self._near_match(minhash(normalized))
+                if match is not None:
+                    self.hits["near"] += 1
+                    return dict(match, summary=_own_summary(text)), "near"
+
+            self.misses += 1
+            return None
+
+    def _near_match(self, signature: tuple[int, ...]) -> Optional[dict]:
+        keys = _band_keys(signature)
+        candidates = self.conn.execute(
+            f"SELECT DISTINCT c.classification, c.signature FROM bands b "
+            f"JOIN classifications c ON c.hash = b.hash WHERE c.signature IS NOT NULL "
+            f"AND c.namespace = ? AND c.created_at >= ? AND b.band IN ({','.join('?' * len(keys))})",
+            [self.namespace, self._cutoff(), *keys],
+        ).fetchall()
+        best, best_score = None, 0.0
+        for classification, blob in candidates:
+            other = struct.unpack(f"<{NUM_PERM}Q", blob)
+            score = sum(a == b for a, b in zip(signature, other)) / NUM_PERM
+            if score > best_score:
+                best, best_score = classification, score
+        if best is not None and best_score >= self.threshold:
+            return json.loads(best)
+        return None
+
+    def put(self, text: str, classification: dict) -> None:
+        if self.read_only:
+            return
+        normalized = normalize(text)
+        key = _key(normalized, self.namespace)
+        signature = minhash(normalized) if self.near_duplicates else None
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?, ?)",
+                (key, self.namespace, json.dumps(dict(classification)),
+                 struct.pack(f"<{NUM_PERM}Q", *signature) if signature else None, time.time()),
+            )
+            if signature:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO bands VALUES (?, ?)",
+                    [(band, key) for band in _band_keys(signature)],
+                )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 1:
+                self._prune()
+
+    def _cutoff(self) -> float:
+        return time.time() - self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+
+    def _prune(self) -> None:
+        """Drop expired rows, then the oldest rows beyond max_entries (all namespaces)."""
+        self.conn.execute("DELETE FROM classifications WHERE created_at < ?", (self._cutoff(),))
+        if self.max_entries > 0:
+            self.conn.execute(
+                "DELETE FROM classifications WHERE hash IN (SELECT hash FROM classifications "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        self.conn.execute("DELETE FROM bands WHERE hash NOT IN (SELECT hash FROM classifications)")
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+            return {"exact_hits": self.hits["exact"], "near_hits": self.hits["near"],
+                    "misses": self.misses, "entries": entries}
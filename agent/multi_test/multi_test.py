@@ -1,4 +1,7 @@
+import hashlib
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from pydantic import SecretStr
 from IPython.display import Image, display
@@ -18,13 +21,21 @@ from langchain.messages import HumanMessage
 
 
 from load_env import *
-# Define the structure for email classification
 
+# 复用上一级目录中的公共模块
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import get_chat_model
+from sqlite_saver import SqliteDeltaSaver
+from classification_cache import ClassificationCache
+from bm25_index import DocIndex
+from rate_limit import get_rate_limiter
+from tracing import instrument
 
+# Define the structure for email classification
 
 
 
-llm = ChatOpenAI(api_key=SecretStr(API_KEY),  base_url=BASE_URL,  model="gpt-4.1",temperature=0)
 
 
 class EmailClassification(TypedDict):
@@ -41,6 +52,9 @@ class EmailAgentState(TypedDict):
 
     # Classification result
     classification: EmailClassification | None
+    # Set by batch mode for a single run; consumed and cleared by classify_intent.
+    # A separate key, because "classification" persists in the checkpoint from earlier runs.
+    precomputed_classification: EmailClassification | None
 
     # Raw search/API results
     search_results: list[str] | None  # List of raw document chunks
@@ -52,7 +66,83 @@ class EmailAgentState(TypedDict):
 
 #=======================================================
 
-llm = ChatOpenAI(model="gpt-4")
+# Shared instance from the model registry (one pooled HTTP client per process)
+LLM_MODEL = "gpt-4"
+llm = get_chat_model(model=LLM_MODEL, rate_limited=True)
+
+# Every model call goes through the process-wide limiter (RPM/TPM buckets + adaptive
+# concurrency); it also owns retries on 429, so nodes that call the model get no RetryPolicy
+rate_limiter = get_rate_limiter()
+
+# Local BM25 index over the help-center docs, see bm25_index.py
+HELP_DOCS_DIR = os.getenv("HELP_DOCS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "help_docs"))
+DOCS_REFRESH_SECONDS = float(os.getenv("HELP_DOCS_REFRESH_SECONDS", "30"))
+DOCS_TOP_K = int(os.getenv("HELP_DOCS_TOP_K", "3"))
+DENSE_MIN_SCORE = 0.1
+doc_index = DocIndex(HELP_DOCS_DIR) if os.path.isdir(HELP_DOCS_DIR) else None
+
+# Dense retrieval catches paraphrased questions that share no keywords with the docs.
+# Needs numpy; HELP_DOCS_DENSE=0 turns it off, HELP_DOCS_QUANTIZE=1 stores int8 vectors
+try:
+    from vector_index import VectorIndex
+except ImportError:
+    VectorIndex = None
+vector_index = VectorIndex(os.path.join(doc_index.index_dir, "dense")) \
+    if doc_index is not None and VectorIndex is not None and os.getenv("HELP_DOCS_DENSE", "1") != "0" else None
+
+class SearchAPIError(Exception):
+    pass
+
+# Batch workers all notice a stale index at once; only one of them refreshes
+_refresh_lock = threading.Lock()
+
+def _refresh_indexes() -> None:
+    # Before the first load there is nothing to search yet, so wait for it; afterwards a
+    # busy lock means another worker is refreshing and the current index is good enough
+    if not _refresh_lock.acquire(blocking=doc_index.last_update == 0):
+        return
+    try:
+        if time.time() - doc_index.last_update <= DOCS_REFRESH_SECONDS:
+            return  # refreshed by another worker while we waited
+        doc_index.update()
+        if vector_index is None:
+            return
+        if vector_index.tag is None:
+            vector_index.load()
+        table = doc_index.table
+        if vector_index.tag != table.fingerprint:
+            # Passage ids are renumbered on every BM25 rewrite, so rebuild the vectors too
+            vector_index.build(
+                [table.text(i) for i in range(len(table))],
+                quantize=os.getenv("HELP_DOCS_QUANTIZE", "0") == "1",
+                tag=table.fingerprint,
+            )
+    finally:
+        _refresh_lock.release()
+
+def _fuse(rankings: list[list[int]], k: int, c: int = 60) -> list[int]:
+    """Reciprocal rank fusion of several ranked id lists"""
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, passage_id in enumerate(ranking):
+            scores[passage_id] = scores.get(passage_id, 0.0) + 1.0 / (c + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:k]
+
+def search_docs(query: str, k: int = DOCS_TOP_K) -> list[str]:
+    """Top-k passages from the help docs; re-indexes changed files at most every DOCS_REFRESH_SECONDS"""
+    try:
+        if time.time() - doc_index.last_update > DOCS_REFRESH_SECONDS:
+            _refresh_indexes()
+        # Resolve every id against the passage table it was ranked in; a concurrent
+        # refresh renumbers passages. Dense ids count only if built from that same table
+        ids, table = doc_index.search_snapshot(query, 2 * k)
+        rankings = [[pid for pid, _ in ids]]
+        if vector_index is not None:
+            dense = vector_index.search(query, 2 * k, tag=table.fingerprint)
+            rankings.append([pid for pid, score in dense if score >= DENSE_MIN_SCORE])
+        return [table.text(pid) for pid in _fuse(rankings, k)]
+    except (OSError, ValueError) as e:
+        raise SearchAPIError(str(e)) from e
 
 def read_email(state: EmailAgentState) -> dict:
     """Extract and parse email content"""
@@ -61,14 +151,9 @@ def read_email(state: EmailAgentState) -> dict:
         "messages": [HumanMessage(content=f"Processing email: {state['email_content']}")]
     }
 
-def classify_intent(state: EmailAgentState) -> Command[Literal["search_documentation", "human_review", "draft_response", "bug_tracking"]]:
-    """Use LLM to classify email intent and urgency, then route accordingly"""
-
-    # Create structured LLM that returns EmailClassification dict
-    structured_llm = llm.with_structured_output(EmailClassification)
-
-    # Format the prompt on-demand, not stored in state
-    classification_prompt = f"""
+def build_classification_prompt(state: EmailAgentState) -> str:
+    """Format the prompt on-demand, not stored in state"""
+    return f"""
     Analyze this customer email and classify it:
 
     Email: {state['email_content']}
@@ -77,23 +162,57 @@ def classify_intent(state: EmailAgentState) -> Command[Literal["search_documenta
     Provide classification including intent, urgency, topic, and summary.
     """
 
-    # Get structured response directly as dict
-    classification = structured_llm.invoke(classification_prompt)
-
-    # Determine next node based on classification
+def classification_namespace() -> str:
+    """Cache namespace: the model plus a digest of the prompt template and output schema,
+    so editing either one starts a fresh set of cache entries"""
+    template = build_classification_prompt({"email_content": "{email}", "sender_email": "{sender}"})
+    digest = hashlib.sha256(f"{template}\0{EmailClassification.__annotations__!r}".encode("utf-8")).hexdigest()
+    return f"{LLM_MODEL}:{digest[:12]}"
+
+# Cache of earlier classifications; CLASSIFICATION_CACHE=0 disables it,
+# CLASSIFICATION_CACHE_NEAR=0 keeps only the exact-match tier.
+# Runs against the offline fake model only read it: their placeholder results must not be stored
+classification_cache = ClassificationCache(
+    near_duplicates=os.getenv("CLASSIFICATION_CACHE_NEAR", "1") != "0",
+    namespace=classification_namespace(),
+    read_only=bool(os.getenv("FAKE_LLM")),
+) if os.getenv("CLASSIFICATION_CACHE", "1") != "0" else None
+
+def route_classification(classification: EmailClassification) -> str:
+    """Determine next node based on classification"""
     if classification['intent'] == 'billing' or classification['urgency'] == 'critical':
-        goto = "human_review"
+        return "human_review"
     elif classification['intent'] in ['question', 'feature']:
-        goto = "search_documentation"
+        return "search_documentation"
     elif classification['intent'] == 'bug':
-        goto = "bug_tracking"
+        return "bug_tracking"
     else:
-        goto = "draft_response"
+        return "draft_response"
+
+def classify_intent(state: EmailAgentState) -> Command[Literal["search_documentation", "human_review", "draft_response", "bug_tracking"]]:
+    """Use LLM to classify email intent and urgency, then route accordingly"""
+
+    # Batch mode classifies many emails up front and passes the result in;
+    # never reuse state['classification'], it may belong to an earlier email on this thread
+    classification = state.get('precomputed_classification')
+    if not classification and classification_cache is not None:
+        # Same or near-duplicate content was classified before: skip the LLM
+        cached = classification_cache.get(state['email_content'])
+        if cached is not None:
+            classification = cached[0]
+    if not classification:
+        # Create structured LLM that returns EmailClassification dict
+        structured_llm = llm.with_structured_output(EmailClassification)
+
+        # Get structured response directly as dict
+        classification = rate_limiter.call(structured_llm.invoke, build_classification_prompt(state))
+        if classification_cache is not None:
+            classification_cache.put(state['email_content'], classification)
 
     # Store classification as a single dict in state
     return Command(
-        update={"classification": classification},
-        goto=goto
+        update={"classification": classification, "precomputed_classification": None},
+        goto=route_classification(classification)
     )
 
 # =============================================
@@ -102,16 +221,13 @@ def search_documentation(state: EmailAgentState) -> Command[Literal["draft_respo
 
     # Build search query from classification
     classification = state.get('classification', {})
-    query = f"{classification.get('intent', '')} {classification.get('topic', '')}"
+    query = f"{classification.get('intent', '')} {classification.get('topic', '')} {classification.get('summary', '')}"
 
     try:
-        # Implement your search logic here
         # Store raw search results, not formatted text
-        search_results = [
-            "Reset password via Settings > Security > Change Password",
-            "Password must be at least 12 characters",
-            "Include uppercase, lowercase, numbers, and symbols"
-        ]
+        search_results = search_docs(query) if doc_index is not None else []
+        if not search_results:
+            search_results = ["No matching help-center articles found"]
     except SearchAPIError as e:
        # For recoverable search errors, store error and continue
         search_results = [f"Search temporarily unavailable: {str(e)}"]
@@ -130,7 +246,6 @@ def bug_tracking(state: EmailAgentState) -> Command[Literal["draft_response"]]:
     return Command(
         update={
             "search_results": [f"Bug ticket {ticket_id} created"],
-            "current_step": "bug_tracked"
         },
         goto="draft_response"
     )
@@ -169,7 +284,7 @@ def draft_response(state: EmailAgentState) -> Command[Literal["human_review", "s
     - Use the provided documentation when relevant
     """
 
-    response = llm.invoke(draft_prompt)
+    response = rate_limiter.call(llm.invoke, draft_prompt)
 
     # Determine if human review needed based on urgency and intent
     needs_review = (
@@ -219,7 +334,6 @@ def send_reply(state: EmailAgentState) -> dict:
 #============================================
 
 
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.types import RetryPolicy
 
 # Create the graph
@@ -233,7 +347,7 @@ workflow.add_node("classify_intent", classify_intent)
 workflow.add_node(
     "search_documentation",
     search_documentation,
-    retry_policy=RetryPolicy(max_attempts=3)
+    retry_policy=RetryPolicy(max_attempts=3, initial_interval=1.0)
 )
 workflow.add_node("bug_tracking", bug_tracking)
 workflow.add_node("draft_response", draft_response)
@@ -246,19 +360,17 @@ workflow.add_edge("read_email", "classify_intent")
 workflow.add_edge("send_reply", END)
 
 # Compile with checkpointer for persistence, in case run graph with Local_Server --> Please compile without checkpointer
-memory = MemorySaver()
-app = workflow.compile(checkpointer=memory)
-
-
-workflow.add_node(
-    "search_documentation",
-    search_documentation,
-    retry_policy=RetryPolicy(max_attempts=3, initial_interval=1.0)
-)
+# Email threads get their own DB: one thread per email adds up to thousands a day, which
+# would push the file-helper REPL sessions out of the shared DB's LRU. No thread cap here;
+# old threads expire by TTL, and threads paused at human_review are never evicted
+EMAIL_CHECKPOINT_DB = os.path.expanduser(os.getenv("EMAIL_CHECKPOINT_DB", "~/.email_triage_checkpoints.sqlite"))
+memory = SqliteDeltaSaver(EMAIL_CHECKPOINT_DB, max_threads=None)
+# TRACE=1 records per-node / model-call timings (see tracing.py)
+app = instrument(workflow.compile(checkpointer=memory))
 
 
 
-def execute_tool(state: State) -> Command[Literal["agent", "execute_tool"]]:
+def execute_tool(state: EmailAgentState) -> Command[Literal["agent", "execute_tool"]]:
     try:
         result = run_tool(state['tool_call'])
         return Command(update={"tool_result": result}, goto="agent")
@@ -271,7 +383,7 @@ def execute_tool(state: State) -> Command[Literal["agent", "execute_tool"]]:
 
 
 
-def lookup_customer_history(state: State) -> Command[Literal["draft_response"]]:
+def lookup_customer_history(state: EmailAgentState) -> Command[Literal["draft_response"]]:
     if not state.get('customer_id'):
         user_input = interrupt({
             "message": "Customer ID needed",
@@ -292,30 +404,32 @@ def send_reply(state: EmailAgentState):
     except Exception:
         raise  # Surface unexpected errors
 
-# Test with an urgent billing issue
-initial_state = {
-    "email_content": "I was charged twice for my subscription! This is urgent!",
-    "sender_email": "customer@example.com",
-    "email_id": "email_123",
-    "messages": []
-}
-
-# Run with a thread_id for persistence
-config = {"configurable": {"thread_id": "customer_123"}}
-result = app.invoke(initial_state, config)
-# The graph will pause at human_review
-print(f"Draft ready for review: {result['draft_response'][:100]}...")
-
-# When ready, provide human input to resume
-from langgraph.types import Command
 
-human_response = Command(
-    resume={
-        "approved": True,
-        "edited_response": "We sincerely apologize for the double charge. I've initiated an immediate refund..."
+if __name__ == "__main__":
+    # Test with an urgent billing issue
+    initial_state = {
+        "email_content": "I was charged twice for my subscription! This is urgent!",
+        "sender_email": "customer@example.com",
+        "email_id": "email_123",
+        "messages": []
     }
-)
 
-# Resume execution
-final_result = app.invoke(human_response, config)
-print(f"Email sent successfully!")
+    # Run with a thread_id for persistence
+    config = {"configurable": {"thread_id": "customer_123"}}
+    result = app.invoke(initial_state, config)
+    # The graph will pause at human_review
+    print(f"Draft ready for review: {(result.get('draft_response') or '')[:100]}...")
+
+    # When ready, provide human input to resume
+    from langgraph.types import Command
+
+    human_response = Command(
+        resume={
+            "approved": True,
+            "edited_response": "We sincerely apologize for the double charge. I've initiated an immediate refund..."
+        }
+    )
+
+    # Resume execution
+    final_result = app.invoke(human_response, config)
+    print(f"Email sent successfully!")
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+本地的 OpenAI 兼容替身服务
+
+只实现 POST /v1/chat/completions：回显最后一条用户消息，支持 stream=true（SSE）。
+协议为 HTTP/1.1 keep-alive，用来在没有网络和 API key 时验证连接池（http_pool.py）
+是否真的复用了连接，以及测量客户端这一侧的开销。设置 rate_limit 后，每 rate_window 秒
+超过 rate_limit 个请求时返回 429（带 Retry-After），用来验证 rate_limit.py。
+
+    python openai_standin.py --port 8765
+    MY_OPENAI_API_BASE=http://127.0.0.1:8765/v1 MY_OPENAI_API_KEY=sk-local python chat.py
+
+也可以在进程内启动：
+    server = StandinServer(latency=0.05).start()
+    ...  server.base_url  ...
+    server.stop()
+"""
+
+import argparse
+import collections
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+def _last_user_text(messages: list) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, list):
+                return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return str(content or "")
+    return ""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写，不关 Nagle 的话 keep-alive 连接上每个请求都要多等一次延迟 ACK（约 40ms）
+    disable_nagle_algorithm = True
+    server: "_Server"
+
+    def log_message(self, format, *args):  # noqa: A002 - 覆盖基类签名
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data: bytes) -> None:
+        # 流式响应不知道总长度，用 chunked 编码以保持连接可复用
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+            return
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+            return
+
+        retry_after = self.server.admit()
+        if retry_after is not None:
+            data = json.dumps({"error": {"message": "Rate limit reached", "type": "requests",
+                                         "code": "rate_limit_exceeded"}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Retry-After", f"{retry_after:.3f}")
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.server.record_request(self.client_address)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        text = _last_user_text(payload.get("messages", []))
+        model = payload.get("model", "standin")
+        created = int(time.time())
+        completion_id = f"chatcmpl-standin-{self.server.requests}"
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in payload.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(text.split()),
+            "total_tokens": prompt_tokens + len(text.split()),
+        }
+
+        if not payload.get("stream"):
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [{"role": "assistant", "content": ""}]
+        pieces += [{"content": token} for token in re.findall(r"\s*\S+", text)]
+        for i, delta in enumerate(pieces):
+            if i and self.server.token_latency:
+                time.sleep(self.server.token_latency)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            self._write_chunk(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        self._write_chunk(b"data: " + json.dumps(final).encode("utf-8") + b"\n\n")
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float, token_latency: float, verbose: bool,
+                 rate_limit: int = 0, rate_window: float = 60.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.verbose = verbose
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.requests = 0
+        self.throttled = 0
+        self._recent: collections.deque[float] = collections.deque()
+        self._peers: set = set()
+        self._lock = threading.Lock()
+
+    def admit(self) -> Optional[float]:
+        """None if the request is within the rate limit, otherwise the Retry-After seconds."""
+        if not self.rate_limit:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0] <= now - self.rate_window:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit:
+                self.throttled += 1
+                return self._recent[0] + self.rate_window - now
+            self._recent.append(now)
+            return None
+
+    def record_request(self, peer) -> None:
+        with self._lock:
+            self.requests += 1
+            self._peers.add(peer)
+
+    @property
+    def connections(self) -> int:
+        """Distinct client connections seen so far (one per TCP source port)."""
+        with self._lock:
+            return len(self._peers)
+
+
+class StandinServer:
+    """Run the stand-in on a background thread.
+
+    Args:
+        host/port: port 0 picks a free port, see ``base_url``
+        latency: seconds before the response starts
+        token_latency: seconds between streamed tokens
+        rate_limit / rate_window: answer 429 beyond ``rate_limit`` requests per ``rate_window`` seconds
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 token_latency: float = 0.0, verbose: bool = False,
+                 rate_limit: int = 0, rate_window: float = 60.0):
+        self._server = _Server((host, port), latency, token_latency, verbose, rate_limit, rate_window)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    @property
+    def connections(self) -> int:
+        return self._server.connections
+
+    @property
+    def throttled(self) -> int:
+        return self._server.throttled
+
+    def start(self) -> "StandinServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="openai-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--rpm", type=int, default=0, help="answer 429 beyond this many requests per minute")
+    args = parser.parse_args()
+
+    server = _Server((args.host, args.port), args.latency, args.token_latency, verbose=True, rate_limit=args.rpm)
+    print(f"OpenAI stand-in listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+列目录之后的预读（speculative prefetch）
+
+list_directory 之后模型几乎总会接着 read_file_tool 其中几个文件，每次都是一整轮模型往返。
+列目录返回时，Prefetcher 在后台线程里挑出最可能被读的文件并提前放进 file_cache：
+- README、入口文件和项目清单（main.py、__main__.py、package.json、pyproject.toml ...）
+- 最近修改过的小文本文件
+- 层级越深分数越低，二进制扩展名、超过 PREFETCH_MAX_FILE_BYTES 的文件不预读
+每次预读有文件数和字节数预算；新的列目录请求会取消还在排队的旧任务，正在执行的任务在
+下一个文件之前检查取消标记。之后的读取直接命中内存，命中情况见 stats()。
+
+    PREFETCH=1                  0 / false / off 关闭
+    PREFETCH_MAX_FILES=8        每次列目录最多预读的文件数
+    PREFETCH_MAX_BYTES=2097152  每次列目录最多预读的字节数
+    PREFETCH_MAX_FILE_BYTES=262144
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from dir_index import IndexEntry
+from file_cache import file_cache
+from file_pager import FULL_READ_LIMIT
+
+DEFAULT_MAX_FILES = int(os.getenv("PREFETCH_MAX_FILES", "8"))
+DEFAULT_MAX_BYTES = int(os.getenv("PREFETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+DEFAULT_MAX_FILE_BYTES = min(int(os.getenv("PREFETCH_MAX_FILE_BYTES", str(256 * 1024))), FULL_READ_LIMIT)
+# 排队中的任务上限，超出时取消最旧的
+MAX_PENDING_JOBS = 2
+# 已预读路径的记录上限，用于统计命中
+_MAX_TRACKED = 1024
+
+ENTRY_POINTS = {
+    "main.py", "__main__.py", "__init__.py", "app.py", "cli.py", "manage.py", "server.py",
+    "setup.py", "setup.cfg", "pyproject.toml", "requirements.txt", "package.json", "tsconfig.json",
+    "index.js", "index.ts", "main.go", "go.mod", "cargo.toml", "main.rs", "lib.rs",
+    "makefile", "dockerfile", "docker-compose.yml", ".env.example",
+}
+TEXT_EXTS = {
+    ".py", ".pyi", ".md", ".rst", ".txt", ".json", ".jsonl", ".yaml", ".yml", ".toml", ".ini", ".cfg",
+    ".csv", ".tsv", ".js", ".jsx", ".ts", ".tsx", ".go", ".rs", ".java", ".c", ".h", ".cpp", ".hpp",
+    ".sh", ".sql", ".html", ".css", ".xml", ".log",
+}
+BINARY_EXTS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".ico", ".pdf", ".zip", ".gz", ".tar", ".whl", ".so", ".dll",
+    ".exe", ".bin", ".pyc", ".pyo", ".o", ".a", ".sqlite", ".db", ".mp3", ".mp4", ".woff", ".woff2",
+}
+
+
+def prefetch_enabled() -> bool:
+    return os.getenv("PREFETCH", "1").strip().lower() not in ("0", "false", "off")
+
+
+def score(name: str, depth: int, size: int, age_seconds: float) -> float:
+    """How likely a listed file is to be read next; <= 0 means not worth prefetching."""
+    lower = name.lower()
+    ext = os.path.splitext(lower)[1]
+    if ext in BINARY_EXTS:
+        return 0.0
+    value = 0.0
+    if lower.startswith("readme"):
+        value += 100
+    elif lower in ENTRY_POINTS:
+        value += 60
+    if ext in TEXT_EXTS:
+        value += 10
+    # 最近一天内修改的文件加分，越新越高
+    if age_seconds < 86400:
+        value += 30 * (1 - age_seconds / 86400)
+    if value <= 10:
+        return 0.0
+    # 越深越不容易被读；同等条件下小文件优先
+    return value - 15 * (depth - 1) - size / 65536
+
+
+class _Job:
+    def __init__(self, root: str, entries: list[IndexEntry]):
+        self.root = root
+        self.entries = entries
+        self.cancelled = threading.Event()
+
+
+class Prefetcher:
+    """Warm the file cache for the files a listing makes likely to be read next.
+
+    Args:
+        warm: reads one file into the cache, defaults to ``file_cache.get``; chat.py also pre-renders the tool output
+        max_files / max_bytes: I/O budget of one listing
+        max_file_bytes: larger files are never prefetched
+    """
+
+    def __init__(self, warm: Optional[Callable[[str], object]] = None,
+                 max_files: int = DEFAULT_MAX_FILES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_file_bytes: int = DEFAULT_MAX_FILE_BYTES, enabled: Optional[bool] = None):
+        self.warm = warm or file_cache.get
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.enabled = prefetch_enabled() if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._pending: deque[_Job] = deque()
+        self._running: Optional[_Job] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._prefetched: dict[str, None] = {}   # 按插入顺序，超出上限时丢掉最旧的
+        self.scheduled = 0
+        self.cancelled = 0
+        self.files = 0
+        self.bytes = 0
+        self.already_cached = 0
+        self.hits = 0
+
+    def schedule(self, root: str, entries: Iterable[IndexEntry]) -> None:
+        """Queue a prefetch for the files of one listing; returns immediately."""
+        if not self.enabled:
+            return
+        files = [e for e in entries if not e.is_dir and 0 < e.size <= self.max_file_bytes]
+        if not files:
+            return
+        job = _Job(os.path.abspath(root), files)
+        with self._lock:
+            self._pending.append(job)
+            self.scheduled += 1
+            # 模型已经在看新的目录了，旧的预读不再有价值
+            while len(self._pending) > MAX_PENDING_JOBS:
+                self._pending.popleft().cancelled.set()
+                self.cancelled += 1
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+            pool = self._pool
+        pool.submit(self._run_next)
+
+    def cancel(self) -> None:
+        """Cancel the running and all queued prefetches (e.g. the session was cleared)."""
+        with self._lock:
+            jobs = list(self._pending) + ([self._running] if self._running else [])
+            self._pending.clear()
+            for job in jobs:
+                if not job.cancelled.is_set():
+                    job.cancelled.set()
+                    self.cancelled += 1
+
+    def claim(self, path: str) -> bool:
+        """Record a read of ``path``; True if it was served thanks to a prefetch."""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._prefetched:
+                del self._prefetched[path]
+                self.hits += 1
+                return True
+        return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "scheduled": self.scheduled,
+                "cancelled": self.cancelled,
+                "files": self.files,
+                "bytes": self.bytes,
+                "already_cached": self.already_cached,
+                "hits": self.hits,
+            }
+
+    def shutdown(self) -> None:
+        self.cancel()
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _run_next(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            job = self._running = self._pending.popleft()
+        try:
+            if not job.cancelled.is_set():
+                self._run(job)
+        finally:
+            with self._lock:
+                self._running = None
+
+    def _run(self, job: _Job) -> None:
+        now = time.time()
+        ranked = []
+        for entry in job.entries:
+            path = os.path.join(job.root, entry.path)
+            try:
+                age = now - os.stat(path).st_mtime
+            except OSError:
+                continue
+            value = score(entry.path.rsplit("/", 1)[-1], entry.depth, entry.size, age)
+            if value > 0:
+                ranked.append((-value, entry.path, path, entry.size))
+        ranked.sort()
+
+        files = used = 0
+        for _, _, path, size in ranked:
+            if files >= self.max_files:
+                break
+            if job.cancelled.is_set():
+                return
+            if used + size > self.max_bytes:
+                continue
+            if file_cache.peek(path) is not None:
+                with self._lock:
+                    self.already_cached += 1
+                continue
+            try:
+                self.warm(path)
+            except Exception:
+                # 预读失败不影响任何东西，真正读取时会报告错误
+                continue
+            files += 1
+            used += size
+            with self._lock:
+                self.files += 1
+                self.bytes += size
+                self._prefetched[path] = None
+                if len(self._prefetched) > _MAX_TRACKED:
+                    del self._prefetched[next(iter(self._prefetched))]
+
+
+def format_stats(stats: dict) -> str:
+    if not stats["enabled"]:
+        return "prefetch: off (set PREFETCH=1 to enable)"
+    return (f"prefetch: {stats['files']} files / {stats['bytes']} bytes warmed for "
+            f"{stats['scheduled']} listings ({stats['cancelled']} cancelled, "
+            f"{stats['already_cached']} already cached), {stats['hits']} later reads served from it")
@@ -0,0 +1,342 @@
+"""
+REPL 里按需开启的 CPU / 内存分析
+
+长会话里变慢或内存上涨时不用重启，直接在 REPL 输入：
+    profile on / profile off   每轮对话用 cProfile 采样，结束后打印最耗时的函数
+    mem                        tracemalloc 快照：分配最多的代码行，以及消息历史、checkpoint 等对象各占多少
+    stats                      每轮的墙钟时间拆成 等模型 / 工具 / 框架开销（其余部分）
+
+    profiler = ReplProfiler()
+    if profiler.handle(user_input, owners=lambda: {"message history": messages}):
+        continue
+    with profiler.turn() as callbacks:
+        graph.invoke(inputs, config={"callbacks": callbacks, ...})
+
+Python 3.11 及以前，cProfile 只能采样开启它的线程。turn() 采样 REPL 所在的线程（异步图的节点都在这里），
+同步图的节点和 ToolExecutor 里的工具在各自的工作线程上运行，由 NodeProfiler 回调在
+节点 / 工具开始时在该线程上开启采样，结束时关闭，最后合并成一份报告。
+asyncio.to_thread 里执行的工具函数不在采样范围内（但计入 stats 的工具时间）。
+Python 3.12 起 cProfile 基于 sys.monitoring：整个进程同时只能有一个 Profile（再开启会报
+ValueError），但它记录所有线程的调用，所以 turn() 只用这一个 Profile，不再挂 NodeProfiler。
+其它分析工具（调试器、coverage）已经占用时，这一轮不采样并给出提示。
+mem 第一次执行时才启动 tracemalloc，之后的分配才会被记录；启动后分配有约 2 倍的开销，
+profile off 不会停止它，输入 mem off 停止。
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, TextIO
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "20"))
+# stats 保留最近多少轮
+STATS_TURNS = 50
+
+
+def deep_sizeof(obj: Any) -> int:
+    """Approximate memory held by ``obj`` and everything it references (each object counted once)."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, type):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current, 0)
+        if isinstance(current, (str, bytes, bytearray, int, float, bool)) or current is None:
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        else:
+            attrs = getattr(current, "__dict__", None)
+            if attrs is not None:
+                stack.append(attrs)
+            for slot in getattr(type(current), "__slots__", ()):
+                if hasattr(current, slot):
+                    stack.append(getattr(current, slot))
+    return total
+
+
+def _human(size: float) -> str:
+    if abs(size) < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KB", "MB"):
+        size /= 1024
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GB"
+
+
+def _union(intervals: list[tuple[float, float]]) -> float:
+    """Total length covered by possibly overlapping intervals (parallel tool calls count once)."""
+    total = 0.0
+    end = float("-inf")
+    for start, stop in sorted(intervals):
+        if stop <= end:
+            continue
+        total += stop - max(start, end)
+        end = stop
+    return total
+
+
+class TurnTimer(BaseCallbackHandler):
+    """Collects the model-call and tool-call intervals of one turn."""
+
+    run_inline = True
+    raise_error = False
+
+    def __init__(self):
+        self._open: dict[UUID, tuple[str, float]] = {}
+        self.intervals: dict[str, list[tuple[float, float]]] = {"model": [], "tool": []}
+        self.calls = {"model": 0, "tool": 0}
+
+    def _start(self, run_id: UUID, kind: str) -> None:
+        self._open[run_id] = (kind, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> None:
+        entry = self._open.pop(run_id, None)
+        if entry is not None:
+            self.intervals[entry[0]].append((entry[1], time.perf_counter()))
+            self.calls[entry[0]] += 1
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "model")
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "model")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "tool")
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+
+# 每个线程同时只能有一个 cProfile 在采样，后开启的会顶掉前一个
+_active = threading.local()
+# 3.12+ 一个 Profile 覆盖所有线程，见模块说明
+PROCESS_WIDE_PROFILE = sys.version_info >= (3, 12)
+
+
+class NodeProfiler(BaseCallbackHandler):
+    """Profiles graph nodes and tool calls on whatever thread runs them (Python 3.11 and older)."""
+
+    run_inline = True
+    raise_error = False
+
+    def __init__(self):
+        self.profiles: list[cProfile.Profile] = []
+        self._running: dict[UUID, cProfile.Profile] = {}
+        self._lock = threading.Lock()
+
+    def _begin(self, run_id: UUID) -> None:
+        if getattr(_active, "profile", None) is not None:
+            return
+        profile = cProfile.Profile()
+        _active.profile = profile
+        self._running[run_id] = profile
+        profile.enable()
+
+    def _end(self, run_id: UUID) -> None:
+        profile = self._running.pop(run_id, None)
+        if profile is None:
+            return
+        profile.disable()
+        _active.profile = None
+        with self._lock:
+            self.profiles.append(profile)
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, tags: Optional[list] = None, **kwargs: Any) -> None:
+        # 只在节点这一层开启，节点内部的 runnable 由同一个采样覆盖
+        if tags and any(t.startswith("graph:step:") for t in tags):
+            self._begin(run_id)
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._begin(run_id)
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+
+class ReplProfiler:
+    """The ``profile on/off``, ``mem`` and ``stats`` REPL commands plus per-turn measurement.
+
+    Args:
+        top: how many functions ``profile`` and lines ``mem`` print
+        out: where reports are written, default stdout
+    """
+
+    def __init__(self, top: int = PROFILE_TOP, out: Optional[TextIO] = None):
+        self.top = top
+        self.out = out or sys.stdout
+        self.profiling = False
+        self.turns: list[dict] = []
+
+    def _print(self, text: str = "") -> None:
+        print(text, file=self.out)
+
+    # ---- 命令 ----
+
+    def handle(self, command: str, owners: Optional[Callable[[], dict]] = None) -> bool:
+        """Run ``command`` if it is a profiling command; True when it was handled.
+
+        ``owners`` returns ``{label: object or size in bytes}`` for ``mem`` to break down,
+        e.g. the message history and the checkpoint of the current session.
+        """
+        command = " ".join(command.lower().split())
+        if command == "profile on":
+            self.profiling = True
+            self._print(f"profiling on: the top {self.top} functions are printed after each turn")
+        elif command == "profile off":
+            self.profiling = False
+            self._print("profiling off")
+        elif command == "mem":
+            self.memory_report(owners() if owners is not None else {})
+        elif command == "mem off":
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            self._print("tracemalloc stopped")
+        elif command == "stats":
+            self.stats_report()
+        else:
+            return False
+        return True
+
+    # ---- 每轮 ----
+
+    @contextmanager
+    def turn(self) -> Iterator[list]:
+        """Measure one turn; yields the callbacks to put into the graph config."""
+        timer = TurnTimer()
+        callbacks: list = [timer]
+        profiler = node_profiler = None
+        if self.profiling:
+            profiler = cProfile.Profile()
+            if not PROCESS_WIDE_PROFILE:
+                node_profiler = NodeProfiler()
+                callbacks.append(node_profiler)
+        start = time.perf_counter()
+        if profiler is not None:
+            try:
+                profiler.enable()
+                _active.profile = profiler
+            except ValueError as e:
+                # 3.12+：调试器、coverage 等已经占用了 sys.monitoring 的分析工具槽位
+                self._print(f"[profile] skipped this turn: {e}")
+                profiler = None
+                if node_profiler is not None:
+                    callbacks.remove(node_profiler)
+        try:
+            yield callbacks
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _active.profile = None
+            wall = time.perf_counter() - start
+            model = _union(timer.intervals["model"])
+            tool = _union(timer.intervals["tool"])
+            self.turns.append({
+                "wall": wall,
+                "model": model,
+                "tool": tool,
+                # 模型和工具不会同时运行，剩下的就是框架本身（图调度、checkpoint、渲染等）
+                "framework": max(0.0, wall - model - tool),
+                "model_calls": timer.calls["model"],
+                "tool_calls": timer.calls["tool"],
+            })
+            del self.turns[:-STATS_TURNS]
+            if profiler is not None:
+                self._print_profile(profiler, node_profiler.profiles if node_profiler is not None else [])
+
+    def _print_profile(self, profiler: cProfile.Profile, others: list[cProfile.Profile]) -> None:
+        buffer = io.StringIO()
+        stats = pstats.Stats(profiler, stream=buffer)
+        for other in others:
+            stats.add(other)
+        # 按自身耗时排序：REPL 线程等待工作线程（模型、工具）的时间集中在一行 lock.acquire，
+        # 不会像按累计时间排序那样让外层的调度函数占满前几名
+        stats.strip_dirs().sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        if PROCESS_WIDE_PROFILE:
+            self._print("\n[profile] top functions by own time (all threads)")
+        else:
+            self._print(f"\n[profile] top functions by own time ({len(others)} node / tool runs on worker threads merged)")
+        # 去掉 pstats 开头的空行和总计之外的说明
+        self._print("\n".join(line for line in buffer.getvalue().splitlines() if line.strip()))
+
+    # ---- 报告 ----
+
+    def stats_report(self) -> None:
+        if not self.turns:
+            self._print("no turns measured yet")
+            return
+        self._print(f"{'turn':>4} {'wall s':>8} {'model s':>8} {'tool s':>8} {'framework s':>12} {'calls m/t':>10}")
+        first = len(self.turns) - min(len(self.turns), 10)
+        for i, t in enumerate(self.turns[first:], first + 1):
+            calls = f"{t['model_calls']}/{t['tool_calls']}"
+            self._print(f"{i:>4} {t['wall']:>8.2f} {t['model']:>8.2f} {t['tool']:>8.2f} {t['framework']:>12.3f} {calls:>10}")
+        wall = sum(t["wall"] for t in self.turns) or 1e-9
+        shares = {k: sum(t[k] for t in self.turns) / wall * 100 for k in ("model", "tool", "framework")}
+        self._print(f"last {len(self.turns)} turns: model {shares['model']:.0f}%, tool {shares['tool']:.0f}%, "
+                    f"framework {shares['framework']:.0f}% of {wall:.1f} s wall time")
+
+    def memory_report(self, owners: dict) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._print("tracemalloc started; allocations from now on are tracked, run 'mem' again later")
+        else:
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            self._print(f"traced: {_human(current)} now, {_human(peak)} peak")
+            self._print(f"top {self.top} allocation sites:")
+            for stat in snapshot.statistics("lineno")[:self.top]:
+                frame = stat.traceback[0]
+                self._print(f"  {_human(stat.size):>10} {stat.count:>8} blocks  "
+                            f"{os.path.basename(frame.filename)}:{frame.lineno}")
+
+        if owners:
+            sizes = {label: value if isinstance(value, int) else deep_sizeof(value) for label, value in owners.items()}
+            self._print("largest owners:")
+            for label, size in sorted(sizes.items(), key=lambda item: -item[1]):
+                self._print(f"  {_human(size):>10}  {label}")
+        try:
+            import resource
+
+            # Linux 上单位是 KB，macOS 上是字节
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self._print(f"peak RSS: {_human(peak_rss if sys.platform == 'darwin' else peak_rss * 1024)}")
+        except ImportError:
+            pass
@@ -0,0 +1,462 @@
+"""
+模型调用的客户端限流
+
+很多会话或批量邮件同时运行时，服务端很快返回 429，而 RetryPolicy / openai 客户端的
+自动重试是各自盲目重试的，限流时只会让请求更多。RateLimiter 放在每次模型调用外面：
+- RPM / TPM 两个令牌桶，请求在发出前就按配额排队，不会去撞服务端的限额
+- AIMD 自适应并发：成功时并发上限缓慢增加（每轮 +1），收到 429 时减半，
+  延迟明显高于基线时小幅下降；429 带 Retry-After 时所有请求一起暂停
+- 排队是先进先出的，大请求不会被后面的小请求饿死
+- 429 / 5xx / 连接错误由限流器统一退避重试；开启时 models.get_chat_model 会把
+  ChatOpenAI 自己的重试关掉，否则限流器看不到 429
+- stats() 给出排队深度、等待时间、在途请求数、当前并发上限和 429 次数
+
+    limiter = get_rate_limiter()
+    response = limiter.call(llm.invoke, messages)
+    response = await limiter.acall(llm.ainvoke, messages)
+
+环境变量：
+    LLM_RATE_LIMIT=1               0 表示关闭（call/acall 直接调用）
+    LLM_RPM=0                      每分钟请求数，0 表示不限
+    LLM_TPM=0                      每分钟 token 数，0 表示不限
+    LLM_RATE_BURST_SECONDS=10      桶容量为这么多秒的配额；服务端通常按更细的窗口计数，整分钟的突发会触发 429
+    LLM_MAX_CONCURRENCY=16         自适应并发的上下限和初始值
+    LLM_MIN_CONCURRENCY=1
+    LLM_INITIAL_CONCURRENCY=4
+    LLM_LATENCY_TOLERANCE=3        延迟超过基线的这个倍数时减小并发，0 表示不看延迟
+    LLM_OUTPUT_TOKENS=512          估算 token 时为输出预留的数量
+    LLM_RATE_MAX_RETRIES=4
+"""
+
+import asyncio
+import collections
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+# 429 之外，这些状态码说明服务端过载，同样按限流处理
+_THROTTLE_STATUS = {429, 503, 529}
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_throttle(exc: BaseException) -> bool:
+    return _status_code(exc) in _THROTTLE_STATUS or type(exc).__name__ == "RateLimitError"
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Errors worth retrying without treating them as a throttling signal."""
+    code = _status_code(exc)
+    if code is not None:
+        return code >= 500
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectError",
+                                  "ReadTimeout", "ConnectTimeout", "RemoteProtocolError")
+
+
+def estimate_tokens(value: Any, output_tokens: int = 0) -> int:
+    """Rough token count of a model input (str, messages, prompt value): ~4 chars per token."""
+    if hasattr(value, "to_messages"):
+        value = value.to_messages()
+    if isinstance(value, (list, tuple)):
+        chars = 0
+        for item in value:
+            content = getattr(item, "content", item)
+            if isinstance(item, tuple) and len(item) == 2:
+                content = item[1]
+            chars += len(str(content))
+    else:
+        chars = len(str(value))
+    return chars // 4 + 1 + output_tokens
+
+
+def _used_tokens(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage_metadata", None)
+    if usage and usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    return None
+
+
+class TokenBucket:
+    """Token bucket refilled at ``per_minute / 60`` per second, holding at most ``burst`` seconds of it."""
+
+    def __init__(self, per_minute: float, burst: float = 60.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` tokens are available (0 if they are now)."""
+        self._refill(now)
+        # 超过桶容量的请求按整桶计算，否则永远等不到
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float) -> None:
+        """Give back (positive) or charge (negative) tokens once the real usage is known."""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Waiter:
+    """One queued request; woken from any thread, waits either in a thread or on an event loop."""
+
+    def __init__(self, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.tokens = tokens
+        self.loop = loop
+        self.enqueued = time.monotonic()
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.event = asyncio.Event()
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class Ticket:
+    """A granted slot; pass it back to ``RateLimiter.release``."""
+
+    __slots__ = ("tokens", "started")
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.started = time.monotonic()
+
+
+class RateLimiter:
+    """RPM/TPM token buckets plus AIMD adaptive concurrency around model calls.
+
+    Args:
+        rpm / tpm: requests / tokens per minute, 0 for no limit
+        burst: seconds of quota the buckets may spend at once
+        max_concurrency / min_concurrency / initial_concurrency: bounds and start of the adaptive limit
+        latency_tolerance: shrink the limit when a call takes longer than this multiple of the
+            baseline latency; 0 ignores latency
+        output_tokens: tokens reserved for the completion when estimating a request
+        max_retries: retries after a throttled / transient failure in ``call`` / ``acall``
+        enabled: False makes ``call`` / ``acall`` plain pass-throughs
+    """
+
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        burst: float = 10.0,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        initial_concurrency: int = 4,
+        latency_tolerance: float = 3.0,
+        output_tokens: int = 512,
+        max_retries: int = 4,
+        enabled: bool = True,
+    ):
+        if not 1 <= min_concurrency <= max_concurrency:
+            raise ValueError("need 1 <= min_concurrency <= max_concurrency")
+        self.enabled = enabled
+        self.rpm = TokenBucket(rpm, burst) if rpm > 0 else None
+        self.tpm = TokenBucket(tpm, burst) if tpm > 0 else None
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.latency_tolerance = latency_tolerance
+        self.output_tokens = output_tokens
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        self._queue: collections.deque[_Waiter] = collections.deque()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        # 延迟基线：成功请求延迟的指数移动平均。模型延迟随输出长度波动很大，
+        # 只有明显超过平均水平（服务端开始排队）时才减小并发
+        self._baseline: Optional[float] = None
+
+        self._waits: collections.deque[float] = collections.deque(maxlen=1000)
+        self._counts = collections.Counter()
+        self._max_queue = 0
+
+    # ---- 排队 ----
+
+    def _grant_delay(self, tokens: int, now: float) -> Optional[float]:
+        """0 when the head request may go now, seconds to wait for the buckets, None for a free slot."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= int(self.limit):
+            return None
+        delay = 0.0
+        if self.rpm is not None:
+            delay = max(delay, self.rpm.delay(1, now))
+        if self.tpm is not None:
+            delay = max(delay, self.tpm.delay(tokens, now))
+        return delay
+
+    def _try_grant(self, waiter: _Waiter) -> tuple[Optional[Ticket], Optional[float]]:
+        # 只有队头可以拿到配额，保证先进先出
+        with self._lock:
+            if not self._queue or self._queue[0] is not waiter:
+                return None, None
+            now = time.monotonic()
+            delay = self._grant_delay(waiter.tokens, now)
+            if delay != 0:
+                return None, delay
+            self._queue.popleft()
+            if self.rpm is not None:
+                self.rpm.take(1)
+            if self.tpm is not None:
+                self.tpm.take(waiter.tokens)
+            self._in_flight += 1
+            self._waits.append(now - waiter.enqueued)
+            self._counts["requests"] += 1
+            self._counts["tokens_reserved"] += waiter.tokens
+            self._wake_head_locked()
+            return Ticket(waiter.tokens), None
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        with self._lock:
+            self._queue.append(waiter)
+            self._max_queue = max(self._max_queue, len(self._queue))
+            if len(self._queue) == 1:
+                waiter.wake()
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        # 等待中被取消（Ctrl-C、任务取消）时让出队头
+        with self._lock:
+            try:
+                self._queue.remove(waiter)
+            except ValueError:
+                return
+            self._wake_head_locked()
+
+    def _wake_head_locked(self) -> None:
+        if self._queue:
+            self._queue[0].wake()
+
+    def acquire(self, tokens: int = 1) -> Ticket:
+        """Block until a request of ``tokens`` tokens may be sent."""
+        waiter = _Waiter(tokens)
+        self._enqueue(waiter)
+        try:
+            while True:
+                ticket, delay = self._try_grant(waiter)
+                if ticket is not None:
+                    return ticket
+                waiter.event.wait(delay)
+                waiter.event.clear()
+        except BaseException:
+            self._dequeue(waiter)
+            raise
+
+    async def aacquire(self, tokens: int = 1) -> Ticket:
+        """``acquire`` for coroutines; waits without blocking the event loop."""
+        waiter = _Waiter(tokens, asyncio.get_running_loop())
+        self._enqueue(waiter)
+        try:
+            while True:
+                ticket, delay = self._try_grant(waiter)
+                if ticket is not None:
+                    return ticket
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                waiter.event.clear()
+        except BaseException:
+            self._dequeue(waiter)
+            raise
+
+    # ---- 反馈 ----
+
+    def release(self, ticket: Ticket, used_tokens: Optional[int] = None, throttled: bool = False,
+                retry_after: Optional[float] = None, failed: bool = False) -> None:
+        """Return a slot and feed the outcome back into the AIMD limit and the TPM bucket."""
+        now = time.monotonic()
+        latency = now - ticket.started
+        with self._lock:
+            self._in_flight -= 1
+            if self.tpm is not None and used_tokens is not None:
+                self.tpm.adjust(ticket.tokens - used_tokens)
+            if throttled:
+                self._counts["throttled"] += 1
+                # multiplicative decrease；多个在途请求同时收到 429 时只减一次
+                if now >= self._paused_until:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                pause = retry_after if retry_after is not None else min(30.0, 2.0 ** self._counts["throttled_streak"])
+                self._counts["throttled_streak"] += 1
+                self._paused_until = max(self._paused_until, now + pause)
+                if self.rpm is not None:
+                    # 服务端的窗口比我们估计的紧，清空令牌重新攒
+                    self.rpm.tokens = min(self.rpm.tokens, 0)
+            elif failed:
+                self._counts["failed"] += 1
+            else:
+                self._counts["throttled_streak"] = 0
+                if self._latency_ok(latency):
+                    # additive increase：大约每 limit 个成功请求 +1
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                else:
+                    self._counts["slow"] += 1
+                    self.limit = max(self.min_concurrency, self.limit * 0.9)
+            self._wake_head_locked()
+
+    def _latency_ok(self, latency: float) -> bool:
+        if not self.latency_tolerance:
+            return True
+        if self._baseline is None:
+            self._baseline = latency
+            return True
+        ok = latency <= self._baseline * self.latency_tolerance
+        self._baseline += (latency - self._baseline) * 0.1
+        return ok
+
+    # ---- 调用 ----
+
+    def _backoff(self, attempt: int) -> float:
+        return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def call(self, fn: Callable[..., Any], *args, tokens: Optional[int] = None, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` inside the limiter, retrying throttled / transient failures.
+
+        ``tokens`` defaults to an estimate from the first positional argument.
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+        if tokens is None:
+            tokens = estimate_tokens(args[0] if args else "", self.output_tokens)
+        for attempt in range(self.max_retries + 1):
+            ticket = self.acquire(tokens)
+            released = False
+            try:
+                result = fn(*args, **kwargs)
+                used = _used_tokens(result)
+                released = True
+                self.release(ticket, used_tokens=used)
+                return result
+            except Exception as e:
+                # 不论是否还会重试都要先归还名额，最后一次失败也不例外
+                released = True
+                if not self._retry(ticket, e) or attempt >= self.max_retries:
+                    raise
+                throttled = is_throttle(e)
+            finally:
+                if not released:
+                    self.release(ticket, failed=True)
+            if not throttled:
+                time.sleep(self._backoff(attempt))
+
+    async def acall(self, fn: Callable[..., Awaitable[Any]], *args, tokens: Optional[int] = None, **kwargs) -> Any:
+        """Async ``call``: ``fn`` returns an awaitable."""
+        if not self.enabled:
+            return await fn(*args, **kwargs)
+        if tokens is None:
+            tokens = estimate_tokens(args[0] if args else "", self.output_tokens)
+        for attempt in range(self.max_retries + 1):
+            ticket = await self.aacquire(tokens)
+            released = False
+            try:
+                result = await fn(*args, **kwargs)
+                used = _used_tokens(result)
+                released = True
+                self.release(ticket, used_tokens=used)
+                return result
+            except Exception as e:
+                # 不论是否还会重试都要先归还名额，最后一次失败也不例外
+                released = True
+                if not self._retry(ticket, e) or attempt >= self.max_retries:
+                    raise
+                throttled = is_throttle(e)
+            finally:
+                if not released:
+                    self.release(ticket, failed=True)
+            if not throttled:
+                await asyncio.sleep(self._backoff(attempt))
+
+    def _retry(self, ticket: Ticket, exc: Exception) -> bool:
+        """Release ``ticket`` for a failed call; True when the call should be retried."""
+        if is_throttle(exc):
+            self.release(ticket, throttled=True, retry_after=_retry_after(exc))
+            return True
+        self.release(ticket, failed=True)
+        return is_transient(exc)
+
+    # ---- 统计 ----
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            counts = dict(self._counts)
+            stats = {
+                "limit": round(self.limit, 2),
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self._max_queue,
+                "paused_s": max(0.0, self._paused_until - time.monotonic()),
+            }
+        stats.update({
+            "requests": counts.get("requests", 0),
+            "throttled": counts.get("throttled", 0),
+            "failed": counts.get("failed", 0),
+            "slow": counts.get("slow", 0),
+            "tokens_reserved": counts.get("tokens_reserved", 0),
+            "wait_p50_ms": waits[len(waits) // 2] * 1000 if waits else 0.0,
+            "wait_p95_ms": waits[int(0.95 * (len(waits) - 1))] * 1000 if waits else 0.0,
+            "wait_max_ms": waits[-1] * 1000 if waits else 0.0,
+        })
+        return stats
+
+
+def format_stats(stats: dict) -> str:
+    return (f"rate limit: concurrency {stats['in_flight']}/{stats['limit']}, queue {stats['queue_depth']} "
+            f"(max {stats['max_queue_depth']}), wait p50 {stats['wait_p50_ms']:.0f} ms / "
+            f"p95 {stats['wait_p95_ms']:.0f} ms, {stats['requests']} requests, {stats['throttled']} throttled")
+
+
+_default: Optional[RateLimiter] = None
+_default_lock = threading.Lock()
+
+
+def rate_limit_enabled() -> bool:
+    return os.getenv("LLM_RATE_LIMIT", "1").strip().lower() not in ("0", "false", "off")
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The process-wide limiter shared by every model call, configured from the environment."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = RateLimiter(
+                rpm=float(os.getenv("LLM_RPM", "0")),
+                tpm=float(os.getenv("LLM_TPM", "0")),
+                burst=float(os.getenv("LLM_RATE_BURST_SECONDS", "10")),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+                min_concurrency=int(os.getenv("LLM_MIN_CONCURRENCY", "1")),
+                initial_concurrency=int(os.getenv("LLM_INITIAL_CONCURRENCY", "4")),
+                latency_tolerance=float(os.getenv("LLM_LATENCY_TOLERANCE", "3")),
+                output_tokens=int(os.getenv("LLM_OUTPUT_TOKENS", "512")),
+                max_retries=int(os.getenv("LLM_RATE_MAX_RETRIES", "4")),
+                enabled=rate_limit_enabled(),
+            )
+        return _default
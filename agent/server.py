@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+File Helper 的多会话 HTTP 服务
+
+chat.py 是单用户的 input() 循环，一个进程一次只服务一个 thread_id。这里用 asyncio 在一个进程里
+跑一个编译好的 chat_async 图，同时服务任意多个会话，模型 token 通过 SSE 实时推给各自的客户端。
+只用标准库（asyncio streams），每个连接处理一个请求（Connection: close）。
+
+    POST   /sessions                        新建会话，返回 {"thread_id": ...}
+    POST   /sessions/<thread_id>/messages   {"message": "..."}，返回 text/event-stream：
+               event: token   {"text": "..."}            模型输出（按帧合并）
+               event: tool    {"status": "invoking" | "finished", "name": "..."}
+               event: done    {"ttft_ms": ..., "total_ms": ..., "tokens": ...}
+               event: error   {"error": "..."}
+    GET    /sessions/<thread_id>/messages   对话历史
+    DELETE /sessions/<thread_id>            删除会话
+    GET    /health, GET /stats
+    GET    /metrics                         Prometheus 格式的节点 / 模型 / 工具耗时（需要 TRACE=1）
+
+    python server.py --port 8080
+    curl -N -X POST localhost:8080/sessions/demo/messages -d '{"message": "list files in ."}'
+
+- 同一会话同时最多 SESSION_MAX_RUNS 个运行（默认 1，同一 thread 并发写历史会乱序），超出返回 429
+- 整个进程同时最多 SERVER_MAX_RUNS 个运行，超出的排队等待
+- 客户端断开时取消对应的运行
+- SIGINT/SIGTERM：停止接受新请求，等进行中的运行最多 SERVER_SHUTDOWN_GRACE 秒后取消剩余的，
+  再关闭 checkpointer 和 HTTP 连接池
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+import uuid
+from typing import Optional
+from urllib.parse import unquote, urlsplit
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+import chat_async
+from file_cache import file_cache
+from http_pool import aclose_http_clients, close_http_clients
+from rate_limit import get_rate_limiter
+from stream_render import DEFAULT_FPS, StreamRenderer, message_text
+from tracing import get_tracer
+
+SESSION_MAX_RUNS = int(os.getenv("SESSION_MAX_RUNS", "1"))
+SERVER_MAX_RUNS = int(os.getenv("SERVER_MAX_RUNS", "32"))
+SHUTDOWN_GRACE = float(os.getenv("SERVER_SHUTDOWN_GRACE", "30"))
+MAX_BODY_BYTES = int(os.getenv("SERVER_MAX_BODY_BYTES", str(1024 * 1024)))
+# 等待模型时每隔这么多秒发一行 SSE 注释，防止代理把空闲连接断掉
+KEEPALIVE_SECONDS = 15.0
+HEADER_TIMEOUT = 10.0
+
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error",
+            503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class SSERenderer(StreamRenderer):
+    """StreamRenderer that turns flushed text and tool markers into SSE events on an asyncio queue.
+
+    Flushes happen on the renderer's own thread, so events are handed to the loop thread-safely.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, fps: float = DEFAULT_FPS):
+        super().__init__(fps=fps)
+        self.loop = loop
+        self.queue = queue
+
+    def _emit(self, event: str, data: dict) -> None:
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (event, data))
+
+    def _write_locked(self) -> None:
+        if not self._buffer:
+            return
+        self._emit("token", {"text": "".join(self._buffer)})
+        self._buffer.clear()
+        self.flushes += 1
+
+    def marker(self, text: str) -> None:
+        status, _, name = text.partition(": ")
+        with self._cond:
+            # 先把标记之前的 token 发出去，保持顺序
+            self._write_locked()
+            self._emit("tool", {"status": "finished" if status == "tool finished" else status, "name": name})
+
+
+def _message_dict(message) -> Optional[dict]:
+    if isinstance(message, HumanMessage):
+        return {"role": "user", "content": message_text(message.content)}
+    if isinstance(message, AIMessage):
+        return {"role": "assistant", "content": message_text(message.content),
+                "tool_calls": [{"name": c["name"], "args": c["args"]} for c in message.tool_calls]}
+    if isinstance(message, ToolMessage):
+        return {"role": "tool", "name": message.name, "content": message_text(message.content)}
+    return None
+
+
+class FileHelperService:
+    """Serve many File Helper sessions over HTTP + SSE from one compiled async graph."""
+
+    def __init__(self, graph=None, session_max_runs: int = SESSION_MAX_RUNS, max_runs: int = SERVER_MAX_RUNS):
+        self.graph = graph if graph is not None else chat_async.build_graph()
+        self.session_max_runs = session_max_runs
+        self.max_runs = max_runs
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._session_runs: dict[str, int] = {}
+        self._runs: set[asyncio.Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._accepting = False
+        self.started_at = time.time()
+        self.completed = 0
+        self.failed = 0
+
+    # ---- 生命周期 ----
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> "FileHelperService":
+        self._slots = asyncio.Semaphore(self.max_runs)
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self._accepting = True
+        return self
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def shutdown(self, grace: float = SHUTDOWN_GRACE) -> None:
+        """Stop accepting requests, let running turns finish for ``grace`` seconds, cancel the rest."""
+        self._accepting = False
+        if self._server is not None:
+            self._server.close()
+        if self._runs:
+            _, pending = await asyncio.wait(set(self._runs), timeout=grace)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        checkpointer = getattr(self.graph, "checkpointer", None)
+        if checkpointer is not None and hasattr(checkpointer, "close"):
+            checkpointer.close()
+        await aclose_http_clients()
+        close_http_clients()
+
+    # ---- HTTP ----
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, dict, bytes]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+        except (asyncio.LimitOverrunError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            raise HTTPError(400, "malformed request")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPError(400, "invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), unquote(urlsplit(target).path), headers, body
+
+    @staticmethod
+    async def _send_json(writer: asyncio.StreamWriter, status: int, payload: dict) -> None:
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                if not self._accepting:
+                    raise HTTPError(503, "server is shutting down")
+                method, path, headers, body = await self._read_request(reader)
+                await self._route(method, path, body, writer)
+            except HTTPError as e:
+                await self._send_json(writer, e.status, {"error": str(e)})
+            except (ConnectionError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                await self._send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+        parts = [p for p in path.split("/") if p]
+        if parts == ["health"] and method == "GET":
+            await self._send_json(writer, 200, {"status": "ok", "active_runs": len(self._runs)})
+        elif parts == ["stats"] and method == "GET":
+            await self._send_json(writer, 200, self.stats())
+        elif parts == ["metrics"] and method == "GET":
+            await self._send_metrics(writer)
+        elif parts == ["sessions"] and method == "POST":
+            await self._send_json(writer, 201, {"thread_id": f"file-helper-session-{uuid.uuid4().hex[:12]}"})
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages":
+            if method == "POST":
+                await self._post_message(parts[1], body, writer)
+            elif method == "GET":
+                await self._send_json(writer, 200, await self._history(parts[1]))
+            else:
+                raise HTTPError(405, f"{method} not allowed")
+        elif len(parts) == 2 and parts[0] == "sessions" and method == "DELETE":
+            if self._session_runs.get(parts[1]):
+                raise HTTPError(409, "session has a running turn")
+            await asyncio.to_thread(self.graph.checkpointer.delete_thread, parts[1])
+            await self._send_json(writer, 200, {"deleted": parts[1]})
+        else:
+            raise HTTPError(404, f"no route for {method} {path}")
+
+    @staticmethod
+    async def _send_metrics(writer: asyncio.StreamWriter) -> None:
+        tracer = get_tracer()
+        if tracer is None:
+            raise HTTPError(404, "tracing is disabled, start with TRACE=1")
+        data = tracer.render_prometheus().encode("utf-8")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            + f"Content-Length: {len(data)}\r\n".encode("latin-1")
+            + b"Connection: close\r\n\r\n" + data
+        )
+        await writer.drain()
+
+    async def _history(self, thread_id: str) -> dict:
+        state = await self.graph.aget_state({"configurable": {"thread_id": thread_id}})
+        messages = [_message_dict(m) for m in state.values.get("messages", [])]
+        return {"thread_id": thread_id, "messages": [m for m in messages if m is not None]}
+
+    # ---- 运行一轮对话 ----
+
+    async def _post_message(self, thread_id: str, body: bytes, writer: asyncio.StreamWriter) -> None:
+        try:
+            message = json.loads(body or b"{}").get("message", "")
+        except (json.JSONDecodeError, AttributeError):
+            raise HTTPError(400, "body must be a JSON object with a 'message' field")
+        if not isinstance(message, str) or not message.strip():
+            raise HTTPError(400, "'message' must be a non-empty string")
+        if self._session_runs.get(thread_id, 0) >= self.session_max_runs:
+            raise HTTPError(429, f"session {thread_id} already has {self.session_max_runs} running turn(s)")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        self._session_runs[thread_id] = self._session_runs.get(thread_id, 0) + 1
+        task = asyncio.create_task(self._run(thread_id, message, queue))
+        self._runs.add(task)
+        task.add_done_callback(self._runs.discard)
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        try:
+            await writer.drain()
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                    await writer.drain()
+                    continue
+                if item is None:
+                    break
+                event, data = item
+                writer.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # 客户端断开：没人再读输出，取消这一轮
+            task.cancel()
+            raise
+
+    async def _run(self, thread_id: str, message: str, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+
+        def put(item) -> None:
+            # 渲染器的输出经 call_soon_threadsafe 入队，这里同样走 call_soon，保证排在最后一段 token 之后
+            loop.call_soon(queue.put_nowait, item)
+
+        try:
+            async with self._slots:
+                renderer = SSERenderer(loop, queue)
+                timing = await chat_async.run_turn(self.graph, thread_id, message, renderer)
+            self.completed += 1
+            put(("done", timing))
+        except asyncio.CancelledError:
+            self.failed += 1
+            put(("error", {"error": "cancelled"}))
+            raise
+        except Exception as e:
+            self.failed += 1
+            put(("error", {"error": f"{type(e).__name__}: {e}"}))
+        finally:
+            remaining = self._session_runs.get(thread_id, 1) - 1
+            if remaining:
+                self._session_runs[thread_id] = remaining
+            else:
+                self._session_runs.pop(thread_id, None)
+            put(None)
+
+    def stats(self) -> dict:
+        return {
+            "uptime_s": time.time() - self.started_at,
+            "active_runs": len(self._runs),
+            "active_sessions": len(self._session_runs),
+            "completed": self.completed,
+            "failed": self.failed,
+            "max_runs": self.max_runs,
+            "session_max_runs": self.session_max_runs,
+            "file_cache": file_cache.stats(),
+            "rate_limit": get_rate_limiter().stats(),
+        }
+
+
+async def serve(host: str, port: int) -> None:
+    service = await FileHelperService().start(host, port)
+    print(f"File Helper service listening on http://{host}:{service.port}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    print(f"shutting down, waiting up to {SHUTDOWN_GRACE:.0f}s for {service.stats()['active_runs']} running turn(s)")
+    await service.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the File Helper graph over HTTP + SSE.")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8080")))
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
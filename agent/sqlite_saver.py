@@ -0,0 +1,505 @@
+"""
+基于 SQLite 的持久化 checkpointer
+
+MemorySaver 重启即丢失，而且 thread 不断轮换（例如 clear 命令）时内存会一直增长。
+SqliteDeltaSaver 把 checkpoint 写到本地 SQLite，并且只写增量：
+- 消息类的追加型 channel（默认 "messages"）写入 message_log，每一步只追加新消息，
+  checkpoint 里只记录当时的消息条数；读取时一次查询取回前 n 条，不需要回放历史。
+  共同前缀的每个位置都要核对：与上次写入的是同一个对象时直接通过，否则比较序列化后的 digest；
+  按 id 替换、RemoveMessage、从旧 checkpoint 分叉等非追加的更新会被发现，改为写完整 blob
+- 其它 channel 只在版本变化时写一份 blob
+- checkpoint 本身不再包含 channel_values，只有版本号等少量元数据
+因此每一步的写入量与对话长度无关。旧 thread 可按 TTL / LRU 淘汰；
+停在 interrupt（例如等待人工审核）的 thread 不会被自动淘汰，否则之后无法恢复。
+"""
+
+import asyncio
+import collections
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+
+# langgraph 记录 interrupt 的 channel 名（langgraph.constants.INTERRUPT 已不再公开）
+_INTERRUPT = "__interrupt__"
+DEFAULT_DB_PATH = os.path.expanduser(os.getenv("CHECKPOINT_DB", "~/.llm_checkpoints.sqlite"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    log_lengths TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS message_log (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    digest BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, seq)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    task_path TEXT NOT NULL DEFAULT '',
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+# 每写入这么多次 checkpoint 检查一次淘汰
+_EVICT_EVERY = 64
+# 内存里保留 log 状态（digest 列表 + 上次写入的消息对象）的 channel 数
+_MAX_LOG_STATES = 128
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class SqliteDeltaSaver(BaseCheckpointSaver):
+    """Checkpoint saver that appends message deltas instead of snapshotting state.
+
+    Args:
+        path: SQLite file, ``":memory:"`` for a throwaway store
+        log_channels: list-valued, append-only channels stored as a message log
+        ttl_seconds: threads untouched for longer than this are deleted
+        max_threads: keep at most this many threads, evicting least recently used
+
+    Threads whose latest checkpoint has a pending interrupt are never evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_DB_PATH,
+        *,
+        log_channels: Sequence[str] = ("messages",),
+        ttl_seconds: Optional[float] = 30 * 24 * 3600,
+        max_threads: Optional[int] = 1000,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self.log_channels = set(log_channels)
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.lock = threading.RLock()
+        # (thread_id, ns, channel) -> (log 中每条消息的 digest, 上次写入/核对过的消息对象)
+        self._log_states: collections.OrderedDict[tuple, tuple[list, list]] = collections.OrderedDict()
+        # (thread_id, ns) -> 最近一次写入的 log_lengths，避免每步都去读父 checkpoint
+        self._last_lengths: dict[tuple, tuple[str, dict]] = {}
+        self._puts = 0
+
+    # ---- 读取 ----
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        with self.lock:
+            if checkpoint_id:
+                row = self.conn.execute(
+                    "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata, log_lengths "
+                    "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata, log_lengths "
+                    "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            if row is None:
+                return None
+            self._touch(thread_id)
+            return self._load_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                 "metadata_type, metadata, log_lengths FROM checkpoints")
+        where, params = [], []
+        if config is not None:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if "checkpoint_ns" in config["configurable"]:
+                where.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before is not None and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_id)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+
+        count = 0
+        for thread_id, checkpoint_ns, *row in rows:
+            with self.lock:
+                item = self._load_tuple(thread_id, checkpoint_ns, row)
+            if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            yield item
+            count += 1
+            if limit is not None and count >= limit:
+                break
+
+    def _load_tuple(self, thread_id: str, checkpoint_ns: str, row) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, checkpoint_blob, metadata_type, metadata_blob, log_lengths = row
+        checkpoint = self.serde.loads_typed((type_, checkpoint_blob))
+        lengths = json.loads(log_lengths) if log_lengths else {}
+
+        channel_values = {}
+        for channel, version in checkpoint["channel_versions"].items():
+            if lengths.get(channel) is not None:
+                # 追加型 channel：一次查询取回前 n 条消息
+                rows = self.conn.execute(
+                    "SELECT type, blob FROM message_log WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "AND channel = ? AND seq < ? ORDER BY seq",
+                    (thread_id, checkpoint_ns, channel, lengths[channel]),
+                ).fetchall()
+                channel_values[channel] = [self.serde.loads_typed(r) for r in rows]
+                continue
+            blob_row = self.conn.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? "
+                "AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if blob_row is not None and blob_row[0] != "empty":
+                channel_values[channel] = self.serde.loads_typed(blob_row)
+
+        writes = self.conn.execute(
+            "SELECT task_id, channel, type, blob FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+            "AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=self.serde.loads_typed((metadata_type, metadata_blob)),
+            parent_config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": parent_id,
+            }} if parent_id else None,
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, b))) for task_id, channel, t, b in writes],
+        )
+
+    # ---- 写入 ----
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        parent_id = config["configurable"].get("checkpoint_id")
+
+        with self.lock:
+            try:
+                self._put_locked(thread_id, checkpoint_ns, parent_id, checkpoint, metadata, new_versions)
+            except Exception:
+                # 事务已回滚，内存里缓存的 log 状态可能已经不准确
+                for key in [k for k in self._log_states if k[0] == thread_id]:
+                    del self._log_states[key]
+                self._last_lengths.pop((thread_id, checkpoint_ns), None)
+                raise
+
+        self._puts += 1
+        if self._puts % _EVICT_EVERY == 0:
+            self.evict()
+
+        return {"configurable": {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint["id"],
+        }}
+
+    def _put_locked(self, thread_id, checkpoint_ns, parent_id, checkpoint, metadata, new_versions) -> None:
+        values = checkpoint["channel_values"]
+        with self.conn:
+            self.conn.execute("BEGIN")
+            lengths = self._parent_lengths(thread_id, checkpoint_ns, parent_id)
+            for channel, version in new_versions.items():
+                value = values.get(channel)
+                if channel in self.log_channels and isinstance(value, list):
+                    length = self._append_log(thread_id, checkpoint_ns, channel, value)
+                    if length is not None:
+                        lengths[channel] = length
+                        continue
+                # 非追加型 channel，或历史与 log 不一致（例如从旧 checkpoint 分叉）时写完整 blob
+                lengths.pop(channel, None)
+                type_, blob = self.serde.dumps_typed(value) if channel in values else ("empty", None)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, channel, str(version), type_, blob),
+                )
+
+            stored = {k: v for k, v in checkpoint.items() if k != "channel_values"}
+            type_, checkpoint_blob = self.serde.dumps_typed(stored)
+            metadata_type, metadata_blob = self.serde.dumps_typed(metadata)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint["id"], parent_id, type_, checkpoint_blob,
+                 metadata_type, metadata_blob, json.dumps(lengths) if lengths else None),
+            )
+            self._touch(thread_id)
+            self._last_lengths[(thread_id, checkpoint_ns)] = (checkpoint["id"], lengths)
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # 特殊 channel（错误、中断等）允许覆盖，普通写入只保留第一次
+        verb = "INSERT OR REPLACE" if all(w[0] in WRITES_IDX_MAP for w in writes) else "INSERT OR IGNORE"
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, task_path,
+                         WRITES_IDX_MAP.get(channel, idx), channel, type_, blob))
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(f"{verb} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _parent_lengths(self, thread_id: str, checkpoint_ns: str, parent_id: Optional[str]) -> dict:
+        if parent_id is None:
+            return {}
+        cached = self._last_lengths.get((thread_id, checkpoint_ns))
+        if cached is not None and cached[0] == parent_id:
+            return dict(cached[1])
+        row = self.conn.execute(
+            "SELECT log_lengths FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, parent_id),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return {}
+        return json.loads(row[0])
+
+    def _log_state(self, thread_id: str, checkpoint_ns: str, channel: str) -> tuple[list, list]:
+        key = (thread_id, checkpoint_ns, channel)
+        state = self._log_states.get(key)
+        if state is None:
+            digests = [row[0] for row in self.conn.execute(
+                "SELECT digest FROM message_log WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? "
+                "ORDER BY seq",
+                (thread_id, checkpoint_ns, channel),
+            )]
+            state = self._log_states[key] = (digests, [None] * len(digests))
+            while len(self._log_states) > _MAX_LOG_STATES:
+                self._log_states.popitem(last=False)
+        else:
+            self._log_states.move_to_end(key)
+        return state
+
+    def _append_log(self, thread_id: str, checkpoint_ns: str, channel: str, value: Sequence) -> Optional[int]:
+        """Append the new tail of ``value`` to the log; None if ``value`` is not an extension of it."""
+        digests, items = self._log_state(thread_id, checkpoint_ns, channel)
+        log_len = len(digests)
+        # 共同前缀逐条核对：未改动的消息在 add_messages 合并后仍是同一个对象，只需比较身份；
+        # 对象不同（按 id 替换、删除、分叉、重启后重新加载）时才序列化比较 digest
+        for seq in range(min(len(value), log_len)):
+            if value[seq] is items[seq]:
+                continue
+            if _digest(self.serde.dumps_typed(value[seq])[1]) != digests[seq]:
+                return None
+            items[seq] = value[seq]
+
+        rows = []
+        for seq in range(log_len, len(value)):
+            type_, blob = self.serde.dumps_typed(value[seq])
+            digest = _digest(blob)
+            rows.append((thread_id, checkpoint_ns, channel, seq, type_, blob, digest))
+        if rows:
+            self.conn.executemany("INSERT OR REPLACE INTO message_log VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            digests.extend(row[-1] for row in rows)
+            items.extend(value[log_len:])
+        return len(value)
+
+    # ---- thread 管理 ----
+
+    def _touch(self, thread_id: str) -> None:
+        self.conn.execute(
+            "INSERT INTO threads VALUES (?, ?) ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (thread_id, time.time()),
+        )
+
+    # ---- 异步接口：SQLite 调用放到线程里执行，不阻塞事件循环 ----
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: [*self.list(config, filter=filter, before=before, limit=limit)]
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    def latest_thread(self, prefix: str = "") -> Optional[str]:
+        """Most recently used thread id starting with ``prefix``."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT thread_id FROM threads WHERE thread_id LIKE ? ORDER BY updated_at DESC LIMIT 1",
+                (prefix.replace("%", r"\%").replace("_", r"\_") + "%",),
+            ).fetchone()
+        return row[0] if row else None
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("BEGIN")
+            for table in ("checkpoints", "blobs", "message_log", "writes", "threads"):
+                self.conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            for cache in (self._log_states, self._last_lengths):
+                for key in [k for k in cache if k[0] == thread_id]:
+                    del cache[key]
+
+    def _interrupted_threads(self) -> set[str]:
+        """Threads whose latest root checkpoint has a pending interrupt write."""
+        return {r[0] for r in self.conn.execute(
+            "SELECT DISTINCT w.thread_id FROM writes w JOIN ("
+            "  SELECT thread_id, MAX(checkpoint_id) AS checkpoint_id FROM checkpoints"
+            "  WHERE checkpoint_ns = '' GROUP BY thread_id"
+            ") latest ON w.thread_id = latest.thread_id AND w.checkpoint_id = latest.checkpoint_id "
+            "WHERE w.checkpoint_ns = '' AND w.channel = ?", (_INTERRUPT,)
+        )}
+
+    def evict(self) -> Sequence[str]:
+        """Delete threads past the TTL and the least recently used ones over ``max_threads``.
+
+        Threads waiting on an interrupt are kept and do not count towards ``max_threads``.
+        """
+        with self.lock:
+            if self.ttl_seconds is None and self.max_threads is None:
+                return []
+            waiting = self._interrupted_threads()
+            stale = set()
+            if self.ttl_seconds is not None:
+                stale.update(r[0] for r in self.conn.execute(
+                    "SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+                ))
+            if self.max_threads is not None:
+                ordered = [r[0] for r in self.conn.execute("SELECT thread_id FROM threads ORDER BY updated_at DESC")]
+                stale.update([t for t in ordered if t not in waiting][self.max_threads:])
+            stale -= waiting
+            for thread_id in stale:
+                self.delete_thread(thread_id)
+        return sorted(stale)
+
+    def get_next_version(self, current: Optional[str], channel: None = None) -> str:
+        # 与 InMemorySaver 相同的版本格式：可按字符串排序
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    def size_bytes(self) -> int:
+        """Size of the database (main file, excluding the WAL)."""
+        with self.lock:
+            pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        return pages * page_size
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,159 @@
+"""
+终端流式输出
+
+graph.stream(stream_mode="messages") 只产出模型 token 和节点返回的消息，
+事件在源头就已过滤，不需要再遍历 "events" 模式下的全部回调事件。
+StreamRenderer 把 token 先写入缓冲区，最多每秒 fps 次刷新到终端（token 很碎时
+每个 token 一次 write+flush 开销很大），工具开始/结束以标记的形式插入输出，
+并记录首 token 时间（TTFT）。
+
+    renderer = StreamRenderer()
+    renderer.start()
+    for message, metadata in graph.stream(inputs, config, stream_mode="messages"):
+        renderer.handle(message, metadata)
+    stats = renderer.finish()
+"""
+
+import os
+import sys
+import threading
+import time
+from typing import Optional, TextIO
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+# 终端刷新频率上限，STREAM_FPS=0 表示每个 token 立即输出
+DEFAULT_FPS = float(os.getenv("STREAM_FPS", "30"))
+
+
+def message_text(content) -> str:
+    if isinstance(content, list):
+        # 有些模型返回分段的 content，只取文本部分
+        return "".join(c.get("text", "") if isinstance(c, dict) else str(c) for c in content)
+    return str(content)
+
+
+class StreamRenderer:
+    """Buffered, frame-rate capped token writer with tool markers and TTFT.
+
+    Args:
+        out: where to write, default stdout
+        fps: maximum flushes per second; pending text is flushed by a background
+            thread at the end of each frame so a stalled stream never hides tokens
+        node: only tokens produced inside this graph node are rendered
+    """
+
+    def __init__(self, out: Optional[TextIO] = None, fps: float = DEFAULT_FPS, node: str = "llm_call"):
+        self.out = out or sys.stdout
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.node = node
+        self._buffer: list[str] = []
+        self._cond = threading.Condition()
+        self._flusher: Optional[threading.Thread] = None
+        self._running = False
+        self._open_tools: set[str] = set()
+        self.started_at = 0.0
+        self.first_token_at: Optional[float] = None
+        self.tokens = 0
+        self.flushes = 0
+
+    # ---- 生命周期 ----
+
+    def start(self) -> "StreamRenderer":
+        """Start timing a turn (TTFT is measured from here)."""
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.tokens = self.flushes = 0
+        self._open_tools.clear()
+        if self.interval and self._flusher is None:
+            self._running = True
+            self._flusher = threading.Thread(target=self._flush_loop, name="stream-render", daemon=True)
+            self._flusher.start()
+        return self
+
+    def finish(self) -> dict:
+        """Flush what is left, stop the flusher and return the turn's timings."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        end = time.perf_counter()
+        return {
+            "ttft_ms": (self.first_token_at - self.started_at) * 1000 if self.first_token_at else None,
+            "total_ms": (end - self.started_at) * 1000,
+            "tokens": self.tokens,
+            "flushes": self.flushes,
+        }
+
+    # ---- 输出 ----
+
+    def token(self, text: str) -> None:
+        if not text:
+            return
+        with self._cond:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.tokens += 1
+            self._buffer.append(text)
+            if not self.interval:
+                self._write_locked()
+            elif len(self._buffer) == 1:
+                # 缓冲区从空变为非空，通知刷新线程开始计时
+                self._cond.notify()
+
+    def marker(self, text: str) -> None:
+        """Write an inline marker line such as ``[invoking: read_file_tool]``."""
+        with self._cond:
+            self._buffer.append(f"\n[{text}]\n")
+            self._write_locked()
+
+    def flush(self) -> None:
+        with self._cond:
+            self._write_locked()
+
+    def _write_locked(self) -> None:
+        if not self._buffer:
+            return
+        self.out.write("".join(self._buffer))
+        self.out.flush()
+        self._buffer.clear()
+        self.flushes += 1
+
+    def _flush_loop(self) -> None:
+        with self._cond:
+            while self._running:
+                if not self._buffer:
+                    self._cond.wait()
+                    continue
+                # 攒一帧的 token 再一起输出
+                self._cond.wait(self.interval)
+                self._write_locked()
+
+    # ---- 处理 stream_mode="messages" 的输出 ----
+
+    def handle(self, message, metadata: dict) -> None:
+        """Render one ``(message, metadata)`` item of ``stream_mode="messages"``."""
+        if isinstance(message, ToolMessage):
+            self._open_tools.discard(message.tool_call_id)
+            self.marker(f"tool finished: {message.name}")
+            return
+        if metadata.get("langgraph_node") != self.node:
+            return
+        if isinstance(message, AIMessageChunk):
+            self.token(message_text(message.content))
+            # 工具调用的参数也是分块到达的，名字只出现在第一块
+            for chunk in message.tool_call_chunks:
+                key = chunk.get("id") or chunk.get("index")
+                if chunk.get("name") and key not in self._open_tools:
+                    self._open_tools.add(key)
+                    self.marker(f"invoking: {chunk['name']}")
+        elif isinstance(message, AIMessage):
+            # 不支持流式的模型只会产出一条完整消息
+            self.token(message_text(message.content))
+            for call in message.tool_calls:
+                if call.get("id") not in self._open_tools:
+                    self._open_tools.add(call.get("id"))
+                    self.marker(f"invoking: {call['name']}")
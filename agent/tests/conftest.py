@@ -0,0 +1,5 @@
+import os
+import sys
+
+# agent/ 下的模块都是平铺的脚本，按模块名直接导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,76 @@
+import threading
+
+from bm25_index import DocIndex
+
+
+def _write_docs(root, generation):
+    # 每一代的文件数不同，passage 编号随之整体移动
+    for i in range(generation % 3 + 2):
+        (root / f"doc{i}.md").write_text(f"doc {i} generation {generation} topic{i}\n\nmore text about topic{i}\n")
+
+
+def test_concurrent_rewrites_leave_a_consistent_index(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    _write_docs(docs, 0)
+    index = DocIndex(str(docs))
+    index.update()
+
+    errors = []
+
+    def writer(n):
+        try:
+            for generation in range(n, n + 5):
+                _write_docs(docs, generation)
+                index.update()
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n * 10,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert not [p for p in (docs / ".bm25").iterdir() if p.name.endswith(".tmp")]
+    reloaded = DocIndex(str(docs))
+    assert reloaded.load()
+    assert len(reloaded) == len(index)
+
+
+def test_ids_resolve_against_their_own_snapshot(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "b.md").write_text("password reset instructions")
+    index = DocIndex(str(docs))
+    index.update()
+    ids, table = index.search_snapshot("password", 1)
+
+    # 新文件排在前面，重写后 passage 0 换成了别的内容
+    (docs / "a.md").write_text("billing and invoices")
+    index.update()
+    assert index.passage_text(ids[0][0]) == "billing and invoices"
+    assert table.text(ids[0][0]) == "password reset instructions"
+
+
+def test_edited_doc_returns_indexed_text_until_update(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.md").write_text("password reset instructions")
+    index = DocIndex(str(docs))
+    index.update()
+    ids, table = index.search_snapshot("password", 1)
+
+    # 编辑后旧的字节偏移落在别的内容上；原文存在索引里，不受影响
+    (docs / "a.md").write_text("billing\n\n" + "invoices " * 200)
+    assert table.text(ids[0][0]) == "password reset instructions"
+    reloaded = DocIndex(str(docs))
+    assert reloaded.load()
+    assert reloaded.search("password")[0]["text"] == "password reset instructions"
+
+    index.update()
+    assert index.search("password") == []
+    assert table.text(ids[0][0]) == "password reset instructions"
+    # 上一代的原文文件已删除，已经映射它的 table 仍然可读
+    assert len([p for p in (docs / ".bm25").iterdir() if p.name.startswith("passages.")]) == 1
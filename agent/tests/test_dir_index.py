@@ -0,0 +1,38 @@
+import os
+
+from dir_index import DirIndex
+
+
+def _sizes(index, root):
+    return {e.path: e.size for e in index.walk(root, max_depth=3) if not e.is_dir}
+
+
+def test_sizes_follow_file_edits_without_rescan(tmp_path):
+    (tmp_path / "a.txt").write_text("abc")
+    (tmp_path / "empty.txt").write_text("")
+    index = DirIndex()
+    assert _sizes(index, tmp_path) == {"a.txt": 3, "empty.txt": 0}
+
+    # 改写文件不会改变目录 mtime，目录扫描结果可以复用，但大小必须是新的
+    (tmp_path / "a.txt").write_text("abc" + "x" * 5000)
+    (tmp_path / "empty.txt").write_text("now has content")
+    assert _sizes(index, tmp_path) == {"a.txt": 5003, "empty.txt": 15}
+    assert index.stats()["reuses"] == 1
+
+
+def test_symlinked_directory_is_a_dir_but_not_entered(tmp_path):
+    (tmp_path / "real").mkdir()
+    (tmp_path / "real" / "f.txt").write_text("x")
+    os.symlink(tmp_path / "real", tmp_path / "link")
+    os.symlink(tmp_path, tmp_path / "real" / "loop")
+
+    entries = {e.path: e.is_dir for e in DirIndex().walk(tmp_path, max_depth=5)}
+    assert entries == {"link": True, "real": True, "real/f.txt": False, "real/loop": True}
+
+
+def test_cached_directories_are_bounded(tmp_path):
+    for i in range(5):
+        (tmp_path / f"d{i}").mkdir()
+    index = DirIndex(max_dirs=3)
+    list(index.walk(tmp_path, max_depth=2))
+    assert index.stats()["directories"] == 3
@@ -0,0 +1,36 @@
+import json
+
+import file_outline
+from file_outline import FULL_READ_LIMIT
+
+
+def _big_array(path):
+    rows = [{"id": i, "name": f"user {i}", "tags": ["a", "b"]} for i in range(FULL_READ_LIMIT // 30)]
+    path.write_text(json.dumps(rows))
+    return len(rows)
+
+
+def test_json_over_read_limit_is_parsed_directly(tmp_path):
+    path = tmp_path / "rows.json"
+    count = _big_array(path)
+    assert path.stat().st_size > FULL_READ_LIMIT
+
+    out = file_outline.file_outline(str(path))
+    assert f"top level: array[{count}] of object" in out
+    assert "  name: str" in out
+
+
+def test_json_over_outline_limit_samples_the_head(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_outline, "FILE_OUTLINE_MAX_BYTES", FULL_READ_LIMIT)
+    path = tmp_path / "rows.json"
+    _big_array(path)
+    out = file_outline.file_outline(str(path))
+    assert "top level: array of object, first" in out
+    assert "  tags: array[2] of str" in out
+
+    # 对象的最后一个键的值被采样截断
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"version": 3, "records": [{"x": i} for i in range(FULL_READ_LIMIT // 8)]}))
+    out = file_outline.file_outline(str(path))
+    assert "  version: int = 3" in out
+    assert "  records: (value continues past the sampled part)" in out
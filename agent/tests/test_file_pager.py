@@ -0,0 +1,26 @@
+from file_pager import MAX_PAGE_BYTES, format_page, read_byte_range, read_line_range
+
+
+def test_overlong_line_points_to_byte_offset(tmp_path):
+    path = tmp_path / "wide.txt"
+    # é 占两个字节：这一行比一页长，剩下的部分一页读得完
+    path.write_text("short\n" + "é" * (MAX_PAGE_BYTES // 2 + 1000) + "END\nnext line\n", encoding="utf-8")
+
+    page = read_line_range(str(path), 2)
+    assert page.line_truncated and page.last_line == 2
+    assert page.end - page.start <= MAX_PAGE_BYTES
+    assert "�" not in page.text   # 截断在完整的 utf-8 字符上
+    assert f"offset={page.end}" in format_page(page)
+
+    # 按提示的 offset 能读到这一行剩下的部分，再用 start_line 接着读下一行
+    rest = read_byte_range(str(path), page.end, MAX_PAGE_BYTES)
+    assert rest.text.endswith("END\nnext line\n")
+    assert read_line_range(str(path), 3).text == "next line\n"
+
+
+def test_regular_pages_keep_line_hint(tmp_path):
+    path = tmp_path / "lines.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(1, 11)))
+    page = read_line_range(str(path), 1, 4)
+    assert not page.line_truncated
+    assert "next: start_line=5" in format_page(page)
@@ -0,0 +1,60 @@
+import threading
+
+import file_search
+from file_search import format_result, search_tree
+
+
+def _tree(root):
+    for i in range(4):
+        (root / f"f{i}.txt").write_text("a" * 40 + "b\nhello world\n")
+
+
+def test_literal_search_in_process(tmp_path):
+    _tree(tmp_path)
+    result = search_tree(str(tmp_path), "HELLO")
+    assert result.matches == 4 and not result.timed_out
+
+
+def test_catastrophic_regex_times_out_and_pool_recovers(tmp_path, monkeypatch):
+    _tree(tmp_path)
+    monkeypatch.setattr(file_search, "SEARCH_WORKERS", 2)
+    monkeypatch.setattr(file_search, "SEARCH_TIMEOUT_SECONDS", 1)
+    try:
+        result = search_tree(str(tmp_path), r"(a+)+$", regex=True)
+        assert result.timed_out
+        assert "results are partial" in format_result(result)
+
+        # 卡住的 worker 已被结束，下一次搜索用新的进程池
+        result = search_tree(str(tmp_path), r"hel+o", regex=True)
+        assert result.matches == 4 and not result.timed_out
+    finally:
+        file_search.shutdown_pool(kill=True)
+
+
+def test_timeout_does_not_break_concurrent_search(tmp_path, monkeypatch):
+    stuck, slow = tmp_path / "stuck", tmp_path / "slow"
+    stuck.mkdir()
+    slow.mkdir()
+    _tree(stuck)
+    # 每个文件单独一批、各要运行约 0.1 s，超时结束旧进程池时这个搜索还有批次在跑
+    for i in range(16):
+        (slow / f"f{i}.txt").write_text("x" * 24 + "\nhello\n")
+    monkeypatch.setattr(file_search, "SEARCH_WORKERS", 2)
+    monkeypatch.setattr(file_search, "SEARCH_TIMEOUT_SECONDS", 1)
+    monkeypatch.setattr(file_search, "SEARCH_BATCH_FILES", 1)
+    results = {}
+
+    def search(name, root, query):
+        results[name] = search_tree(str(root), query, regex=True)
+
+    threads = [threading.Thread(target=search, args=("stuck", stuck, r"(a+)+$")),
+               threading.Thread(target=search, args=("slow", slow, r"(x|xx)+y|hel+o"))]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results["stuck"].timed_out
+        assert results["slow"].matches == 16 and not results["slow"].timed_out
+    finally:
+        file_search.shutdown_pool(kill=True)
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+import pytest
+
+from rate_limit import RateLimiter
+
+
+class ServerError(Exception):
+    status_code = 502
+
+
+def _limiter(**kwargs) -> RateLimiter:
+    options = dict(initial_concurrency=2, max_concurrency=2, min_concurrency=1, latency_tolerance=0)
+    options.update(kwargs)
+    limiter = RateLimiter(**options)
+    limiter._backoff = lambda attempt: 0.0
+    return limiter
+
+
+def _fail(prompt):
+    raise ValueError("boom")
+
+
+def _call_in_thread(limiter: RateLimiter, fn) -> threading.Thread:
+    thread = threading.Thread(target=lambda: limiter.call(fn, "x"), daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    return thread
+
+
+def test_last_failed_attempt_releases_slot_without_retries():
+    limiter = _limiter(max_retries=0)
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            limiter.call(_fail, "x")
+    assert limiter.stats()["in_flight"] == 0
+    # 名额都还回来了，后续调用不会卡住
+    assert not _call_in_thread(limiter, lambda prompt: "ok").is_alive()
+
+
+def test_exhausted_transient_retries_release_slot():
+    limiter = _limiter(initial_concurrency=1, max_concurrency=1)
+    calls = []
+
+    def always_502(prompt):
+        calls.append(1)
+        raise ServerError("unavailable")
+
+    with pytest.raises(ServerError):
+        limiter.call(always_502, "x")
+    assert len(calls) == limiter.max_retries + 1
+    assert limiter.stats()["in_flight"] == 0
+    assert not _call_in_thread(limiter, lambda prompt: "ok").is_alive()
+
+
+def test_acall_releases_slot_on_final_failure():
+    limiter = _limiter(max_retries=1)
+
+    async def always_502(prompt):
+        raise ServerError("unavailable")
+
+    async def main():
+        for _ in range(3):
+            with pytest.raises(ServerError):
+                await limiter.acall(always_502, "x")
+        return await asyncio.wait_for(limiter.acall(lambda prompt: asyncio.sleep(0, "ok"), "x"), 5)
+
+    assert asyncio.run(main()) == "ok"
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_success_releases_slot():
+    limiter = _limiter()
+    assert limiter.call(lambda prompt: prompt.upper(), "x") == "X"
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_final_throttled_attempt_releases_slot():
+    limiter = _limiter(max_retries=0)
+
+    class Throttled(Exception):
+        status_code = 429
+
+    def throttled(prompt):
+        raise Throttled("slow down")
+
+    with pytest.raises(Throttled):
+        limiter.call(throttled, "x")
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter.stats()["throttled"] == 1
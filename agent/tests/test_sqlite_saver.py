@@ -0,0 +1,115 @@
+import operator
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+from typing_extensions import Annotated, TypedDict
+
+from sqlite_saver import SqliteDeltaSaver
+
+
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+    turns: Annotated[int, operator.add]
+
+
+def reply(state: State):
+    return {"messages": [AIMessage(f"reply to {state['messages'][-1].content}")], "turns": 1}
+
+
+def build(path):
+    builder = StateGraph(State)
+    builder.add_node("reply", reply)
+    builder.add_edge(START, "reply")
+    builder.add_edge("reply", END)
+    return builder.compile(checkpointer=SqliteDeltaSaver(str(path)))
+
+
+CONFIG = {"configurable": {"thread_id": "t1"}}
+
+
+def contents(graph, config=CONFIG):
+    return [m.content for m in graph.get_state(config).values["messages"]]
+
+
+@pytest.fixture
+def db(tmp_path):
+    return tmp_path / "checkpoints.sqlite"
+
+
+def test_append_survives_reopen(db):
+    graph = build(db)
+    graph.invoke({"messages": [HumanMessage("one")]}, CONFIG)
+    graph.invoke({"messages": [HumanMessage("two")]}, CONFIG)
+    expected = ["one", "reply to one", "two", "reply to two"]
+    assert contents(graph) == expected
+    assert contents(build(db)) == expected
+
+
+def test_in_place_edit_is_persisted(db):
+    graph = build(db)
+    graph.invoke({"messages": [HumanMessage("orig")]}, CONFIG)
+    first = graph.get_state(CONFIG).values["messages"][0]
+    graph.update_state(CONFIG, {"messages": [HumanMessage("EDITED", id=first.id)]})
+    assert contents(graph) == ["EDITED", "reply to orig"]
+    assert contents(build(db)) == ["EDITED", "reply to orig"]
+    # 编辑之后继续追加也要正确
+    graph.invoke({"messages": [HumanMessage("next")]}, CONFIG)
+    assert contents(build(db)) == ["EDITED", "reply to orig", "next", "reply to next"]
+
+
+def test_remove_message_is_persisted(db):
+    graph = build(db)
+    graph.invoke({"messages": [HumanMessage("one")]}, CONFIG)
+    graph.invoke({"messages": [HumanMessage("two")]}, CONFIG)
+    first = graph.get_state(CONFIG).values["messages"][0]
+    graph.update_state(CONFIG, {"messages": [RemoveMessage(id=first.id)]})
+    expected = ["reply to one", "two", "reply to two"]
+    assert contents(graph) == expected
+    assert contents(build(db)) == expected
+
+
+def test_fork_keeps_both_branches(db):
+    graph = build(db)
+    graph.invoke({"messages": [HumanMessage("one")]}, CONFIG)
+    after_first = graph.get_state(CONFIG).config
+    graph.invoke({"messages": [HumanMessage("two")]}, CONFIG)
+
+    # 从第一轮结束时的 checkpoint 分叉出另一条历史
+    graph.invoke({"messages": [HumanMessage("other")]}, after_first)
+    forked = ["one", "reply to one", "other", "reply to other"]
+    assert contents(graph) == forked
+
+    reopened = build(db)
+    assert contents(reopened) == forked
+    main_branch = [s for s in reopened.get_state_history(CONFIG)
+                   if [m.content for m in s.values.get("messages", [])][-1:] == ["reply to two"]]
+    assert [m.content for m in main_branch[0].values["messages"]] == ["one", "reply to one", "two", "reply to two"]
+
+
+def test_evict_keeps_threads_waiting_on_interrupt(tmp_path):
+    from langgraph.types import Command, interrupt
+
+    def review(state: State):
+        return {"messages": [AIMessage(content=interrupt("approve?"))]}
+
+    builder = StateGraph(State)
+    builder.add_node("review", review)
+    builder.add_edge(START, "review")
+    builder.add_edge("review", END)
+    saver = SqliteDeltaSaver(str(tmp_path / "cp.sqlite"), max_threads=2)
+    graph = builder.compile(checkpointer=saver)
+
+    waiting = {"configurable": {"thread_id": "waiting"}}
+    graph.invoke({"messages": [HumanMessage(content="hi")]}, waiting)
+    for i in range(4):
+        done = {"configurable": {"thread_id": f"done-{i}"}}
+        graph.invoke({"messages": [HumanMessage(content="hi")]}, done)
+        graph.invoke(Command(resume="ok"), done)
+
+    # 最旧的 thread 停在 interrupt 上，不能被 LRU 淘汰，也不占 max_threads 的名额
+    assert sorted(saver.evict()) == ["done-0", "done-1"]
+    assert graph.get_state(waiting).next == ("review",)
+    graph.invoke(Command(resume="approved"), waiting)
+    assert graph.get_state(waiting).values["messages"][-1].content == "approved"
@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from vector_index import VectorIndex  # noqa: E402
+
+TEXTS = [f"how do I reset my password, variant {i}" for i in range(200)] + ["refund a duplicate invoice"] * 20
+
+
+def test_concurrent_builds_leave_one_loadable_generation(tmp_path):
+    errors = []
+
+    def build(quantize, clusters):
+        try:
+            for i in range(3):
+                VectorIndex(str(tmp_path)).build(TEXTS, quantize=quantize, clusters=clusters, tag=f"{quantize}{i}")
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=build, args=(q, c)) for q in (False, True) for c in (0, 8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+    index = VectorIndex(str(tmp_path))
+    assert index.load()
+    assert len(index) == len(TEXTS)
+    assert index.search("refund invoice", 1)[0][0] >= 200
+
+
+def test_search_with_tag_ignores_other_generations(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    index.build(TEXTS, tag="v1")
+    assert index.search("reset password", 2, tag="v1")
+    assert index.search("reset password", 2, tag="v2") == []
@@ -0,0 +1,132 @@
+"""
+并发工具执行器
+
+LLM 一次返回多个 tool_calls 时，按顺序逐个执行会让整轮耗时等于所有工具耗时之和。
+ToolExecutor 用线程池并发执行它们（文件读取等 I/O 会释放 GIL），
+整轮耗时约等于最慢的那个工具；返回的 ToolMessage 顺序与 tool_calls 顺序保持一致。
+节点把自己的 config 传进来时，工具调用会带上图的回调（追踪、流式事件），线程池里也不会丢。
+异步图中使用 arun：各工具的 ainvoke 并发执行，同样受 max_workers 限制。
+传入 result_store（见 tool_results.py）时，超长的工具输出会落盘，ToolMessage 里只保留预览和 handle。
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+
+# 默认并发上限，可通过环境变量 TOOL_MAX_WORKERS 调整
+DEFAULT_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "4"))
+
+
+def _default_error_message(exc: Exception) -> str:
+    return f"错误：执行工具时出现问题 - {str(exc)}"
+
+
+class ToolExecutor:
+    """Run the tool calls of one AIMessage concurrently, preserving their order.
+
+    Args:
+        tools: tools the model may call, looked up by ``tool.name``
+        max_workers: upper bound on tool calls running at the same time
+        catch_errors: turn tool exceptions into an error ToolMessage instead of raising
+        error_message: formats the content of that error ToolMessage
+        result_store: a ``ToolResultStore``; outputs above its threshold are replaced by a preview and a handle
+    """
+
+    def __init__(
+        self,
+        tools: Iterable,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        catch_errors: bool = True,
+        error_message: Callable[[Exception], str] = _default_error_message,
+        result_store=None,
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1")
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.max_workers = max_workers
+        self.catch_errors = catch_errors
+        self.error_message = error_message
+        self.result_store = result_store
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        # 线程池懒加载，整个进程复用同一个
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="tool-exec",
+                )
+            return self._pool
+
+    def _run_one(self, tool_call: dict, config: Optional[RunnableConfig] = None) -> ToolMessage:
+        try:
+            tool = self.tools_by_name[tool_call["name"]]
+            observation = tool.invoke(tool_call["args"], config)
+        except Exception as e:
+            if not self.catch_errors:
+                raise
+            observation = self.error_message(e)
+        return self._message(tool_call, observation)
+
+    async def _arun_one(self, tool_call: dict, semaphore: asyncio.Semaphore,
+                        config: Optional[RunnableConfig] = None) -> ToolMessage:
+        async with semaphore:
+            try:
+                tool = self.tools_by_name[tool_call["name"]]
+                observation = await tool.ainvoke(tool_call["args"], config)
+            except Exception as e:
+                if not self.catch_errors:
+                    raise
+                observation = self.error_message(e)
+        if self.result_store is not None:
+            # 落盘是文件 I/O，不在事件循环线程里做
+            return await asyncio.to_thread(self._message, tool_call, observation)
+        return self._message(tool_call, observation)
+
+    def _message(self, tool_call: dict, observation) -> ToolMessage:
+        content = str(observation)
+        if self.result_store is not None:
+            content = self.result_store.spill(content, tool_call["name"])
+        return ToolMessage(
+            content=content,
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+        )
+
+    def run(self, tool_calls: list[dict], config: Optional[RunnableConfig] = None) -> list[ToolMessage]:
+        """Execute ``tool_calls`` and return one ToolMessage per call, in call order.
+
+        ``config`` is passed to every tool invocation (callbacks, tags, metadata).
+        """
+        if not tool_calls:
+            return []
+
+        # 只有一个调用时没必要切线程
+        if len(tool_calls) == 1 or self.max_workers == 1:
+            return [self._run_one(tool_call, config) for tool_call in tool_calls]
+
+        futures = [self._get_pool().submit(self._run_one, tool_call, config) for tool_call in tool_calls]
+        # 按提交顺序取结果，保证 ToolMessage 与 tool_call_id 的顺序一致
+        return [future.result() for future in futures]
+
+    async def arun(self, tool_calls: list[dict], config: Optional[RunnableConfig] = None) -> list[ToolMessage]:
+        """Async variant of ``run``; sync-only tools are run in the event loop's default executor."""
+        if not tool_calls:
+            return []
+        semaphore = asyncio.Semaphore(self.max_workers)
+        return list(await asyncio.gather(
+            *(self._arun_one(tool_call, semaphore, config) for tool_call in tool_calls)
+        ))
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
@@ -0,0 +1,212 @@
+"""
+超大工具结果落盘
+
+一次 read_file_tool / list_directory 的输出可能有几十万字符，直接放进 ToolMessage 后，
+它会进入 State.messages，之后每个 checkpoint 和每次调用模型的 prompt 都要带着它。
+ToolResultStore 把超过阈值的结果写到本地 blob 目录（按内容 sha256 寻址，相同输出只存一份），
+ToolMessage 里只留开头/结尾预览和一个 handle，模型需要时用 read_tool_result 分页读取剩余部分。
+
+blob 目录在进程之间共享、重启后仍然有效（SQLite checkpoint 里的旧 handle 还能读到），
+超过 TOOL_RESULT_TTL_SECONDS 没有再写入的 blob 会被删除，总大小超过 TOOL_RESULT_MAX_BYTES 时
+按最近写入时间淘汰最旧的 blob（重复写入同样内容也算）。
+注意：blob 就是工具输出的原文，其中包括被读取文件的原始内容，会以明文留在 TOOL_RESULT_DIR 里
+（默认最多 7 天、256 MB）。读过敏感文件后可以手动清空这个目录，或者用 TOOL_RESULT_MAX_CHARS=0 关闭落盘。
+
+read_file_page / read_tool_result 本身就是分页输出，search_files / file_outline 的输出有上限，
+这些工具的结果不落盘，否则模型要为同一页内容多走一轮。
+
+    TOOL_RESULT_DIR=~/.llm_tool_results
+    TOOL_RESULT_MAX_CHARS=8000       超过这个长度的结果才落盘，0 表示关闭
+    TOOL_RESULT_PREVIEW_CHARS=2400   预览的字符数（开头 2/3，结尾 1/3）
+    TOOL_RESULT_MAX_BYTES=268435456  blob 目录的大小上限
+    TOOL_RESULT_TTL_SECONDS=604800   blob 的保留时间，0 表示不过期
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from file_pager import DEFAULT_PAGE_BYTES, Page, page_hint, read_byte_range, read_line_range
+
+DEFAULT_DIR = os.path.expanduser(os.getenv("TOOL_RESULT_DIR", "~/.llm_tool_results"))
+DEFAULT_MAX_CHARS = int(os.getenv("TOOL_RESULT_MAX_CHARS", "8000"))
+DEFAULT_PREVIEW_CHARS = int(os.getenv("TOOL_RESULT_PREVIEW_CHARS", "2400"))
+DEFAULT_MAX_BYTES = int(os.getenv("TOOL_RESULT_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_TTL_SECONDS = float(os.getenv("TOOL_RESULT_TTL_SECONDS", str(7 * 24 * 3600)))
+# 过期清理要扫描整个目录，最多这么久做一次
+_EXPIRE_INTERVAL = 3600
+
+# 分页读取工具自身的输出不能再落盘，否则模型永远拿不到内容；
+# read_file_page 默认一页 16 KB，本来就超过阈值，和有上限的工具一样落盘只会多一轮往返
+NEVER_SPILL = frozenset({"read_tool_result", "read_file_page", "search_files", "file_outline"})
+
+_HANDLE_RE = re.compile(r"^tr-[0-9a-f]{20}$")
+
+
+def _cut(text: str, limit: int, from_end: bool = False) -> str:
+    """At most ``limit`` chars from one end of ``text``, cut at a line break when one is near."""
+    if len(text) <= limit:
+        return text
+    if from_end:
+        piece = text[-limit:]
+        newline = piece.find("\n")
+        return piece[newline + 1:] if 0 <= newline < limit // 4 else piece
+    piece = text[:limit]
+    newline = piece.rfind("\n")
+    return piece[:newline] if newline > limit * 3 // 4 else piece
+
+
+class ToolResultStore:
+    """Content-addressed blob store for tool outputs that are too large to keep in the history.
+
+    Args:
+        root: directory holding the blobs, created on first use
+        max_chars: outputs longer than this are spilled; 0 disables spilling
+        preview_chars: size of the head + tail preview left in the ToolMessage
+        max_bytes: disk budget of ``root``, least recently stored blobs are removed beyond it
+        ttl_seconds: blobs not stored again for this long are removed; 0 keeps them
+    """
+
+    def __init__(self, root: str = DEFAULT_DIR, max_chars: int = DEFAULT_MAX_CHARS,
+                 preview_chars: int = DEFAULT_PREVIEW_CHARS, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.root = root
+        self.max_chars = max_chars
+        self.preview_chars = min(preview_chars, max_chars) if max_chars else preview_chars
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._expired_at = 0.0
+        self._lock = threading.Lock()
+        self._total: Optional[int] = None    # 第一次写入时才扫描目录
+        self.spilled = 0
+        self.spilled_chars = 0
+        self.reads = 0
+
+    def path(self, handle: str) -> str:
+        # handle 来自模型的参数，必须校验格式，不能让它拼出 root 之外的路径
+        if not _HANDLE_RE.match(handle or ""):
+            raise ValueError(f"'{handle}' is not a tool result handle")
+        return os.path.join(self.root, handle + ".txt")
+
+    def put(self, text: str) -> str:
+        """Store ``text`` and return its handle; identical outputs share one blob."""
+        data = text.encode("utf-8")
+        handle = "tr-" + hashlib.sha256(data).hexdigest()[:20]
+        path = self.path(handle)
+        with self._lock:
+            self._load_total()
+            if os.path.exists(path):
+                os.utime(path)   # 刷新使用时间，淘汰时排在后面
+                return handle
+            # 先写临时文件再改名，其它进程不会读到写了一半的 blob
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self._total += len(data)
+            expire_due = self.ttl_seconds > 0 and time.time() - self._expired_at > _EXPIRE_INTERVAL
+            if expire_due or self._total > self.max_bytes:
+                self._prune(keep=path)
+        return handle
+
+    def spill(self, content: str, tool_name: str) -> str:
+        """``content`` itself if it is small enough, otherwise a preview plus the handle of the stored blob."""
+        if not self.max_chars or len(content) <= self.max_chars or tool_name in NEVER_SPILL:
+            return content
+        try:
+            handle = self.put(content)
+        except OSError:
+            # 磁盘不可写时退回原样返回，宁可上下文大一些也不能丢结果
+            return content
+        self.spilled += 1
+        self.spilled_chars += len(content)
+
+        head = _cut(content, self.preview_chars * 2 // 3)
+        tail = _cut(content, self.preview_chars - len(head), from_end=True)
+        omitted = content[len(head):len(content) - len(tail)]
+        lines = content.count("\n") + 1
+        first_omitted = head.count("\n") + 2
+        return (
+            f"[output of {tool_name} is {len(content)} chars / {lines} lines, too large for the chat; "
+            f"stored as tool result handle '{handle}']\n"
+            f"{head}\n"
+            f"... [{len(omitted)} chars omitted, about lines {first_omitted}-{lines - tail.count(chr(10)) - 1}] ...\n"
+            f"{tail}\n"
+            f"[call read_tool_result(handle='{handle}', start_line=...) or (offset=...) to read the rest]"
+        )
+
+    def read(self, handle: str, offset: int = 0, length: int = DEFAULT_PAGE_BYTES,
+             start_line: int = 0, end_line: int = 0) -> Page:
+        """One page of a stored result, by byte range or line range (see file_pager)."""
+        path = self.path(handle)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"tool result '{handle}' no longer exists (evicted), run the tool again")
+        self.reads += 1
+        if start_line > 0:
+            return read_line_range(path, start_line, end_line)
+        return read_byte_range(path, offset, length)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "spilled": self.spilled,
+                "spilled_chars": self.spilled_chars,
+                "reads": self.reads,
+                "disk_bytes": self._total or 0,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _blobs(self) -> list[tuple[float, int, str]]:
+        blobs = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.name.endswith(".txt"):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    blobs.append((st.st_mtime, st.st_size, entry.path))
+        return blobs
+
+    def _load_total(self) -> None:
+        if self._total is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._total = sum(size for _, size, _ in self._blobs())
+
+    def _prune(self, keep: str) -> None:
+        # 其它进程也可能在写同一个目录，以实际扫描结果为准
+        blobs = sorted(self._blobs())
+        self._total = sum(size for _, size, _ in blobs)
+        now = time.time()
+        self._expired_at = now
+        # 按时间从旧到新删：先删过期的，再删到总大小不超过上限
+        cutoff = now - self.ttl_seconds if self.ttl_seconds > 0 else float("-inf")
+        for mtime, size, path in blobs:
+            if self._total <= self.max_bytes and mtime >= cutoff:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self._total -= size
+
+
+def format_result_page(handle: str, page: Page) -> str:
+    """Like file_pager.format_page, with the handle instead of the blob path."""
+    span = f"lines {page.first_line}-{page.last_line}" if page.first_line else f"bytes {page.start}-{page.end}"
+    hint = page_hint(page, "end of result")
+    return f"tool result '{handle}', size: {page.file_size} bytes, {span} ({hint}), content:\n\n{page.text}"
+
+
+# 进程内共享的实例
+tool_results = ToolResultStore()
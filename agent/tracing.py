@@ -0,0 +1,402 @@
+"""
+图执行的计时与追踪
+
+Tracer 是一个 LangChain 回调，挂在编译好的图上（instrument(graph)），记录四类 span：
+- node:       每个节点一次执行（llm_call / tool_node、agent / tools、邮件流程的各节点）
+- superstep:  同一步里所有节点从最早开始到最晚结束
+- llm:        每次模型调用，另记首 token 时间（TTFT，仅流式）和输出 token/s
+- tool:       每次工具调用
+另有 graph span 表示整次 invoke / stream。
+
+每个 span 计入按 (kind, name) 分组的直方图（固定桶，记录是 O(1) 的），可以：
+- TRACE_JSONL=path  把每个 span 追加写成一行 JSON（缓冲写入，退出时刷新）
+- TRACE_PROM_PORT=9464  在该端口提供 Prometheus 文本格式的 /metrics；server.py 也提供 /metrics
+- format_summary() 打印各 span 的次数和 p50 / p95
+
+TRACE=1 开启。关闭时 get_tracer() 返回 None，instrument() 原样返回图，不注册任何回调，没有额外开销。
+回调是 run_inline 的：不经过线程池，只做几次字典操作和一次 perf_counter。
+"""
+
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 秒；覆盖从毫秒级的节点开销到几分钟的长回答
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# token/s 的桶
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense; ``observe`` is a bisect and two adds."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Bucket-interpolated quantile estimate."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1] * 2
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class JSONLExporter:
+    """Append spans to a JSON lines file, buffering ``flush_every`` of them."""
+
+    def __init__(self, path: str, flush_every: int = 256):
+        self.path = path
+        self.flush_every = flush_every
+        self._pending: list[dict] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: dict) -> None:
+        with self._lock:
+            self._pending.append(span)
+            if len(self._pending) < self.flush_every:
+                return
+            pending, self._pending = self._pending, []
+        self._write(pending)
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        self._write(pending)
+
+    def _write(self, spans: list[dict]) -> None:
+        if not spans:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in spans))
+
+
+class Tracer(BaseCallbackHandler):
+    """Callback handler that times graphs, supersteps, nodes, model calls and tool calls.
+
+    Args:
+        exporter: receives every finished span as a dict (see ``JSONLExporter``), optional
+    """
+
+    run_inline = True
+    raise_error = False
+
+    def __init__(self, exporter: Optional[JSONLExporter] = None):
+        self.exporter = exporter
+        self._lock = threading.Lock()
+        # run_id -> (kind, name, start, attrs)
+        self._open: dict[UUID, tuple] = {}
+        # 图的 run_id -> {step: [最早开始, 最晚结束, 节点数]}
+        self._steps: dict[UUID, dict[int, list]] = {}
+        self._first_token: dict[UUID, float] = {}
+        self._token_counts: dict[UUID, int] = {}
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.ttft: dict[str, Histogram] = {}
+        self.token_rate: dict[str, Histogram] = {}
+        self.errors: dict[tuple[str, str], int] = {}
+        self.output_tokens: dict[str, int] = {}
+
+    # ---- 记录 ----
+
+    def _start(self, run_id: UUID, kind: str, name: str, attrs: dict) -> None:
+        self._open[run_id] = (kind, name, time.perf_counter(), attrs)
+
+    def _finish(self, run_id: UUID, error: Optional[BaseException] = None) -> Optional[tuple]:
+        entry = self._open.pop(run_id, None)
+        if entry is None:
+            return None
+        kind, name, start, attrs = entry
+        end = time.perf_counter()
+        self._record(kind, name, start, end, attrs, run_id, error)
+        return kind, name, start, end, attrs
+
+    def _record(self, kind: str, name: str, start: float, end: float, attrs: dict,
+                run_id: Optional[UUID] = None, error: Optional[BaseException] = None) -> None:
+        key = (kind, name)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(end - start)
+            if error is not None:
+                self.errors[key] = self.errors.get(key, 0) + 1
+        if self.exporter is not None:
+            span = {"kind": kind, "name": name, "duration_ms": (end - start) * 1000,
+                    "end_time": time.time(), **attrs}
+            if run_id is not None:
+                span["run_id"] = str(run_id)
+            if error is not None:
+                span["error"] = f"{type(error).__name__}: {error}"
+            self.exporter.export(span)
+
+    # ---- 图与节点 ----
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                       tags: Optional[list] = None, metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        if parent_run_id is None:
+            self._steps[run_id] = {}
+            self._start(run_id, "graph", kwargs.get("name") or "graph", {})
+            return
+        # 节点本身的 run 带 "graph:step:N" 标签；节点内部的 RunnableSequence、条件边等都跳过
+        if not tags or not any(t.startswith("graph:step:") for t in tags):
+            return
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node") or kwargs.get("name") or "node"
+        self._start(run_id, "node", node, {
+            "step": metadata.get("langgraph_step"),
+            "thread_id": metadata.get("thread_id"),
+            "graph_run_id": str(parent_run_id),
+        })
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_chain(run_id, None)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_chain(run_id, error)
+
+    def _end_chain(self, run_id: UUID, error: Optional[BaseException]) -> None:
+        finished = self._finish(run_id, error)
+        if finished is None:
+            return
+        kind, _, start, end, attrs = finished
+        if kind == "node":
+            steps = self._steps.get(UUID(attrs["graph_run_id"]))
+            if steps is not None and attrs["step"] is not None:
+                span = steps.get(attrs["step"])
+                if span is None:
+                    steps[attrs["step"]] = [start, end, 1]
+                else:
+                    span[0] = min(span[0], start)
+                    span[1] = max(span[1], end)
+                    span[2] += 1
+        elif kind == "graph":
+            for step, (step_start, step_end, nodes) in sorted(self._steps.pop(run_id, {}).items()):
+                self._record("superstep", "superstep", step_start, step_end,
+                             {"step": step, "nodes": nodes, "graph_run_id": str(run_id)})
+
+    # ---- 模型调用 ----
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                            metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        self._llm_start(run_id, serialized, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                     metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        self._llm_start(run_id, serialized, metadata)
+
+    def _llm_start(self, run_id: UUID, serialized, metadata: Optional[dict]) -> None:
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name") or ((serialized or {}).get("kwargs") or {}).get("model_name") or "model"
+        self._start(run_id, "llm", model, {
+            "node": metadata.get("langgraph_node"),
+            "step": metadata.get("langgraph_step"),
+            "thread_id": metadata.get("thread_id"),
+        })
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id not in self._first_token:
+            self._first_token[run_id] = time.perf_counter()
+            self._token_counts[run_id] = 0
+        self._token_counts[run_id] += 1
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        first = self._first_token.pop(run_id, None)
+        streamed = self._token_counts.pop(run_id, 0)
+        entry = self._open.get(run_id)
+        if entry is None:
+            return
+        _, model, start, attrs = entry
+        end = time.perf_counter()
+        tokens = _output_tokens(response) or streamed
+        attrs["output_tokens"] = tokens
+        if first is not None:
+            attrs["ttft_ms"] = (first - start) * 1000
+        # 流式时按首 token 之后的时间算生成速度，否则按整个调用
+        gen_time = end - (first if first is not None else start)
+        with self._lock:
+            if first is not None:
+                self.ttft.setdefault(model, Histogram()).observe(first - start)
+            if tokens and gen_time > 0:
+                rate = tokens / gen_time
+                attrs["tokens_per_s"] = rate
+                self.token_rate.setdefault(model, Histogram(RATE_BUCKETS)).observe(rate)
+            self.output_tokens[model] = self.output_tokens.get(model, 0) + tokens
+        self._finish(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._first_token.pop(run_id, None)
+        self._token_counts.pop(run_id, None)
+        self._finish(run_id, error)
+
+    # ---- 工具调用 ----
+
+    def on_tool_start(self, serialized, input_str: str, *, run_id: UUID, parent_run_id: Optional[UUID] = None,
+                      metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        metadata = metadata or {}
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._start(run_id, "tool", name, {
+            "node": metadata.get("langgraph_node"),
+            "step": metadata.get("langgraph_step"),
+            "thread_id": metadata.get("thread_id"),
+        })
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, error)
+
+    # ---- 导出 ----
+
+    def snapshot(self) -> dict:
+        """Per (kind, name): count, total seconds, p50 / p95 estimates, errors."""
+        with self._lock:
+            return {
+                f"{kind}:{name}": {
+                    "count": h.count,
+                    "total_s": h.sum,
+                    "p50_ms": h.quantile(0.5) * 1000,
+                    "p95_ms": h.quantile(0.95) * 1000,
+                    "errors": self.errors.get((kind, name), 0),
+                }
+                for (kind, name), h in sorted(self.histograms.items())
+            }
+
+    def render_prometheus(self) -> str:
+        """All histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines += _prom_histograms("agent_span_duration_seconds", "Duration of graph, superstep, node, llm and tool spans.",
+                                      {(("kind", k), ("name", n)): h for (k, n), h in self.histograms.items()})
+            lines += _prom_histograms("agent_llm_ttft_seconds", "Time to first streamed token of model calls.",
+                                      {(("model", m),): h for m, h in self.ttft.items()})
+            lines += _prom_histograms("agent_llm_output_tokens_per_second", "Output token rate of model calls.",
+                                      {(("model", m),): h for m, h in self.token_rate.items()})
+            lines.append("# HELP agent_llm_output_tokens_total Output tokens produced by model calls.")
+            lines.append("# TYPE agent_llm_output_tokens_total counter")
+            for model, total in sorted(self.output_tokens.items()):
+                lines.append(f'agent_llm_output_tokens_total{{model="{_escape(model)}"}} {total}')
+            lines.append("# HELP agent_span_errors_total Spans that ended with an error.")
+            lines.append("# TYPE agent_span_errors_total counter")
+            for (kind, name), total in sorted(self.errors.items()):
+                lines.append(f'agent_span_errors_total{{kind="{kind}",name="{_escape(name)}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        if self.exporter is not None:
+            self.exporter.flush()
+
+
+def _output_tokens(response) -> int:
+    for generations in getattr(response, "generations", []) or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage and usage.get("output_tokens"):
+                return int(usage["output_tokens"])
+    usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    return int(usage.get("completion_tokens") or 0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prom_histograms(metric: str, help_text: str, histograms: dict) -> list[str]:
+    lines = [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+    for labels, hist in sorted(histograms.items()):
+        label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+        cumulative = 0
+        for bound, count in zip(hist.bounds, hist.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {hist.count}')
+        lines.append(f"{metric}_sum{{{label_text}}} {hist.sum}")
+        lines.append(f"{metric}_count{{{label_text}}} {hist.count}")
+    return lines
+
+
+def format_summary(tracer: "Tracer") -> str:
+    rows = [f"{'span':<40} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'total s':>9}"]
+    for key, s in tracer.snapshot().items():
+        rows.append(f"{key:<40} {s['count']:>7} {s['p50_ms']:>10.1f} {s['p95_ms']:>10.1f} {s['total_s']:>9.2f}")
+    return "\n".join(rows)
+
+
+def serve_prometheus(tracer: "Tracer", port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``GET /metrics`` for ``tracer`` from a daemon thread."""
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            data = tracer.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):  # noqa: A002 - 覆盖基类签名
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="prometheus", daemon=True).start()
+    return server
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def tracing_enabled() -> bool:
+    return os.getenv("TRACE", "").strip().lower() in ("1", "true", "on")
+
+
+def get_tracer() -> Optional[Tracer]:
+    """The process-wide tracer, or None when TRACE is not set."""
+    global _tracer
+    if not tracing_enabled():
+        return None
+    with _tracer_lock:
+        if _tracer is None:
+            path = os.getenv("TRACE_JSONL")
+            _tracer = Tracer(JSONLExporter(path) if path else None)
+            atexit.register(_tracer.flush)
+            port = os.getenv("TRACE_PROM_PORT")
+            if port:
+                serve_prometheus(_tracer, int(port))
+        return _tracer
+
+
+def instrument(graph, tracer: Optional[Tracer] = None):
+    """Attach ``tracer`` (default: the process-wide one) to a compiled graph; no-op when tracing is off."""
+    tracer = tracer or get_tracer()
+    if tracer is None:
+        return graph
+    return graph.with_config(callbacks=[tracer])
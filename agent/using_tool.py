@@ -19,16 +19,14 @@ from langchain.messages import SystemMessage, AnyMessage, ToolMessage
 from typing import Literal
 from langgraph.graph import StateGraph, START, END
 
+from models import get_chat_model
+from tool_executor import ToolExecutor
 
 
 
 
-load_dotenv('../../../.llm_env')
-API_KEY : str= os.getenv("MY_OPENAI_API_KEY") or ""
-BASE_URL = os.getenv("MY_OPENAI_API_BASE")
 
-
-llm = ChatOpenAI(api_key=SecretStr(API_KEY),  base_url=BASE_URL,  model="gpt-4.1",temperature=0)
+llm = get_chat_model(model="gpt-4.1", temperature=0)
 
 
 # Define tools
@@ -69,6 +67,7 @@ def divide(a: int, b: int) -> float:
 tools = [add, multiply, divide]
 tools_by_name = {tool.name: tool for tool in tools}
 model_with_tools = llm.bind_tools(tools)
+tool_executor = ToolExecutor(tools, catch_errors=False)
 
 # Step 2: Define state
 
@@ -101,12 +100,8 @@ def llm_call(state: MessagesState):
 def tool_node(state: MessagesState):
     """Performs the tool call"""
 
-    result = []
-    for tool_call in state["messages"][-1].tool_calls:
-        tool = tools_by_name[tool_call["name"]]
-        observation = tool.invoke(tool_call["args"])
-        result.append(ToolMessage(content=observation, tool_call_id=tool_call["id"]))
-    return {"messages": result}
+    # 多个工具调用并发执行，返回顺序与 tool_calls 一致
+    return {"messages": tool_executor.run(state["messages"][-1].tool_calls)}
 
 # 条件判断
 def should_continue(state: MessagesState) -> Literal["tool_node", END]:
@@ -147,7 +142,7 @@ display(Image(agent.get_graph(xray=True).draw_mermaid_png()))
 # Invoke
 from langchain.messages import HumanMessage
 messages :MessagesState ={"messages":[HumanMessage(content="Add 3 and 4.")], "llm_calls":0} 
-messages = agent.invoke(messages))
+messages = agent.invoke(messages)
 for m in messages["messages"]:
     m.pretty_print()
 
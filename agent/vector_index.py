@@ -0,0 +1,348 @@
+"""
+本地稠密向量检索
+
+BM25 只做关键词匹配，换个说法的问题就找不到。这里把 passage 编码成向量：
+- 向量矩阵以 float32（可选 int8 量化 + 每行缩放系数）写入磁盘，用 np.memmap 加载
+- 查询时分块做批量点积（向量已归一化，即余弦相似度），argpartition 取 top-k
+- 数据量大时先做粗聚类（球面 k-means），行按簇连续存放，查询只扫描最近的 n_probe 个簇
+- Embedder 可替换，默认的 HashingEmbedder 用词和字符 n-gram 做特征哈希，完全离线
+- 每次 build 写一组新文件名（带随机后缀）的数据文件，最后原子替换 meta.json 指向它们，
+  并发的构建或读取（包括其它进程）不会看到混合的新旧文件；已加载的一代数据整体替换
+
+    index = VectorIndex("path/to/index")
+    index.build(texts, ids)
+    index.search("how do I change my password", k=5)  # -> [(id, score), ...]
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import Optional, Protocol, Sequence
+
+import numpy as np
+
+from bm25_index import tokenize
+
+BLOCK_ROWS = 65536
+# 向量数少于这个值时不聚类，直接全量扫描
+CLUSTER_MIN_ROWS = int(os.getenv("VECTOR_CLUSTER_MIN_ROWS", "20000"))
+DEFAULT_N_PROBE = int(os.getenv("VECTOR_N_PROBE", "16"))
+KMEANS_ITERATIONS = 8
+# 没有 meta 指向、又超过这么久没动的数据文件视为其它进程并发构建留下的，可以删除
+ORPHAN_SECONDS = 3600
+_DATA_PREFIXES = ("vectors-", "scales-", "centroids-", "offsets-", "raw-", "meta.json.")
+
+
+class Embedder(Protocol):
+    dim: int
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Return a ``(len(texts), dim)`` float32 array of L2-normalized rows."""
+        ...
+
+
+class HashingEmbedder:
+    """Signed feature hashing of word tokens and character n-grams.
+
+    字符 n-gram 让 "reset" / "resetting" / "resets" 这类变形落到相近的向量上。
+    """
+
+    def __init__(self, dim: int = 256, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def _features(self, text: str) -> list[str]:
+        features = []
+        for token in tokenize(text):
+            features.append(token)
+            padded = f"<{token}>"
+            if len(padded) > self.ngram:
+                features.extend(padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter(
+                (zlib.crc32(f.encode("utf-8")) for f in self._features(text)), dtype=np.uint32
+            )
+            if not len(hashes):
+                continue
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(out[row], hashes % self.dim, signs)
+        # 次线性词频，再做 L2 归一化
+        out = np.sign(out) * np.log1p(np.abs(out))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+
+def _kmeans(sample: np.ndarray, k: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on normalized rows; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = ~sums.any(axis=1)
+        # 空簇重新随机取一个样本，避免簇数塌缩
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+
+# 旧版本 meta.json 没有 "files" 时使用的固定文件名
+_LEGACY_FILES = {"scales": "scales.f32", "centroids": "centroids.f32", "offsets": "offsets.i64"}
+
+
+@dataclass(frozen=True)
+class _Loaded:
+    """One generation of the index; searches hold on to it even if a rebuild swaps it out."""
+    meta: dict = field(default_factory=dict)
+    ids: list = field(default_factory=list)
+    vectors: Optional[np.ndarray] = None
+    scales: Optional[np.ndarray] = None
+    centroids: Optional[np.ndarray] = None
+    offsets: Optional[np.ndarray] = None
+
+
+class VectorIndex:
+    """Dense retrieval over a memory-mapped embedding matrix.
+
+    Files in ``index_dir``（数据文件名带每次构建的后缀，由 meta.json 的 files 指出）:
+        meta.json          维度、行数、是否量化、tag、数据文件名，以及每一行对应的 id
+        vectors-*.f32      (rows, dim) float32；量化时为 vectors-*.i8 + scales-*.f32
+        centroids-*.f32    (clusters, dim) 簇中心；offsets-*.i64 为每个簇在矩阵中的起始行
+    """
+
+    def __init__(self, index_dir: str, embedder: Optional[Embedder] = None):
+        self.index_dir = index_dir
+        self.embedder = embedder or HashingEmbedder()
+        self._loaded = _Loaded()
+        self._build_lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    @property
+    def meta(self) -> dict:
+        return self._loaded.meta
+
+    @property
+    def ids(self) -> list:
+        return self._loaded.ids
+
+    @property
+    def tag(self) -> Optional[str]:
+        return self._loaded.meta.get("tag")
+
+    def __len__(self) -> int:
+        return len(self._loaded.ids)
+
+    # ---- 构建 ----
+
+    def build(
+        self,
+        texts: Sequence[str],
+        ids: Optional[Sequence] = None,
+        *,
+        quantize: bool = False,
+        clusters: Optional[int] = None,
+        tag: Optional[str] = None,
+        batch_size: int = 1024,
+    ) -> None:
+        """Embed ``texts`` and write the index; ``ids`` default to row numbers.
+
+        ``clusters`` defaults to sqrt(rows) above CLUSTER_MIN_ROWS, 0 disables the pre-filter.
+        """
+        with self._build_lock:
+            self._build(texts, ids, quantize, clusters, tag, batch_size)
+
+    def _temp(self, prefix: str, suffix: str) -> str:
+        fd, path = tempfile.mkstemp(dir=self.index_dir, prefix=prefix, suffix=suffix)
+        os.close(fd)
+        return path
+
+    def _build(self, texts, ids, quantize, clusters, tag, batch_size) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+        # 本次构建的文件名后缀，与其它构建（包括其它进程）不冲突
+        generation = uuid.uuid4().hex[:12]
+        written: list[str] = []
+        try:
+            self._write(texts, ids, quantize, clusters, tag, batch_size, generation, written)
+        except BaseException:
+            for path in written:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+    def _write(self, texts, ids, quantize, clusters, tag, batch_size, generation, written) -> None:
+        ids = list(range(len(texts))) if ids is None else list(ids)
+        rows, dim = len(texts), self.embedder.dim
+        # 先按原始顺序写到临时 memmap，大语料不需要整体放进内存
+        raw_path = self._temp("raw-", ".tmp")
+        written.append(raw_path)
+        raw = np.lib.format.open_memmap(raw_path, mode="w+", dtype=np.float32, shape=(max(rows, 1), dim))
+        for start in range(0, rows, batch_size):
+            raw[start:start + batch_size] = self.embedder.embed(texts[start:start + batch_size])
+
+        if clusters is None:
+            clusters = int(np.sqrt(rows)) if rows >= CLUSTER_MIN_ROWS else 0
+        clusters = min(clusters, rows)
+        order = np.arange(rows)
+        offsets = centroids = None
+        if clusters > 1:
+            sample_rows = np.sort(np.random.default_rng(0).choice(rows, size=min(rows, clusters * 64), replace=False))
+            centroids = _kmeans(np.asarray(raw[sample_rows]), clusters)
+            assign = np.empty(rows, dtype=np.int32)
+            for start in range(0, rows, BLOCK_ROWS):
+                assign[start:start + BLOCK_ROWS] = np.argmax(raw[start:start + BLOCK_ROWS] @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            offsets = np.searchsorted(assign[order], np.arange(clusters + 1)).astype(np.int64)
+
+        files = {"vectors": f"vectors-{generation}" + (".i8" if quantize else ".f32")}
+        vectors_path = self._path(files["vectors"])
+        written.append(vectors_path)
+        out = np.memmap(vectors_path, mode="w+", dtype=np.int8 if quantize else np.float32,
+                        shape=(max(rows, 1), dim))
+        scales = np.empty(rows, dtype=np.float32) if quantize else None
+        for start in range(0, rows, BLOCK_ROWS):
+            block = np.asarray(raw[order[start:start + BLOCK_ROWS]])
+            if quantize:
+                scale = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127.0
+                out[start:start + len(block)] = np.round(block / scale[:, None]).astype(np.int8)
+                scales[start:start + len(block)] = scale
+            else:
+                out[start:start + len(block)] = block
+        out.flush()
+        del out, raw
+        os.remove(raw_path)
+
+        extra = []
+        if quantize:
+            extra.append(("scales", f"scales-{generation}.f32", scales))
+        if centroids is not None:
+            extra += [("centroids", f"centroids-{generation}.f32", centroids),
+                      ("offsets", f"offsets-{generation}.i64", offsets)]
+        for key, name, array in extra:
+            files[key] = name
+            written.append(self._path(name))
+            array.tofile(self._path(name))
+
+        meta = {
+            "version": 2, "rows": rows, "dim": dim, "quantized": quantize,
+            "clusters": int(clusters) if centroids is not None else 0,
+            "tag": tag, "files": files, "ids": [ids[i] for i in order.tolist()],
+        }
+        # 数据文件都写完之后才替换 meta.json，之前的读者仍然看到完整的上一代
+        previous = self._read_meta()
+        tmp = self._temp("meta.json.", ".tmp")
+        written.append(tmp)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path("meta.json"))
+        written.clear()   # 从这里开始这些文件就是当前的索引了，失败也不能删
+        self.load()
+
+        # 上一代的数据文件已经没有 meta 指向了；已经映射它们的进程不受删除影响
+        if previous is not None:
+            for name in self._files(previous).values():
+                if name not in files.values() and os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+        self._sweep(set(files.values()))
+
+    def _sweep(self, keep: set) -> None:
+        """Remove stale files of builds that lost a race with another process."""
+        cutoff = time.time() - ORPHAN_SECONDS
+        with os.scandir(self.index_dir) as it:
+            for entry in it:
+                if entry.name.startswith(_DATA_PREFIXES) and entry.name not in keep:
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except OSError:
+                        continue
+
+    # ---- 加载 ----
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self._path("meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _files(meta: dict) -> dict:
+        if "files" in meta:
+            return meta["files"]
+        return dict(_LEGACY_FILES, vectors="vectors.i8" if meta["quantized"] else "vectors.f32")
+
+    def load(self) -> bool:
+        """Map an existing index; False if there is none (or its dimension does not match the embedder)."""
+        meta = self._read_meta()
+        if meta is None or meta["dim"] != self.embedder.dim:
+            return False
+        rows, dim = meta["rows"], meta["dim"]
+        files = self._files(meta)
+        vectors = scales = centroids = offsets = None
+        try:
+            if rows:
+                if meta["quantized"]:
+                    vectors = np.memmap(self._path(files["vectors"]), mode="r", dtype=np.int8, shape=(rows, dim))
+                    scales = np.fromfile(self._path(files["scales"]), dtype=np.float32)
+                else:
+                    vectors = np.memmap(self._path(files["vectors"]), mode="r", dtype=np.float32, shape=(rows, dim))
+            if meta["clusters"]:
+                centroids = np.fromfile(self._path(files["centroids"]), dtype=np.float32).reshape(-1, dim)
+                offsets = np.fromfile(self._path(files["offsets"]), dtype=np.int64)
+        except (OSError, ValueError):
+            # 另一个进程刚好完成了重建并删掉了这一代的文件
+            return False
+        self._loaded = _Loaded(meta, meta["ids"], vectors, scales, centroids, offsets)
+        return True
+
+    # ---- 查询 ----
+
+    @staticmethod
+    def _score_range(loaded: _Loaded, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        scores = np.empty(end - start, dtype=np.float32)
+        for lo in range(start, end, BLOCK_ROWS):
+            hi = min(lo + BLOCK_ROWS, end)
+            if loaded.scales is not None:
+                # int8 行先转回 float32 再点积，再乘回每行的缩放系数
+                scores[lo - start:hi - start] = (loaded.vectors[lo:hi].astype(np.float32) @ query) * loaded.scales[lo:hi]
+            else:
+                scores[lo - start:hi - start] = loaded.vectors[lo:hi] @ query
+        return scores
+
+    def search(self, query: str, k: int = 5, n_probe: int = DEFAULT_N_PROBE,
+               tag: Optional[str] = None) -> list[tuple]:
+        """Top-``k`` ``(id, cosine score)`` pairs for ``query``.
+
+        With ``tag``, returns nothing unless the loaded index was built with that tag.
+        """
+        loaded = self._loaded
+        if loaded.vectors is None or (tag is not None and loaded.meta.get("tag") != tag):
+            return []
+        q = self.embedder.embed([query])[0]
+        if loaded.centroids is not None:
+            n_probe = min(n_probe, len(loaded.centroids))
+            nearest = np.argpartition(-(loaded.centroids @ q), n_probe - 1)[:n_probe]
+            ranges = [(int(loaded.offsets[c]), int(loaded.offsets[c + 1])) for c in nearest]
+        else:
+            ranges = [(0, len(loaded.ids))]
+
+        rows = np.concatenate([np.arange(lo, hi) for lo, hi in ranges if hi > lo] or [np.empty(0, dtype=np.int64)])
+        if not len(rows):
+            return []
+        scores = np.concatenate([self._score_range(loaded, q, lo, hi) for lo, hi in ranges if hi > lo])
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(loaded.ids[int(rows[i])], float(scores[i])) for i in top]